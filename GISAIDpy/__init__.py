@@ -0,0 +1,73 @@
+"""
+GISAIDpy, a Python port of Wytamma's GISAIDR package.
+
+The public functions are importable from the package itself, e.g.
+`from GISAIDpy import download, Query`. Submodules are only imported when one of their names
+is first used, so `import GISAIDpy` loads neither requests, polars nor numpy.
+
+"""
+
+import importlib
+
+__version__ = '0.0.1'
+
+# public name -> submodule defining it
+_EXPORTS = {
+    'download': 'main',
+    'download_bulk': 'main',
+    'process_download': 'main',
+    'MAX_BATCH_SIZE': 'main',
+    'get_accession_ids': 'functions',
+    'select_entries': 'functions',
+    'reset_query': 'functions',
+    'count_query': 'functions',
+    'CommandQueue': 'functions',
+    'Query': 'query',
+    'AccessionIDSet': 'accession',
+    'GISAIDClient': 'client',
+    'get_client': 'client',
+    'set_client': 'client',
+    'RateLimiter': 'ratelimit',
+    'SessionState': 'session',
+    'get_session_state': 'session',
+    'set_session_state': 'session',
+    'SessionExpiredError': 'session',
+    'StalePanelError': 'session',
+    'RecordCache': 'cache',
+    'scan_synced': 'sync',
+    'read_fasta': 'polars_funcs',
+    'scan_fasta': 'polars_funcs',
+    'iter_fasta': 'polars_funcs',
+    'sequence_stats': 'polars_funcs',
+    'sequence_hash': 'polars_funcs',
+    'scan_metadata': 'metadata',
+    'select_metadata': 'metadata',
+    'scan_output': 'output',
+    'deduplicate': 'dedup',
+    'attach_sequences': 'dedup',
+    'pack': 'packed',
+    'unpack': 'packed',
+}
+
+_SUBMODULES = {
+    'accession', 'async_functions', 'cache', 'cli', 'client', 'components', 'constants', 'dedup', 'fasta_index',
+    'functions', 'jobs', 'main', 'metadata', 'output', 'packed', 'polars_funcs', 'polling', 'query',
+    'ratelimit', 'session', 'sync', 'tracing',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+        # cached, so later lookups skip this function
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | _SUBMODULES)
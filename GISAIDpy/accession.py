@@ -0,0 +1,218 @@
+"""
+Script containing a compact set of accession IDs.
+
+`AccessionIDSet` stores every ID as one int64, its database prefix tag in the high bits and its
+number in the low bits, in a sorted NumPy array. A million IDs take 8 MB instead of a Python
+list of strings, and union, intersection and difference are vectorized over the arrays, so
+comparing the IDs of a query with what is already downloaded takes milliseconds.
+
+Example:
+    available = get_accession_ids(credentials, as_set=True)
+    seen = AccessionIDSet.load('seen.npz')
+    download_bulk(credentials, available - seen)
+    (seen | available).save('seen.npz')
+
+"""
+
+import os
+import re
+import numpy as np
+import polars as pl
+
+# prefix -> tag, tried in this order so 'EPI' does not shadow the longer prefixes
+PREFIXES = {'EPI_ISL_': 0, 'EPI_SET_': 1, 'EPI': 2}
+TAG_SHIFT = 48
+NUMBER_MASK = (1 << TAG_SHIFT) - 1
+# no leading zeros, so decoding gives back the exact ID
+ID_PATTERN = r'^(?P<prefix>EPI_ISL_|EPI_SET_|EPI)(?P<number>[1-9][0-9]{0,13}|0)$'
+
+_id_regex = re.compile(ID_PATTERN)
+_TAG_PREFIXES = {tag: prefix for prefix, tag in PREFIXES.items()}
+
+
+def _encode(values):
+    # pl.Series of IDs -> unsorted int64 codes
+    values = values.str.strip_chars()
+    values = values.filter(values.str.len_bytes() > 0)
+    parts = values.str.extract_groups(ID_PATTERN)
+    numbers = parts.struct.field('number')
+    if numbers.null_count():
+        raise ValueError(f"Not an accession ID: {values.filter(numbers.is_null())[0]!r}")
+    tags = parts.struct.field('prefix').replace_strict(PREFIXES, return_dtype=pl.Int64)
+    return (tags.to_numpy() << TAG_SHIFT) | numbers.cast(pl.Int64).to_numpy()
+
+
+def _sorted_unique(codes):
+    # np.unique is far slower than a sort for large int arrays
+    codes = np.sort(codes)
+    if len(codes) > 1:
+        codes = codes[np.concatenate(([True], codes[1:] != codes[:-1]))]
+    return codes
+
+
+def _lines(text):
+    return pl.Series([text], dtype=pl.String).str.split('\n').explode()
+
+
+def _encode_one(accession_id):
+    match = _id_regex.match(accession_id.strip()) if isinstance(accession_id, str) else None
+    if match is None:
+        return None
+    return (PREFIXES[match['prefix']] << TAG_SHIFT) | int(match['number'])
+
+
+def _read_chunks(source, chunk_size):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+    elif hasattr(source, 'read'):
+        yield from iter(lambda: source.read(chunk_size), b'')
+    else:
+        yield from source
+
+
+class AccessionIDSet:
+    """
+    Immutable set of accession IDs such as 'EPI_ISL_402124', kept as sorted int64 codes.
+
+    Iterating yields the IDs as strings, ordered by prefix and number. Slicing returns a
+    smaller set, e.g. `ids[:5000]` for a download batch. The set operators also accept plain
+    iterables of IDs.
+
+    Args:
+        ids (iterable of str | pl.Series | AccessionIDSet): IDs to hold, duplicates are dropped.
+    """
+
+    __slots__ = ('_codes',)
+
+    def __init__(self, ids=()):
+        if isinstance(ids, AccessionIDSet):
+            self._codes = ids._codes
+            return
+        values = ids if isinstance(ids, pl.Series) else pl.Series(list(ids), dtype=pl.String)
+        self._codes = _sorted_unique(_encode(values.cast(pl.String)))
+
+    @classmethod
+    def from_codes(cls, codes, assume_unique=False):
+        """
+        Wraps int64 codes, e.g. from `codes` of another set; sorted and deduplicated unless
+        `assume_unique` says they already are.
+        """
+        ids = cls.__new__(cls)
+        codes = np.asarray(codes, dtype=np.int64)
+        ids._codes = codes if assume_unique else _sorted_unique(codes)
+        return ids
+
+    @classmethod
+    def from_csv(cls, source, chunk_size=1 << 20):
+        """
+        Parses an ID list with one ID per line, such as the selection GISAID exports, without
+        holding its text in memory.
+
+        Args:
+            source (str | file | iterable of bytes): path, binary file, or chunks of the
+                file, e.g. `response.iter_content()` of a streamed download.
+            chunk_size (int): bytes read at a time from a path or file.
+        """
+        blocks, tail = [], b''
+        for chunk in _read_chunks(source, chunk_size):
+            block = tail + chunk
+            end = block.rfind(b'\n') + 1
+            tail = block[end:]
+            if end:
+                blocks.append(_sorted_unique(_encode(_lines(block[:end].decode()))))
+        if tail.strip():
+            blocks.append(_encode(_lines(tail.decode())))
+        return cls.from_codes(np.concatenate(blocks) if blocks else np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a set written by `save`.
+        """
+        with np.load(path) as data:
+            return cls.from_codes(np.cumsum(data['deltas'], dtype=np.int64), assume_unique=True)
+
+    def save(self, path):
+        """
+        Writes the set to `path` as compressed .npz; consecutive IDs differ by small amounts, so
+        storing the differences takes a few bits per ID.
+        """
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, deltas=np.diff(self._codes, prepend=np.int64(0)))
+
+    @property
+    def codes(self):
+        return self._codes
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __contains__(self, accession_id):
+        code = _encode_one(accession_id)
+        if code is None:
+            return False
+        i = np.searchsorted(self._codes, code)
+        return i < len(self._codes) and self._codes[i] == code
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError('AccessionIDSet slices cannot have a step.')
+            return self.from_codes(self._codes[index], assume_unique=True)
+        return self.from_codes(self._codes[[index]], assume_unique=True).to_list()[0]
+
+    def __eq__(self, other):
+        if not isinstance(other, AccessionIDSet):
+            return NotImplemented
+        return np.array_equal(self._codes, other._codes)
+
+    __hash__ = None
+
+    def __repr__(self):
+        head = ', '.join(self[:3].to_list())
+        return f"AccessionIDSet({len(self)} IDs{': ' + head if head else ''}{', ...' if len(self) > 3 else ''})"
+
+    def _codes_of(self, other):
+        return other._codes if isinstance(other, AccessionIDSet) else AccessionIDSet(other)._codes
+
+    def union(self, other):
+        return self.from_codes(np.concatenate([self._codes, self._codes_of(other)]))
+
+    def intersection(self, other):
+        return self.from_codes(np.intersect1d(self._codes, self._codes_of(other), assume_unique=True), assume_unique=True)
+
+    def difference(self, other):
+        return self.from_codes(np.setdiff1d(self._codes, self._codes_of(other), assume_unique=True), assume_unique=True)
+
+    def symmetric_difference(self, other):
+        return self.from_codes(np.setxor1d(self._codes, self._codes_of(other), assume_unique=True), assume_unique=True)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+
+    def to_series(self, name='accession_id'):
+        """
+        Returns the IDs as a polars String Series.
+        """
+        prefixes = pl.Series(self._codes >> TAG_SHIFT).replace_strict(_TAG_PREFIXES, return_dtype=pl.String)
+        return (prefixes + pl.Series(self._codes & NUMBER_MASK).cast(pl.String)).alias(name)
+
+    def to_frame(self, name='accession_id'):
+        return self.to_series(name).to_frame()
+
+    def to_list(self):
+        return self.to_series().to_list()
+
+    def join(self, separator=', '):
+        """
+        Returns the IDs joined into one string, e.g. for the selection panel.
+        """
+        if not len(self):
+            return ''
+        return self.to_series().str.join(separator).item()
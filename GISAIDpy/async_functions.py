@@ -0,0 +1,325 @@
+"""
+asyncio counterparts of the functions in `functions.py` and `main.download`.
+
+Requests are awaitable and the check_async polling yields to the event loop instead of
+sleeping, so many queries and downloads can run concurrently on one loop.
+
+"""
+
+import asyncio
+import contextvars
+import logging
+from .constants import GISAID
+from .client import get_client
+from .polling import get_waiter
+from .functions import (
+    CommandQueue, create_command, format_data_for_request, parse_response, parse_count, extract_first_match, timestamp,
+    queued_commands, search_responses, join_accession_ids, _stream_chunks
+)
+from .components import QUERY_FIELDS, extract_component_ids, extract_field_ids, extract_overlay, extract_download_job
+from .session import get_session_state, StalePanelError
+from .tracing import span, traced, record, current_span, enabled as tracing_enabled
+from .main import MAX_BATCH_SIZE, process_download
+
+
+async def send_request(parameter_string="", data=None, method='GET'):
+    client = get_client()
+    URL = client.frontend_url + '?' + parameter_string
+    if data is None:
+        data = ""
+    logging.debug(f"Sending request:\n Method -> {method}\n URL -> {URL}\n data -> {data[:500]}")
+
+    with span('send_request', method=method):
+        if data and tracing_enabled():
+            record(commands=queued_commands(data))
+        if method == 'GET':
+            response = await client.aget(URL)
+        elif method == 'POST':
+            response = await client.apost(URL, headers=GISAID.HEADERS, data=data)
+        else:
+            raise ValueError(f"Method '{method}' not allowed")
+
+    if response.status_code >= 500:
+        logging.warning(f"An error occurred while trying to {method} {URL}")
+        raise Exception("Server error!")
+
+    return response
+
+
+async def send_queue(sid, wid, pid, commands, mode='ajax'):
+    data = format_data_for_request(sid, wid, pid, {'queue': commands}, timestamp(), mode)
+    response = await send_request(method='POST', data=data)
+    return parse_response(response)
+
+
+async def send_commands(queue):
+    """
+    Awaitable `CommandQueue.send`.
+    """
+    return parse_response(await send_request(method='POST', data=queue.build()))
+
+
+async def load_page(queue, parameter_string, method='GET'):
+    """
+    Awaitable `CommandQueue.load`.
+    """
+    queue.round_trips += 1
+    return await send_request(parameter_string, method=method)
+
+
+@traced('check_async')
+async def check_async(async_id):
+    client = get_client()
+    res = await client.aget(client.url(f"{GISAID.CHECK_ASYNC_PATH}/{async_id}"), params={'_': timestamp()})
+    return res.json()
+
+
+@traced('wait_for_async')
+async def wait_for_async(async_id, ready_key='is_ready', waiter=None):
+    waiter = waiter if waiter is not None else get_waiter()
+    return await waiter.wait_async(async_id, check_async, lambda j: j.get(ready_key))
+
+
+@traced('send_back_cmd')
+async def send_back_cmd(session_id, WID, PID, CID):
+    # send back command to get back to page
+    return await send_queue(session_id, WID, PID, [create_command(wid=WID, pid=PID, cid=CID, cmd='Back', params={})])
+
+
+@traced('reset_query')
+async def reset_query(credentials):
+    command = create_command(
+        wid=credentials['wid'],
+        pid=credentials['pid'],
+        cid=credentials['search_cid'],
+        cmd='Reset'
+    )
+    data = format_data_for_request(
+        sid=credentials['sid'],
+        wid=credentials['wid'],
+        pid=credentials['pid'],
+        queue={'queue': [command]},
+        timestamp=timestamp()
+    )
+    return await send_request(method='POST', data=data)
+
+
+async def _open_panel(session_id, WID, PID, CID, cmd):
+    response_data = await send_queue(session_id, WID, PID, [create_command(wid=WID, pid=PID, cid=CID, cmd=cmd, params={})])
+    logging.debug(f"{cmd} panel (response_data): {response_data}")
+    panel = response_data['responses'][0]['data'].split("'")
+    return {'pid': panel[3], 'wid': panel[1]}
+
+
+@traced('get_download_panel')
+async def get_download_panel(session_id, WID, customSearch_page_ID, query_cid):
+    return await _open_panel(session_id, WID, customSearch_page_ID, query_cid, 'DownloadAllSequences')
+
+
+@traced('get_selection_panel')
+async def get_selection_panel(session_id, WID, customSearch_page_ID, query_cid):
+    return await _open_panel(session_id, WID, customSearch_page_ID, query_cid, 'Selection')
+
+
+async def open_selection_panel(credentials, state=None):
+    state = state if state is not None else get_session_state()
+    selection_pid_wid = state.get(credentials['sid'], 'selection')
+    if selection_pid_wid is None:
+        selection_pid_wid = await get_selection_panel(credentials['sid'], credentials['wid'], credentials['pid'], credentials['query_cid'])
+        # Load panel
+        await send_request(f"sid={credentials['sid']}&pid={selection_pid_wid['pid']}")
+        state.set(credentials['sid'], 'selection', selection_pid_wid)
+    return selection_pid_wid
+
+
+async def open_download_panel(credentials, state=None):
+    state = state if state is not None else get_session_state()
+    panel = state.get(credentials['sid'], 'download')
+    if panel is None:
+        panel = await get_download_panel(credentials['sid'], credentials['wid'], credentials['pid'], credentials['query_cid'])
+        download_page = await send_request(f"sid={credentials['sid']}&pid={panel['pid']}")
+        ids = extract_component_ids(download_page.text, credentials['database'], ['download_selection', 'format_radio'])
+        if ids['download_selection'] is None:
+            raise StalePanelError('Could not find the download selection component on the download panel.')
+        panel['cid'], panel['ceid'] = ids['download_selection'], ids['format_radio']
+        state.set(credentials['sid'], 'download', panel)
+    return panel
+
+
+@traced('get_accession_ids')
+async def get_accession_ids(credentials, state=None, as_set=False):
+    state = state if state is not None else get_session_state()
+    ids = await state.run_async(credentials['sid'], _get_accession_ids, credentials, state)
+    return ids if as_set else ids.to_frame()
+
+
+async def _get_accession_ids(credentials, state):
+    from .accession import AccessionIDSet
+
+    j = await send_queue(credentials['sid'], credentials['wid'], credentials['pid'], [
+        create_command(
+            wid=credentials['wid'],
+            pid=credentials['pid'],
+            cid=credentials['query_cid'],
+            cmd='CallAsync',
+            params={'col_name': 'c', 'checked': True, '_async_cmd': 'SelectAll'}
+        )
+    ])
+    j = await wait_for_async(j['callback_response']['async_id'], '__ready__')
+    logging.debug(j)
+
+    selection_pid_wid = await open_selection_panel(credentials, state)
+
+    j = await send_queue(credentials['sid'], credentials['wid'], credentials['pid'], [
+        create_command(
+            wid=selection_pid_wid['wid'],
+            pid=selection_pid_wid['pid'],
+            cid=credentials['selection_panel_cid'],
+            cmd='Download',
+            params={}
+        )
+    ])
+    url = extract_first_match(r"sys.downloadFile\(\"(.*)\",", j['responses'][0]['data'])
+    # streamed like the sync path, the blocking reads and the parsing run on the default executor
+    client = get_client()
+    response = await client.aget(client.url(url), stream=True)
+    with response:
+        response.raise_for_status()
+        ids = await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, AccessionIDSet.from_csv, _stream_chunks(response)
+        )
+
+    await send_back_cmd(credentials['sid'], selection_pid_wid['wid'], selection_pid_wid['pid'], credentials['selection_panel_cid'])
+    await reset_query(credentials)
+    return ids
+
+
+@traced('select_entries')
+async def select_entries(credentials, list_of_accession_ids, state=None):
+    state = state if state is not None else get_session_state()
+    return await state.run_async(credentials['sid'], _select_entries, credentials, list_of_accession_ids, state)
+
+
+async def _select_entries(credentials, list_of_accession_ids, state):
+    accession_ids_string = join_accession_ids(list_of_accession_ids)
+
+    selection_pid_wid = await open_selection_panel(credentials, state)
+
+    wid, pid, cid, ceid = selection_pid_wid['wid'], selection_pid_wid['pid'], credentials['selection_panel_cid'], credentials['selection_ceid']
+    response_data = await send_queue(credentials['sid'], wid, pid, [
+        create_command(wid, pid, cid, 'setTarget', {'cvalue': accession_ids_string, 'ceid': ceid}, f"ST{ceid}"),
+        create_command(wid, pid, cid, 'ChangeValue', {'cvalue': accession_ids_string, 'ceid': ceid}, f"CV{ceid}"),
+        create_command(wid, pid, cid, 'OK', {}),
+    ])
+    logging.debug(response_data)
+
+    if 'Back' in response_data['responses'][1]['data']:
+        await send_back_cmd(credentials['sid'], wid, pid, cid)
+
+    return response_data
+
+
+async def open_query_fields(credentials, state=None):
+    state = state if state is not None else get_session_state()
+    field_ids = state.get(credentials['sid'], 'query')
+    if field_ids is None:
+        search_page = await send_request(f"sid={credentials['sid']}&pid={credentials['pid']}")
+        filters = QUERY_FIELDS.get(credentials['database'], QUERY_FIELDS['EpiCoV'])
+        field_ids = extract_field_ids(search_page.text, credentials['database'], filters)
+        state.set(credentials['sid'], 'query', field_ids)
+    return field_ids
+
+
+@traced('count_query')
+async def count_query(credentials, query, state=None):
+    state = state if state is not None else get_session_state()
+    return await state.run_async(credentials['sid'], _count_query, credentials, query, state)
+
+
+async def _count_query(credentials, query, state):
+    field_ids = await open_query_fields(credentials, state)
+    sid, wid, pid = credentials['sid'], credentials['wid'], credentials['pid']
+    await send_queue(sid, wid, pid, query.commands(credentials, field_ids))
+
+    command = create_command(wid, pid, credentials['query_cid'], 'GetData', {'start_index': 0, 'rows_per_page': 1, 'sorting': ''})
+    data = format_data_for_request(sid, wid, pid, {'queue': [command]}, timestamp())
+    total = parse_count(await send_request(data))
+    logging.debug(f"{query} matches {total} records")
+    return total
+
+
+@traced('download')
+async def download(credentials, list_of_accession_ids, get_sequence=True, clean_up=True, work_dir=None, progress=None,
+                   cache=None, output=None, output_format='parquet', state=None, columns=None, predicate=None,
+                   packed=False, content_hash=False, dedupe=False, parse_dates=False):
+    """
+    Awaitable version of `main.download`, see there for the arguments.
+    """
+    if len(list_of_accession_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'Can only download a maximum of {MAX_BATCH_SIZE} samples at a time, use download_bulk for more.')
+    elif len(list_of_accession_ids) == 0:
+        raise ValueError('Select at least one sequence!')
+
+    if cache is not None:
+        if output is not None:
+            raise ValueError('cache and output cannot be combined.')
+        if columns is not None or predicate is not None or packed or content_hash or dedupe or parse_dates:
+            raise ValueError(
+                'cache only stores complete records and cannot be combined with columns, predicate, packed, '
+                'content_hash, dedupe or parse_dates.'
+            )
+        import polars as pl
+
+        cached, missing = cache.get(list_of_accession_ids, get_sequence)
+        if not missing:
+            return cached
+        df = await download(credentials, missing, get_sequence, clean_up, work_dir, progress, state=state)
+        cache.put(df)
+        return df if cached is None else pl.concat([cached, df], how='diagonal_relaxed')
+
+    state = state if state is not None else get_session_state()
+    download_url = await state.run_async(credentials['sid'], _prepare_download, credentials, list_of_accession_ids, state)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, contextvars.copy_context().run, process_download, credentials, download_url, list_of_accession_ids,
+        get_sequence, clean_up, work_dir, progress, output, output_format, columns, predicate, packed,
+        content_hash, dedupe, parse_dates
+    )
+
+
+async def _prepare_download(credentials, list_of_accession_ids, state):
+    await select_entries(credentials=credentials, list_of_accession_ids=list_of_accession_ids, state=state)
+
+    sid = credentials['sid']
+    panel = await open_download_panel(credentials, state)
+    credentials['download_panel_cid'] = panel['cid']
+    queue = CommandQueue(sid, panel['wid'], panel['pid'])
+
+    queue.set_value(panel['cid'], panel['ceid'], 'augur_input', 'FormatChange').add(panel['cid'], 'DownloadReminder')
+    overlay = search_responses(await send_commands(queue), extract_overlay)
+    if overlay is None:
+        raise StalePanelError('Could not find the download reminder overlay.')
+    wid, pid = overlay['wid'], overlay['pid']
+
+    agreement_page = await load_page(queue, f"sid={sid}&pid={pid}&wid={wid}&mode=page", method="POST")
+    ids = extract_component_ids(agreement_page.text, credentials['database'], ['reminder_buttons', 'agree_checkbox'])
+    cid = credentials['download_panel_cid'] = ids['reminder_buttons']
+
+    queue.target(wid, pid).set_value(cid, ids['agree_checkbox'], ['agreed'], 'Agreed').add(cid, 'Download')
+    try:
+        check_async_id = search_responses(await send_commands(queue), extract_download_job)
+        if check_async_id is None:
+            raise Exception('Could not find the download job.')
+        await wait_for_async(check_async_id, 'is_ready')
+
+        queue.target(credentials['wid'], credentials['pid']).add(credentials['query_cid'], 'generateDownloadDone')
+        j = await send_commands(queue)
+    except StalePanelError as e:
+        # Download has been sent, retrying would start a second compression job
+        raise Exception(f"Download failed after the download job was started: {e}") from e
+
+    logging.debug(f"Download prepared in {queue.round_trips} round trips after selecting entries")
+    if current_span() is not None:
+        current_span().attributes['round_trips'] = queue.round_trips
+    return get_client().url(j['responses'][0]['data'].split('"')[1])
@@ -0,0 +1,212 @@
+"""
+Script containing a local on-disk cache of downloaded GISAID records keyed by accession ID.
+
+Records are stored as content-addressed Parquet partitions (named after the hash of their
+contents) with a Parquet index mapping each accession ID to the partition holding it.
+
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import polars as pl
+from .accession import AccessionIDSet
+
+INDEX_SCHEMA = {'accession_id': pl.Utf8, 'partition': pl.Utf8, 'added': pl.Float64}
+
+
+class RecordCache:
+    """
+    On-disk cache of download() results with size-based LRU eviction and an optional TTL.
+
+    Lookups only note access times in memory; they are written with the next `put`, `evict`
+    or `clear`, or by `close`, which a `with RecordCache(...)` block calls on exit.
+
+    Args:
+        path (str): directory holding the cache, created when missing.
+        max_bytes (int): evict least recently used partitions once the cache grows past this.
+        ttl (float): seconds after which a cached record is considered stale, None keeps forever.
+    """
+
+    def __init__(self, path, max_bytes=None, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._accessed = False
+        os.makedirs(os.path.join(path, 'partitions'), exist_ok=True)
+        self._index = self._load_index()
+        self._partitions = self._load_partitions()
+
+    @property
+    def _index_file(self):
+        return os.path.join(self.path, 'index.parquet')
+
+    @property
+    def _partitions_file(self):
+        return os.path.join(self.path, 'partitions.json')
+
+    def _partition_file(self, partition):
+        return os.path.join(self.path, 'partitions', f"{partition}.parquet")
+
+    def _load_index(self):
+        if os.path.exists(self._index_file):
+            return pl.read_parquet(self._index_file)
+        return pl.DataFrame(schema=INDEX_SCHEMA)
+
+    def _load_partitions(self):
+        if os.path.exists(self._partitions_file):
+            with open(self._partitions_file) as f:
+                return json.load(f)
+        return {}
+
+    def _save_partitions(self):
+        tmp = self._partitions_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._partitions, f)
+        os.replace(tmp, self._partitions_file)
+        self._accessed = False
+
+    def _save(self):
+        tmp = self._index_file + '.tmp'
+        self._index.write_parquet(tmp)
+        os.replace(tmp, self._index_file)
+        self._save_partitions()
+
+    def _live_index(self):
+        if self.ttl is None:
+            return self._index
+        return self._index.filter(pl.col('added') >= time.time() - self.ttl)
+
+    def get(self, accession_ids, get_sequence=True):
+        """
+        Looks up `accession_ids` in the cache.
+
+        Returns:
+            tuple of (pl.DataFrame of the cached records or None, list of the accession IDs
+            that still have to be downloaded, an AccessionIDSet if `accession_ids` is one).
+        """
+        if not isinstance(accession_ids, AccessionIDSet):
+            accession_ids = list(dict.fromkeys(accession_ids))
+        with self._lock:
+            if isinstance(accession_ids, AccessionIDSet):
+                hits = self._live_index().join(accession_ids.to_frame(), on='accession_id', how='semi')
+            else:
+                hits = self._live_index().filter(pl.col('accession_id').is_in(accession_ids))
+            if get_sequence:
+                with_sequence = [p for p, info in self._partitions.items() if info['has_sequence']]
+                hits = hits.filter(pl.col('partition').is_in(with_sequence))
+            if hits.height == 0:
+                return None, accession_ids
+
+            partitions = hits['partition'].unique().to_list()
+            now = time.time()
+            for partition in partitions:
+                self._partitions[partition]['last_access'] = now
+            self._accessed = True
+
+            frames = [
+                pl.scan_parquet(self._partition_file(partition))
+                .join(hits.lazy().filter(pl.col('partition') == partition).select('accession_id'), on='accession_id')
+                for partition in partitions
+            ]
+            cached = pl.concat(frames, how='diagonal_relaxed').collect()
+
+        if not get_sequence and 'sequence' in cached.columns:
+            cached = cached.drop('sequence')
+        if isinstance(accession_ids, AccessionIDSet):
+            return cached, accession_ids - AccessionIDSet(hits['accession_id'])
+        found = set(hits['accession_id'].to_list())
+        return cached, [accession_id for accession_id in accession_ids if accession_id not in found]
+
+    def put(self, df):
+        """
+        Adds the records of a download() result, replacing older copies of the same accession IDs.
+        """
+        if df.height == 0:
+            return None
+        buffer = io.BytesIO()
+        df.write_parquet(buffer)
+        content = buffer.getvalue()
+        partition = hashlib.sha256(content).hexdigest()
+
+        with self._lock:
+            if partition not in self._partitions:
+                tmp = self._partition_file(partition) + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp, self._partition_file(partition))
+
+            now = time.time()
+            self._partitions[partition] = {
+                'bytes': len(content),
+                'last_access': now,
+                'has_sequence': 'sequence' in df.columns,
+            }
+            new_index = pl.DataFrame({
+                'accession_id': df['accession_id'].unique(),
+            }).with_columns(pl.lit(partition).alias('partition'), pl.lit(now).alias('added'))
+            self._index = pl.concat([
+                self._index.filter(~pl.col('accession_id').is_in(new_index['accession_id'].to_list())),
+                new_index,
+            ])
+            self._evict()
+            self._save()
+        return partition
+
+    def _drop_partitions(self, partitions):
+        for partition in partitions:
+            self._partitions.pop(partition, None)
+            if os.path.exists(self._partition_file(partition)):
+                os.remove(self._partition_file(partition))
+        self._index = self._index.filter(~pl.col('partition').is_in(list(partitions)))
+
+    def _evict(self):
+        # partitions whose records were all superseded or have expired
+        referenced = set(self._live_index()['partition'].unique().to_list())
+        self._drop_partitions([p for p in self._partitions if p not in referenced])
+
+        if self.max_bytes is None:
+            return
+        total = sum(info['bytes'] for info in self._partitions.values())
+        by_age = sorted(self._partitions, key=lambda p: self._partitions[p]['last_access'])
+        evicted = []
+        for partition in by_age:
+            if total <= self.max_bytes:
+                break
+            total -= self._partitions[partition]['bytes']
+            evicted.append(partition)
+        self._drop_partitions(evicted)
+
+    def evict(self):
+        """
+        Drops expired and superseded records, then least recently used partitions over max_bytes.
+        """
+        with self._lock:
+            self._evict()
+            self._save()
+
+    def close(self):
+        """
+        Writes the access times noted by lookups since the last write.
+        """
+        with self._lock:
+            if self._accessed:
+                self._save_partitions()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def size(self):
+        return sum(info['bytes'] for info in self._partitions.values())
+
+    def clear(self):
+        with self._lock:
+            self._drop_partitions(list(self._partitions))
+            self._save()
@@ -0,0 +1,107 @@
+"""
+Script containing the `gisaidpy` command line interface.
+
+Commands take the logged in session as a JSON file holding the credentials dict
+(sid, wid, pid, query_cid, search_cid, selection_panel_cid, selection_ceid, database).
+
+Example:
+    gisaidpy download --credentials session.json --ids ids.txt --output data/
+    gisaidpy run manifest.json --workers 4
+
+"""
+
+import json
+import logging
+import os
+import time
+import click
+from . import __version__
+from .main import MAX_BATCH_SIZE
+
+
+@click.group()
+@click.version_option(__version__, prog_name='gisaidpy')
+@click.option('-v', '--verbose', count=True, help='log more, repeat for debug output.')
+def cli(verbose):
+    """
+    Download data from GISAID.
+    """
+    logging.basicConfig(level=[logging.WARNING, logging.INFO, logging.DEBUG][min(verbose, 2)])
+
+
+@cli.command()
+@click.option('--credentials', type=click.Path(exists=True, dir_okay=False), required=True,
+              help='JSON file with the credentials of a logged in session.')
+@click.option('--ids', 'ids_file', type=click.Path(exists=True, dir_okay=False), required=True,
+              help='file of accession IDs, one per line.')
+@click.option('--output', type=click.Path(file_okay=False), required=True, help='directory to write the records to.')
+@click.option('--format', 'output_format', type=click.Choice(['parquet', 'ipc']), default='parquet', show_default=True)
+@click.option('--no-sequence', is_flag=True, help='only download the metadata.')
+@click.option('--batch-size', type=click.IntRange(1, MAX_BATCH_SIZE), default=MAX_BATCH_SIZE, show_default=True)
+def download(credentials, ids_file, output, output_format, no_sequence, batch_size):
+    """
+    Download the records of a list of accession IDs.
+    """
+    from .main import download_bulk
+    from .jobs import load_credentials, read_accession_ids
+
+    try:
+        sessions = load_credentials(credentials)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--credentials')
+    ids = read_accession_ids(ids_file)
+    if not ids:
+        raise click.BadParameter(f"{ids_file} holds no accession IDs.", param_hint='--ids')
+    lf = download_bulk(
+        sessions, ids, get_sequence=not no_sequence, batch_size=batch_size, output=output, output_format=output_format
+    )
+    rows = lf.select('accession_id').collect().height
+    click.echo(f"Downloaded {rows} of {len(ids)} records into {output}")
+
+
+def _echo_event(event):
+    name = event['job']
+    if event['kind'] == 'query':
+        click.echo(f"[{name}] query matches {event['total']} records")
+    elif event['kind'] == 'start':
+        click.echo(f"[{name}] downloading {event['ids']} accession IDs")
+    elif event['kind'] == 'batch':
+        click.echo(f"[{name}] batch {event['done']}/{event['total']}")
+    elif event['status'] == 'ok':
+        click.echo(f"[{name}] done, {event['records']} records in {event['seconds']:.1f}s")
+    else:
+        click.echo(f"[{name}] failed after {event['seconds']:.1f}s: {event.get('error')}", err=True)
+
+
+@cli.command()
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', type=click.IntRange(1), help="worker processes, the manifest's `workers` by default.")
+@click.option('--force', is_flag=True, help='rerun jobs that finished in an earlier run.')
+@click.pass_context
+def run(ctx, manifest, workers, force):
+    """
+    Run the download jobs of a manifest, see `GISAIDpy.jobs` for its format.
+
+    Exits with status 1 when a job failed; running the manifest again resumes the failed jobs.
+    """
+    from .jobs import load_manifest, run_manifest, format_summary
+
+    try:
+        loaded = load_manifest(manifest)
+    except (OSError, ValueError) as e:
+        raise click.ClickException(f"Invalid manifest: {e}")
+
+    start = time.perf_counter()
+    results = run_manifest(loaded, workers, force, on_event=_echo_event)
+    elapsed = time.perf_counter() - start
+
+    click.echo(format_summary(results, elapsed))
+    os.makedirs(loaded['output'], exist_ok=True)
+    with open(os.path.join(loaded['output'], 'summary.json'), 'w') as f:
+        json.dump({'seconds': elapsed, 'jobs': results}, f, indent=2)
+    if any(r['status'] == 'failed' for r in results):
+        ctx.exit(1)
+
+
+def main():
+    cli()
@@ -0,0 +1,255 @@
+"""
+Script containing the pooled HTTP client used for all traffic to GISAID.
+
+"""
+
+import contextvars
+import functools
+import logging
+import random
+import re
+import threading
+import time
+import urllib.parse
+from .constants import GISAID
+from .ratelimit import RateLimiter, parse_retry_after
+from . import tracing
+
+_SID_PATTERN = re.compile(r'(?:^|&)sid=([^&]*)')
+# methods that can be sent twice without a second effect
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+class GISAIDClient:
+    """
+    Owns a pooled `requests.Session` so consecutive commands reuse one keep-alive connection,
+    and retries server errors and dropped connections with exponential backoff and jitter.
+    Every request first waits for the `limiter`, and a 429/503 with Retry-After pauses it.
+
+    A POST may already have taken effect when it times out or fails, e.g. started a download
+    job, so it is only retried when the server never saw it: the connection could not be
+    opened, or it was turned away with 429 or 503 and a Retry-After header. Pass
+    `idempotent=True` to `request` to retry one like a GET.
+
+    Args:
+        base_url (str): scheme and host of the GISAID instance.
+        timeout (float | tuple): connect/read timeout passed to every request.
+        retries (int): number of retries after the first attempt.
+        backoff_factor (float): base delay in seconds, doubled on every retry.
+        backoff_max (float): upper bound on a single backoff delay.
+        pool_maxsize (int): connections kept open per host.
+        session (requests.Session): use an existing session instead of creating one.
+        limiter (RateLimiter): rate and concurrency limits per session and host, a
+            `RateLimiter()` with the default limits when None; False sends unlimited.
+    """
+
+    def __init__(self, base_url=GISAID.BASE_URL, timeout=(10, 300), retries=3, backoff_factor=0.5,
+                 backoff_max=30, pool_maxsize=10, session=None, limiter=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.limiter = RateLimiter() if limiter is None else limiter
+
+        # imported on first use, processes that never talk to GISAID do not pay for requests
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.retry_exceptions = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+        self.connect_timeout = requests.exceptions.ConnectTimeout
+        self.session = session if session is not None else requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @property
+    def frontend_url(self):
+        return self.base_url + GISAID.FRONTEND_PATH
+
+    def url(self, path):
+        return self.base_url + '/' + path.lstrip('/')
+
+    def backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    def _limit_keys(self, url, data):
+        # host and, when the request names one, session whose limits the request counts against
+        parts = urllib.parse.urlsplit(url)
+        match = _SID_PATTERN.search(parts.query) or (_SID_PATTERN.search(data) if isinstance(data, str) else None)
+        return parts.netloc, match.group(1) if match else None
+
+    def _send(self, method, url, kwargs):
+        response = self.session.request(method, url, **kwargs)
+        if tracing.enabled():
+            self._trace(kwargs, response)
+        return response
+
+    @staticmethod
+    def _hold(permit, response, stream):
+        # a streamed body is read after request returns, so its slot is kept until the response closes
+        if permit is None:
+            return
+        if not stream:
+            permit.release()
+            return
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                permit.release()
+        response.close = close_and_release
+
+    def _not_sent(self, error):
+        # a refused or timed out connection means the server never saw the request
+        if isinstance(error, self.connect_timeout):
+            return True
+        from urllib3.exceptions import NewConnectionError
+
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _retry_delay(self, attempt, method, url, keys, idempotent, response=None, error=None):
+        """
+        Returns the seconds to wait before retrying, or None when `response` is final. Re-raises
+        `error` after the last attempt, or when a request that is not idempotent may have been sent.
+        """
+        if error is not None:
+            if attempt == self.retries or not (idempotent or self._not_sent(error)):
+                raise error
+            logging.debug(f"{method} {url} failed ({error}), retrying")
+            return self.backoff(attempt)
+        retry_after = None
+        if response.status_code in (429, 503):
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None and self.limiter:
+                self.limiter.pause(*keys, seconds=retry_after)
+        if idempotent:
+            final = response.status_code < 500 and response.status_code != 429
+        else:
+            # only a request turned away before it was processed is safe to send again
+            final = retry_after is None
+        if attempt == self.retries or final:
+            return None
+        logging.debug(f"{method} {url} returned {response.status_code}, retrying")
+        response.close()
+        if retry_after is None:
+            return self.backoff(attempt)
+        # the paused limiter holds the retry back
+        return 0 if self.limiter else retry_after
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        Sends a request through the limiter and retries it, see the class docstring.
+
+        Args:
+            idempotent (bool): whether the request can safely be sent twice, by default True for
+                GET, HEAD, OPTIONS, PUT and DELETE.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        keys = self._limit_keys(url, kwargs.get('data'))
+        for attempt in range(self.retries + 1):
+            permit = self.limiter.acquire(*keys) if self.limiter else None
+            try:
+                response = self._send(method, url, kwargs)
+            except self.retry_exceptions as e:
+                if permit is not None:
+                    permit.release()
+                delay = self._retry_delay(attempt, method, url, keys, idempotent, error=e)
+            except BaseException:
+                if permit is not None:
+                    permit.release()
+                raise
+            else:
+                self._hold(permit, response, kwargs.get('stream'))
+                delay = self._retry_delay(attempt, method, url, keys, idempotent, response)
+                if delay is None:
+                    return response
+            time.sleep(delay)
+
+    @staticmethod
+    def _trace(kwargs, response):
+        data = kwargs.get('data')
+        sent = len(data) if isinstance(data, (str, bytes)) else 0
+        # streamed bodies are counted by whoever reads them, see fetch_file
+        received = 0 if kwargs.get('stream') else len(response.content)
+        tracing.record(requests=1, bytes_sent=sent, bytes_received=received)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    async def arequest(self, method, url, idempotent=None, **kwargs):
+        """
+        Awaitable `request`; the blocking call runs on the event loop's default executor so
+        many requests can be in flight on a single loop while sharing the connection pool.
+        Waits for the rate limiter and retries happen on the loop, not in executor threads.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        keys = self._limit_keys(url, kwargs.get('data'))
+        for attempt in range(self.retries + 1):
+            permit = await self.limiter.acquire_async(*keys) if self.limiter else None
+            # run in a copy of the caller's context so the request is counted in the caller's span
+            call = functools.partial(contextvars.copy_context().run, self._send, method, url, kwargs)
+            try:
+                response = await loop.run_in_executor(None, call)
+            except self.retry_exceptions as e:
+                if permit is not None:
+                    permit.release()
+                delay = self._retry_delay(attempt, method, url, keys, idempotent, error=e)
+            except BaseException:
+                if permit is not None:
+                    permit.release()
+                raise
+            else:
+                self._hold(permit, response, kwargs.get('stream'))
+                delay = self._retry_delay(attempt, method, url, keys, idempotent, response)
+                if delay is None:
+                    return response
+            await asyncio.sleep(delay)
+
+    async def aget(self, url, **kwargs):
+        return await self.arequest('GET', url, **kwargs)
+
+    async def apost(self, url, data=None, **kwargs):
+        return await self.arequest('POST', url, data=data, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the process wide client, creating it on first use.
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = GISAIDClient()
+    return _default_client
+
+
+def set_client(client):
+    """
+    Replaces the process wide client, e.g. to change timeouts or point at another host.
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
@@ -0,0 +1,117 @@
+"""
+Script containing the extraction of component IDs from GISAID panel pages.
+
+Panel pages declare their components as `sys.createComponent('<cid>','<Name>',...)` and their
+form inputs as `sys.createFI('<ceid>','<Name>',...)`. Rather than searching the page once per
+name, `extract_components` collects every declaration in a single pass of one precompiled
+pattern, and `COMPONENTS` maps the roles GISAIDpy needs to each database's component names.
+
+Search filters are form inputs of the search panel named after the field they filter, as in
+`sys.createFI('<ceid>','EntryWidget','covv_location',...)`; `QUERY_FIELDS` maps the filters of
+`query.Query` to those field names.
+
+"""
+
+import re
+
+# createComponent('<cid>','<Name>' and createFI('<ceid>','<Name>'; the literal prefix lets re skip ahead quickly
+COMPONENT_PATTERN = re.compile(r"create(?:Component|FI)\('([^',]{5,20})','(\w+)'")
+FIELD_PATTERN = re.compile(r"createFI\('([^',]{5,20})','\w+','(\w+)'")
+OVERLAY_PATTERN = re.compile(r"sys\.openOverlay\('([^',]{5,20})','([^',]{5,20})',new Object")
+DOWNLOAD_JOB_PATTERN = re.compile(r"sys\.call\('[^',]*','([^',]+)','generateDownloadDone'")
+
+COMPONENTS = {
+    'EpiCoV': {
+        'download_selection': 'DownloadSelectionComponent',
+        'format_radio': 'RadiobuttonWidget',
+        'reminder_buttons': 'Corona2020DownloadReminderButtonsComponent',
+        'agree_checkbox': 'CheckboxWidget',
+    },
+    'EpiRSV': {
+        'download_selection': 'RSVDownloadSelectionComponent',
+        'format_radio': 'RadiobuttonWidget',
+        'reminder_buttons': 'Corona2020DownloadReminderButtonsComponent',
+        'agree_checkbox': 'CheckboxWidget',
+    },
+    'EpiPox': {
+        'download_selection': 'MPoxDownloadSelectionComponent',
+        'format_radio': 'RadiobuttonWidget',
+        'reminder_buttons': 'Corona2020DownloadReminderButtonsComponent',
+        'agree_checkbox': 'CheckboxWidget',
+    },
+}
+
+QUERY_FIELDS = {
+    'EpiCoV': {
+        'virus_name': 'covv_virus_name',
+        'location': 'covv_location',
+        'lineage': 'pangolin_lineage',
+        'variant': 'covv_variants',
+        'collection_date_from': 'covv_collection_date_from',
+        'collection_date_to': 'covv_collection_date_to',
+        'submission_date_from': 'covv_subm_date_from',
+        'submission_date_to': 'covv_subm_date_to',
+        # one checkbox field, checked with 'complete', 'highq' and/or 'lowco'
+        'quality': 'quality',
+    },
+}
+
+
+def extract_components(text):
+    """
+    Returns a dict of component name to the ID of its first declaration in `text`.
+    """
+    components = {}
+    for match in COMPONENT_PATTERN.finditer(text):
+        components.setdefault(match.group(2), match.group(1))
+    return components
+
+
+def extract_component_ids(text, database, roles):
+    """
+    Looks up the IDs of `roles` (keys of COMPONENTS) on a page of `database`.
+
+    Args:
+        text (str): panel page HTML.
+        database (str): 'EpiCoV', 'EpiRSV' or 'EpiPox'.
+        roles (list of str): roles to look up.
+
+    Returns:
+        dict of role to ID, None for components missing from the page.
+    """
+    names = COMPONENTS.get(database, COMPONENTS['EpiCoV'])
+    components = extract_components(text)
+    return {role: components.get(names[role]) for role in roles}
+
+
+def extract_field_ids(text, database, filters):
+    """
+    Looks up the ceids of the search `filters` (keys of QUERY_FIELDS) on the search panel of
+    `database`, in a single pass over the page.
+
+    Returns:
+        dict of filter to ceid, None for fields missing from the page.
+    """
+    names = QUERY_FIELDS.get(database, QUERY_FIELDS['EpiCoV'])
+    fields = {}
+    for match in FIELD_PATTERN.finditer(text):
+        fields.setdefault(match.group(2), match.group(1))
+    return {name: fields.get(names[name]) for name in filters}
+
+
+def extract_overlay(text):
+    """
+    Returns the wid and pid of the overlay opened by a `sys.openOverlay` response, or None.
+    """
+    match = OVERLAY_PATTERN.search(text)
+    if match is None:
+        return None
+    return {'wid': match.group(1), 'pid': match.group(2)}
+
+
+def extract_download_job(text):
+    """
+    Returns the async ID of the download job started by a `Download` command response, or None.
+    """
+    match = DOWNLOAD_JOB_PATTERN.search(text)
+    return match.group(1) if match else None
@@ -1,5 +1,8 @@
 class GISAID:
-    GISAID_URL = "https://www.epicov.org/epi3/frontend"
+    BASE_URL = "https://www.epicov.org"
+    FRONTEND_PATH = "/epi3/frontend"
+    CHECK_ASYNC_PATH = "/epi3/check_async"
+    GISAID_URL = BASE_URL + FRONTEND_PATH
 
     HEADERS = {
     'accept': 'application/json, text/javascript, */*; q=0.01',
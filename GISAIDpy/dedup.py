@@ -0,0 +1,61 @@
+"""
+Script containing the storage of sequences by content hash.
+
+Many GISAID records share an identical sequence. Keyed by `sequence_hash` (see
+`polars_funcs.sequence_hash`), every distinct sequence is stored once and the records only
+carry its hash, which also lets downstream steps skip sequences they have already processed.
+
+"""
+
+import polars as pl
+from .polars_funcs import HASH_COLUMN, sequence_hash
+
+
+def with_sequence_hash(df, column='sequence'):
+    """
+    Adds the `sequence_hash` column to a DataFrame or LazyFrame, unless it is already there.
+    """
+    if HASH_COLUMN in df.collect_schema():
+        return df
+    return df.with_columns(sequence_hash(column))
+
+
+def unique_sequences(df, column='sequence'):
+    """
+    Returns the distinct sequences of a DataFrame or LazyFrame as `sequence_hash` and `column`.
+    """
+    return with_sequence_hash(df, column).select(HASH_COLUMN, column).unique(HASH_COLUMN, keep='first', maintain_order=True)
+
+
+def deduplicate(df, column='sequence'):
+    """
+    Splits a DataFrame of records into the records and their distinct sequences.
+
+    Args:
+        df (pl.DataFrame): records with a `column` sequence column, e.g. from download().
+        column (str): name of the sequence column.
+
+    Returns:
+        (pl.DataFrame, pl.DataFrame): the records with `sequence_hash` in place of the sequence,
+        and one row of `sequence_hash` and `column` per distinct sequence.
+    """
+    df = with_sequence_hash(df, column)
+    return df.drop(column), unique_sequences(df, column)
+
+
+def attach_sequences(records, sequences, column='sequence'):
+    """
+    Joins the sequences from `deduplicate` back onto the records.
+
+    polars strings are views into shared buffers, so records with the same hash point at the
+    same sequence in memory instead of each holding a copy.
+    """
+    return records.join(sequences.select(HASH_COLUMN, column), on=HASH_COLUMN, how='left', maintain_order='left')
+
+
+def new_sequences(sequences, known_hashes):
+    """
+    Keeps only the sequences whose hash is not in `known_hashes` (Series or list of str).
+    """
+    # a list, is_in no longer takes a Series of the column's own type
+    return sequences.filter(~pl.col(HASH_COLUMN).is_in(list(known_hashes)))
@@ -0,0 +1,204 @@
+"""
+File containing functions for building and querying `.fai`-style byte offset indexes of FASTA
+files, so individual sequences can be pulled from a memory-mapped file without re-parsing it.
+"""
+
+import mmap
+import os
+import polars as pl
+
+FAI_COLUMNS = ['name', 'length', 'offset', 'linebases', 'linewidth']
+
+FAI_SCHEMA = {
+    'name': pl.Utf8,
+    'length': pl.Int64,
+    'offset': pl.Int64,
+    'linebases': pl.Int64,
+    'linewidth': pl.Int64,
+}
+
+
+def index_path(file):
+    return f"{os.fspath(file)}.fai"
+
+
+def _index_frame(rows):
+    index = pl.DataFrame(
+        {name: [row[i] for row in rows] for i, name in enumerate(FAI_COLUMNS)},
+        schema=FAI_SCHEMA
+    )
+    return _with_lookup_columns(index)
+
+
+def _with_lookup_columns(index):
+    # GISAID headers are either a bare strain name or 'strain|EPI_ISL_...|date'
+    fields = pl.col('name').str.split('|')
+    return index.with_columns(
+        fields.list.first().alias('strain'),
+        fields.list.get(1, null_on_oob=True).str.strip_chars().alias('accession_id'),
+    )
+
+
+def build_fasta_index(file, index_file=None):
+    """
+    Scans a FASTA file once and writes a samtools compatible `.fai` index next to it.
+
+    Unlike samtools, the `name` column holds the whole header line, since strain names such as
+    'hCoV-19/South Africa/...' contain spaces.
+
+    Args:
+        file (str | os.PathLike): path to an uncompressed FASTA file.
+        index_file (str | os.PathLike): where to write the index, defaults to `<file>.fai`.
+
+    Returns:
+        pl.DataFrame with the index columns plus `strain` and `accession_id` lookup columns.
+    """
+    rows = []
+    name = None
+    offset = pos = length = linebases = linewidth = 0
+    short_line = False
+
+    def add_record():
+        rows.append((name, length, offset, linebases, linewidth))
+
+    with open(file, 'rb') as f:
+        for line in f:
+            if line[:1] == b'>':
+                if name is not None:
+                    add_record()
+                name = line[1:].rstrip(b'\r\n').decode()
+                pos += len(line)
+                offset = pos
+                length = linebases = linewidth = 0
+                short_line = False
+                continue
+
+            bases = len(line.rstrip(b'\r\n'))
+            if name is not None and bases:
+                if short_line or (linebases and bases > linebases):
+                    raise ValueError(f"Different line length in sequence '{name}'; cannot index {file}.")
+                if not linebases:
+                    linebases, linewidth = bases, len(line)
+                elif bases < linebases or len(line) != linewidth:
+                    short_line = True
+                length += bases
+            pos += len(line)
+
+        if name is not None:
+            add_record()
+
+    index = _index_frame(rows)
+    index.select(FAI_COLUMNS).write_csv(
+        index_file or index_path(file), separator='\t', include_header=False, quote_style='never'
+    )
+    return index
+
+
+def load_fasta_index(file, index_file=None, rebuild=False):
+    """
+    Loads the `.fai` index of `file`, (re)building it when missing or older than the FASTA.
+    """
+    index_file = index_file or index_path(file)
+    if rebuild or not os.path.exists(index_file) or os.path.getmtime(index_file) < os.path.getmtime(file):
+        return build_fasta_index(file, index_file)
+
+    index = pl.read_csv(
+        index_file,
+        separator='\t',
+        has_header=False,
+        new_columns=FAI_COLUMNS,
+        schema_overrides=FAI_SCHEMA,
+        quote_char=None,
+    )
+    return _with_lookup_columns(index)
+
+
+def select_from_index(index, strains=None, accession_ids=None):
+    """
+    Filters an index down to the records matching any of `strains` or `accession_ids`.
+    """
+    if strains is None and accession_ids is None:
+        return index
+    condition = pl.lit(False)
+    if strains is not None:
+        strains = list(strains)
+        condition = condition | pl.col('strain').is_in(strains) | pl.col('name').is_in(strains)
+    if accession_ids is not None:
+        condition = condition | pl.col('accession_id').is_in(list(accession_ids))
+    return index.filter(condition)
+
+
+def _read_record(buffer, offset, length, linebases, linewidth):
+    if length == 0:
+        return ''
+    lines, rest = divmod(length, linebases)
+    span = lines * linewidth + rest
+    raw = buffer[offset:offset + span]
+    if linewidth != linebases:
+        raw = raw.replace(b'\r', b'').replace(b'\n', b'')
+    return raw.decode()
+
+
+def iter_indexed_sequences(file, index, batch_size=10000):
+    """
+    Yields polars batches of `strain`/`sequence` for every record of `index`, reading only
+    the indexed byte ranges of a memory-mapped `file`.
+    """
+    if index.height == 0:
+        return
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        for batch in index.iter_slices(batch_size):
+            sequence = [
+                _read_record(buffer, *row)
+                for row in batch.select('offset', 'length', 'linebases', 'linewidth').iter_rows()
+            ]
+            yield pl.DataFrame({
+                'strain': batch['strain'],
+                'sequence': pl.Series('sequence', sequence, dtype=pl.Utf8),
+            })
+
+
+def fetch_sequences(file, strains=None, accession_ids=None, index=None):
+    """
+    Returns the sequences of the requested strains or accession IDs from a FASTA file.
+
+    Args:
+        file (str | os.PathLike): path to an uncompressed FASTA file.
+        strains (iterable of str): strain names (first `|` field of the header) to fetch.
+        accession_ids (iterable of str): accession IDs found in the headers to fetch.
+        index (pl.DataFrame): a previously loaded index, loaded or built when omitted.
+
+    Returns:
+        pl.DataFrame with `strain` and `sequence` columns.
+    """
+    if index is None:
+        index = load_fasta_index(file)
+    selected = select_from_index(index, strains, accession_ids)
+    batches = list(iter_indexed_sequences(file, selected))
+    if not batches:
+        return pl.DataFrame(schema={'strain': pl.Utf8, 'sequence': pl.Utf8})
+    return pl.concat(batches, rechunk=True)
+
+
+def scan_sequences(file, strains=None, accession_ids=None, index=None):
+    """
+    Lazy counterpart of `fetch_sequences`; sequences are only read from disk on collect.
+    """
+    from polars.io.plugins import register_io_source
+
+    def source(with_columns, predicate, n_rows, batch_size):
+        selected = select_from_index(index if index is not None else load_fasta_index(file), strains, accession_ids)
+        remaining = n_rows
+        for batch in iter_indexed_sequences(file, selected, batch_size or 10000):
+            if predicate is not None:
+                batch = batch.filter(predicate)
+            if with_columns is not None:
+                batch = batch.select(with_columns)
+            if remaining is not None:
+                batch = batch.head(remaining)
+                remaining -= batch.height
+            yield batch
+            if remaining is not None and remaining <= 0:
+                break
+
+    return register_io_source(source, schema={'strain': pl.Utf8, 'sequence': pl.Utf8})
@@ -4,13 +4,18 @@ Script that contains and defines the primary functions needed for GISAIDpy imple
 """
 
 import logging
+import os
+import re
 import warnings
-import requests
 import urllib.parse
 import json
 import time
-import polars as pl
-from constants import GISAID
+from .constants import GISAID
+from .client import get_client
+from .polling import get_waiter
+from .session import get_session_state, SessionExpiredError, StalePanelError
+from .components import QUERY_FIELDS, extract_component_ids, extract_field_ids
+from .tracing import span, traced, record, enabled as tracing_enabled
 
 def timestamp():
     return f"{int(time.time() * 1000)}"
@@ -48,10 +53,102 @@ def parse_response(res):
                 warnings.warn(f"There was an error, previously documented by Wytamma. Please see link for R issue: {issue_link}")
             else:
                 warnings.warn(error_message)
+            if error_type == 'expired':
+                raise SessionExpiredError(error_message)
+            if error_type == 'Error':
+                # also what commands sent to a panel the server no longer knows get back
+                raise StalePanelError(error_message)
             raise Exception(error_message)
 
     return j
 
+def queued_commands(data):
+    # command names in a request body built by format_data_for_request
+    queue = urllib.parse.parse_qs(data).get('data')
+    if not queue:
+        return []
+    return [command['cmd'] for command in json.loads(queue[0]).get('queue', [])]
+
+def search_responses(response_data, extract):
+    """
+    Returns the first non-None `extract(data)` over the responses of a parsed command queue.
+    """
+    for response in response_data.get('responses', []):
+        value = extract(str(response.get('data', '')))
+        if value is not None:
+            return value
+    return None
+
+class CommandQueue:
+    """
+    Builds command queues and sends each logical protocol step as one request.
+
+    The frontend runs the commands of a queue in order, so commands whose parameters do not
+    depend on an earlier response can share a request: e.g. the format choice together with
+    the DownloadReminder it is followed by. `round_trips` counts every request sent through
+    the builder, page loads included.
+
+    Args:
+        sid (str): session ID.
+        wid (str): window ID requests are sent to, see `target`.
+        pid (str): panel ID requests are sent to, see `target`.
+    """
+
+    def __init__(self, sid, wid, pid):
+        self.sid = sid
+        self.wid = wid
+        self.pid = pid
+        self.commands = []
+        self.round_trips = 0
+
+    def target(self, wid, pid):
+        """
+        Sends the next commands to panel `pid` of window `wid`.
+        """
+        if self.commands:
+            raise ValueError('Send the queued commands before changing panels.')
+        self.wid, self.pid = wid, pid
+        return self
+
+    def add(self, cid, cmd, params=None, equiv=None):
+        self.commands.append(create_command(self.wid, self.pid, cid, cmd, params if params is not None else {}, equiv))
+        return self
+
+    def set_value(self, cid, ceid, value, cmd=None, equiv=False):
+        """
+        Queues the setTarget/ChangeValue pair that edits form input `ceid`, followed by the
+        `cmd` notifying the component of the change (e.g. FormatChange) when given.
+        """
+        self.add(cid, 'setTarget', {'cvalue': value, 'ceid': ceid}, f"ST{ceid}" if equiv else None)
+        self.add(cid, 'ChangeValue', {'cvalue': value, 'ceid': ceid}, f"CV{ceid}" if equiv else None)
+        if cmd is not None:
+            self.add(cid, cmd, {'ceid': ceid})
+        return self
+
+    def build(self):
+        """
+        Returns the request body of the queued commands, emptying the queue.
+        """
+        if not self.commands:
+            raise ValueError('No commands queued.')
+        data = format_data_for_request(self.sid, self.wid, self.pid, {'queue': self.commands}, timestamp())
+        self.commands = []
+        self.round_trips += 1
+        return data
+
+    def send(self):
+        """
+        POSTs the queued commands and returns the parsed response.
+        """
+        return parse_response(send_request(method='POST', data=self.build()))
+
+    def load(self, parameter_string, method='GET'):
+        """
+        Loads a page, counted as a round trip of this queue.
+        """
+        self.round_trips += 1
+        return send_request(parameter_string, method=method)
+
 def extract_first_match(regex, text):
     logging.debug(f"Extracting '{regex}' from '{text[:30]}'")
     match = re.search(regex, text)
@@ -60,6 +157,7 @@ def extract_first_match(regex, text):
     else:
         return None
     
+@traced('send_back_cmd')
 def send_back_cmd(session_id, WID, PID, CID):
     # send back command to get back to page
     selection_command = create_command(
@@ -77,6 +175,7 @@ def send_back_cmd(session_id, WID, PID, CID):
 
     response_data = parse_response(response)
 
+@traced('reset_query')
 def reset_query(credentials):
     queue = []
     command = create_command(
@@ -96,10 +195,11 @@ def reset_query(credentials):
         timestamp=timestamp()
     )
 
-    res = requests.post(GISAID.GISAID_URL, headers=GISAID.HEADERS, data=data)
+    res = send_request(method='POST', data=data)
 
     return res
 
+@traced('get_download_panel')
 def get_download_panel(session_id, WID, customSearch_page_ID, query_cid):
     selection_command = create_command(
         wid=WID,
@@ -127,7 +227,37 @@ def get_download_panel(session_id, WID, customSearch_page_ID, query_cid):
 
     return {'pid': download_pid, 'wid': download_wid}
 
-def get_accession_ids(credentials):
+@traced('get_accession_ids')
+def get_accession_ids(credentials, state=None, as_set=False):
+    """
+    Returns the accession IDs of the records matching the current search, e.g. after `count_query`.
+
+    Args:
+        credentials (dict): logged in GISAID session.
+        state (SessionState): cache of panel IDs to reuse, the process wide one by default.
+        as_set (bool): return an `AccessionIDSet` instead of a pl.DataFrame with an
+            `accession_id` column.
+    """
+    state = state if state is not None else get_session_state()
+    ids = state.run(credentials['sid'], _get_accession_ids, credentials, state)
+    return ids if as_set else ids.to_frame()
+
+def _stream_chunks(response, chunk_size=1 << 20):
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        record(bytes_received=len(chunk))
+        yield chunk
+
+def join_accession_ids(list_of_accession_ids):
+    # the selection panel takes the IDs as one comma separated string
+    from .accession import AccessionIDSet
+
+    if isinstance(list_of_accession_ids, AccessionIDSet):
+        return list_of_accession_ids.join(", ")
+    return ", ".join(list_of_accession_ids)
+
+def _get_accession_ids(credentials, state):
+    from .accession import AccessionIDSet
+
     command_queue = {
         'queue': [
             create_command(
@@ -147,21 +277,15 @@ def get_accession_ids(credentials):
         queue=command_queue,
         timestamp=timestamp()
     )
-    res = requests.post(GISAID.GISAID_URL, headers=GISAID.HEADERS, data=data)
+    res = send_request(method='POST', data=data)
     j = parse_response(res)
 
     check_async_id = j['callback_response']['async_id']
-    while True:
-        res = requests.get(f"https://www.epicov.org/epi3/check_async/{check_async_id}?_={timestamp()}")
-        j = parse_response(res)
-        if j['__ready__']:
-            break
-        time.sleep(1)
+    j = wait_for_async(check_async_id, '__ready__')
 
     logging.debug(j)
 
-    selection_pid_wid = get_selection_panel(credentials['sid'], credentials['wid'], credentials['pid'], credentials['query_cid'])
-    selection_page = send_request(f"sid={credentials['sid']}&pid={selection_pid_wid['pid']}")
+    selection_pid_wid = open_selection_panel(credentials, state)
 
     command_queue = {
         'queue': [
@@ -182,18 +306,20 @@ def get_accession_ids(credentials):
         queue=command_queue,
         timestamp=timestamp()
     )
-    res = requests.post(GISAID.GISAID_URL, headers=GISAID.HEADERS, data=data)
+    res = send_request(method='POST', data=data)
     j = parse_response(res)
     url = extract_first_match(r"sys.downloadFile\(\"(.*)\",", j['responses'][0]['data'])
-    logging.debug(f"https://www.epicov.org/{url}")
-    response = requests.get(f"https://www.epicov.org/{url}")
-    df = pl.read_csv(response.content.decode(), header=None)
-    df = df.rename(['accession_id'])
+    logging.debug(get_client().url(url))
+    # parsed while it streams in, the ID list of a broad query runs into millions of lines
+    with get_client().get(get_client().url(url), stream=True) as response:
+        response.raise_for_status()
+        ids = AccessionIDSet.from_csv(_stream_chunks(response))
 
     send_back_cmd(credentials['sid'], selection_pid_wid['wid'], selection_pid_wid['pid'], credentials['selection_panel_cid'])
     reset_query(credentials)
-    return df
+    return ids
 
+@traced('get_selection_panel')
 def get_selection_panel(session_id, WID, customSearch_page_ID, query_cid):
     selection_command = create_command(
         wid=WID,
@@ -216,18 +342,79 @@ def get_selection_panel(session_id, WID, customSearch_page_ID, query_cid):
 
     return {'pid': selection_pid, 'wid': selection_wid}
 
+@traced('check_async')
+def check_async(async_id):
+    client = get_client()
+    res = client.get(client.url(f"{GISAID.CHECK_ASYNC_PATH}/{async_id}"), params={'_': timestamp()})
+    return res.json()
+
+@traced('wait_for_async')
+def wait_for_async(async_id, ready_key='is_ready', waiter=None):
+    waiter = waiter if waiter is not None else get_waiter()
+    return waiter.wait(async_id, check_async, lambda j: j.get(ready_key))
+
+@traced('fetch_file')
+def fetch_file(url, path, chunk_size=1 << 20, progress=None, resume=True):
+    """
+    Streams `url` into `path`, resuming a partial file with a Range request.
+
+    Dropped connections are resumed from the last written byte up to the client's retry limit.
+
+    Args:
+        url (str): file to download.
+        path (str): destination, appended to when it already holds part of the file.
+        chunk_size (int): bytes read from the socket at a time.
+        progress (callable): called as progress(bytes_done, bytes_total) after every chunk,
+            bytes_total is None when the server does not report a size.
+        resume (bool): continue an existing partial file instead of starting over.
+    """
+    import requests
+
+    client = get_client()
+    for attempt in range(client.retries + 1):
+        done = os.path.getsize(path) if resume and os.path.exists(path) else 0
+        headers = {'Range': f'bytes={done}-'} if done else {}
+        try:
+            with client.get(url, stream=True, headers=headers) as res:
+                if res.status_code == 416:
+                    # the partial file is already complete
+                    return path
+                res.raise_for_status()
+                if res.status_code != 206:
+                    done = 0
+                length = res.headers.get('Content-Length')
+                total = done + int(length) if length is not None else None
+                with open(path, 'ab' if done else 'wb') as f:
+                    for chunk in res.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        done += len(chunk)
+                        record(bytes_received=len(chunk))
+                        if progress is not None:
+                            progress(done, total)
+            return path
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+            if attempt == client.retries:
+                raise
+            logging.debug(f"Download of {url} interrupted at {done} bytes ({e}), resuming")
+            resume = True
+            time.sleep(client.backoff(attempt))
+
 def send_request(parameter_string="", data=None, method='GET'):
-    URL = GISAID.GISAID_URL + '?' + parameter_string
+    client = get_client()
+    URL = client.frontend_url + '?' + parameter_string
     if data is None:
         data = ""
-    logging.debug(f"Sending request:\n Method -> {method}\n URL -> {URL}\n data -> {data}")
-    
-    if method == 'GET':
-        response = requests.get(URL)
-    elif method == 'POST':
-        response = requests.post(URL, headers=GISAID.HEADERS, data=data)
-    else:
-        raise ValueError(f"Method '{method}' not allowed")
+    logging.debug(f"Sending request:\n Method -> {method}\n URL -> {URL}\n data -> {data[:500]}")
+
+    with span('send_request', method=method):
+        if data and tracing_enabled():
+            record(commands=queued_commands(data))
+        if method == 'GET':
+            response = client.get(URL)
+        elif method == 'POST':
+            response = client.post(URL, headers=GISAID.HEADERS, data=data)
+        else:
+            raise ValueError(f"Method '{method}' not allowed")
     
     if response.status_code >= 500:
         logging.warning(f"An error occurred while trying to {method} {URL}")
@@ -235,13 +422,107 @@ def send_request(parameter_string="", data=None, method='GET'):
     
     return response
 
-def select_entries(credentials, list_of_accession_ids):
-    accession_ids_string = ", ".join(list_of_accession_ids)
+def open_selection_panel(credentials, state=None):
+    """
+    Returns the wid/pid of the selection panel, opening and loading it only when the
+    session state has none cached.
+    """
+    state = state if state is not None else get_session_state()
+    selection_pid_wid = state.get(credentials['sid'], 'selection')
+    if selection_pid_wid is None:
+        selection_pid_wid = get_selection_panel(credentials['sid'], credentials['wid'], credentials['pid'], credentials['query_cid'])
+        # Load panel
+        send_request(f"sid={credentials['sid']}&pid={selection_pid_wid['pid']}")
+        state.set(credentials['sid'], 'selection', selection_pid_wid)
+    return selection_pid_wid
+
+def open_download_panel(credentials, state=None):
+    """
+    Returns the wid/pid of the download panel with the cid of its selection component and the
+    ceid of its format radio buttons, opening and scanning the panel only when the session
+    state has none cached.
+    """
+    state = state if state is not None else get_session_state()
+    panel = state.get(credentials['sid'], 'download')
+    if panel is None:
+        panel = get_download_panel(credentials['sid'], credentials['wid'], credentials['pid'], credentials['query_cid'])
+        # load panel
+        download_page_text = send_request(f"sid={credentials['sid']}&pid={panel['pid']}").text
+        ids = extract_component_ids(download_page_text, credentials['database'], ['download_selection', 'format_radio'])
+        if ids['download_selection'] is None:
+            raise StalePanelError('Could not find the download selection component on the download panel.')
+        panel['cid'], panel['ceid'] = ids['download_selection'], ids['format_radio']
+        state.set(credentials['sid'], 'download', panel)
+    return panel
+
+def open_query_fields(credentials, state=None):
+    """
+    Returns the ceid of every search filter, loading and scanning the search panel only when
+    the session state has none cached.
+    """
+    state = state if state is not None else get_session_state()
+    field_ids = state.get(credentials['sid'], 'query')
+    if field_ids is None:
+        search_page_text = send_request(f"sid={credentials['sid']}&pid={credentials['pid']}").text
+        filters = QUERY_FIELDS.get(credentials['database'], QUERY_FIELDS['EpiCoV'])
+        field_ids = extract_field_ids(search_page_text, credentials['database'], filters)
+        state.set(credentials['sid'], 'query', field_ids)
+    return field_ids
+
+def parse_count(res):
+    j = res.json()
+    if 'totalRecords' not in j:
+        # errors come back as regular responses
+        parse_response(res)
+        raise Exception('Could not find the number of records in the query response.')
+    return int(j['totalRecords'])
+
+@traced('count_query')
+def count_query(credentials, query, state=None):
+    """
+    Applies `query` to the search panel and returns the number of matching records.
+
+    The filters stay applied afterwards, so a following get_accession_ids() returns the
+    matching IDs (and resets the query).
+
+    Args:
+        credentials (dict): logged in GISAID session.
+        query (query.Query): filters to apply.
+        state (SessionState): cache of panel IDs to reuse, the process wide one by default.
+    """
+    state = state if state is not None else get_session_state()
+    return state.run(credentials['sid'], _count_query, credentials, query, state)
+
+def _count_query(credentials, query, state):
+    field_ids = open_query_fields(credentials, state)
+    data = format_data_for_request(
+        credentials['sid'], credentials['wid'], credentials['pid'], {'queue': query.commands(credentials, field_ids)},
+        timestamp()
+    )
+    parse_response(send_request(method='POST', data=data))
+
+    # a single row keeps the response small, only the total is needed
+    command = create_command(
+        wid=credentials['wid'],
+        pid=credentials['pid'],
+        cid=credentials['query_cid'],
+        cmd='GetData',
+        params={'start_index': 0, 'rows_per_page': 1, 'sorting': ''}
+    )
+    data = format_data_for_request(credentials['sid'], credentials['wid'], credentials['pid'], {'queue': [command]}, timestamp())
+    total = parse_count(send_request(data))
+    logging.debug(f"{query} matches {total} records")
+    return total
+
+@traced('select_entries')
+def select_entries(credentials, list_of_accession_ids, state=None):
+    state = state if state is not None else get_session_state()
+    return state.run(credentials['sid'], _select_entries, credentials, list_of_accession_ids, state)
 
-    selection_pid_wid = get_selection_panel(credentials['sid'], credentials['wid'], credentials['pid'], credentials['query_cid'])
+def _select_entries(credentials, list_of_accession_ids, state):
+    accession_ids_string = join_accession_ids(list_of_accession_ids)
 
-    # Load panel
-    selection_page = send_request(f"sid={credentials['sid']}&pid={selection_pid_wid['pid']}")
+    selection_pid_wid = open_selection_panel(credentials, state)
 
     ev1 = create_command(
         wid=selection_pid_wid['wid'],
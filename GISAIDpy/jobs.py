@@ -0,0 +1,370 @@
+"""
+Script containing the job manifests run by `gisaidpy run`.
+
+A manifest is a JSON (or TOML) file listing download jobs:
+
+    {
+        "credentials": ["session1.json", "session2.json"],
+        "output": "data",
+        "workers": 2,
+        "defaults": {"batch_size": 5000, "dedupe": true},
+        "limits": {"rate": 2, "host_rate": 5},
+        "jobs": [
+            {"name": "denmark", "ids_file": "denmark_ids.txt"},
+            {"name": "ba1", "query": {"location": "Europe", "lineage": "BA.1", "collection_date": ["2022-01-01", "2022-03-31"]}},
+            {"name": "few", "ids": ["EPI_ISL_402124", "EPI_ISL_402125"], "get_sequence": false}
+        ]
+    }
+
+`credentials` is a credentials JSON file, a credentials dict, `{"env": "VARIABLE"}` naming an
+environment variable holding the JSON, or a list of those. A GISAID session only holds one
+selection at a time, so each worker process gets a session of its own and there are never more
+workers than sessions. Relative paths are resolved against the manifest's directory.
+
+`limits` holds the arguments of the `RateLimiter` all workers share through lock files in
+`<output>/.locks`, so the limits hold for the run as a whole.
+
+Every job is written to `<output>/<name>` through download_bulk(output=...), so finished batches
+are kept when a job fails, and `<output>/_jobs.json` records the finished jobs, which are
+skipped when the manifest is run again.
+
+"""
+
+import contextlib
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .main import MAX_BATCH_SIZE
+from .ratelimit import RateLimiter
+
+# options a job can set, with their defaults
+JOB_DEFAULTS = {
+    'get_sequence': True,
+    'batch_size': MAX_BATCH_SIZE,
+    'format': 'parquet',
+    'retries': 2,
+    'columns': None,
+    'packed': False,
+    'content_hash': False,
+    'dedupe': False,
+    'parse_dates': False,
+}
+
+STATE_FILE = '_jobs.json'
+
+
+def _resolve(path, base_dir):
+    return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+def load_credentials(source, base_dir='.'):
+    """
+    Returns the list of credentials dicts described by a manifest's `credentials` entry.
+    """
+    if isinstance(source, list):
+        return [credentials for item in source for credentials in load_credentials(item, base_dir)]
+    if isinstance(source, dict) and 'env' in source:
+        if source['env'] not in os.environ:
+            raise ValueError(f"Environment variable {source['env']} holding the credentials is not set.")
+        return load_credentials(json.loads(os.environ[source['env']]), base_dir)
+    if isinstance(source, dict):
+        missing = [key for key in ('sid', 'wid', 'pid', 'query_cid', 'database') if key not in source]
+        if missing:
+            raise ValueError(f"Credentials are missing {', '.join(missing)}.")
+        return [source]
+    with open(_resolve(source, base_dir)) as f:
+        return load_credentials(json.load(f), base_dir)
+
+
+def read_accession_ids(path):
+    """
+    Reads accession IDs from a file, one per line or comma separated.
+    """
+    with open(path) as f:
+        ids = [i.strip() for line in f for i in line.split(',')]
+    return list(dict.fromkeys(i for i in ids if i))
+
+
+def _load_toml(f):
+    try:
+        import tomllib
+    except ImportError:
+        # tomllib is only in the standard library from Python 3.11, tomli is its backport
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ValueError('TOML manifests need Python 3.11+ or the tomli package, use a JSON manifest instead.')
+    return tomllib.load(f)
+
+
+def load_manifest(path):
+    """
+    Reads and validates a job manifest.
+
+    Returns:
+        dict with `sessions` (list of credentials), `output`, `workers`, `base_url` and `jobs`,
+        every job holding its name, output directory, ID source and options.
+    """
+    with open(path, 'rb') as f:
+        if path.endswith('.toml'):
+            manifest = _load_toml(f)
+        else:
+            manifest = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    for key in ('credentials', 'jobs'):
+        if key not in manifest:
+            raise ValueError(f"Manifest {path} has no '{key}'.")
+    unknown = set(manifest.get('defaults', {})) - set(JOB_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown default options: {', '.join(sorted(unknown))}.")
+    defaults = dict(JOB_DEFAULTS, **manifest.get('defaults', {}))
+    output = _resolve(manifest.get('output', 'gisaidpy_output'), base_dir)
+
+    jobs, names = [], set()
+    for i, spec in enumerate(manifest['jobs']):
+        name = spec.get('name', f"job_{i + 1}")
+        if name in names:
+            raise ValueError(f"Job name '{name}' is used twice.")
+        names.add(name)
+        sources = [key for key in ('ids', 'ids_file', 'query') if key in spec]
+        if len(sources) != 1:
+            raise ValueError(f"Job '{name}' needs exactly one of 'ids', 'ids_file' or 'query'.")
+        unknown = set(spec) - set(JOB_DEFAULTS) - {'name', 'output', 'ids', 'ids_file', 'query'}
+        if unknown:
+            raise ValueError(f"Job '{name}' has unknown options: {', '.join(sorted(unknown))}.")
+        job = dict(defaults, **{k: v for k, v in spec.items() if k in JOB_DEFAULTS})
+        job['name'] = name
+        job['output'] = _resolve(spec.get('output', name), output)
+        if 'ids_file' in spec:
+            files = spec['ids_file'] if isinstance(spec['ids_file'], list) else [spec['ids_file']]
+            job['ids_file'] = [_resolve(file, base_dir) for file in files]
+        else:
+            job[sources[0]] = spec[sources[0]]
+        jobs.append(job)
+
+    limits = dict(manifest.get('limits', {}))
+    unknown = set(limits) - (set(inspect.signature(RateLimiter).parameters) - {'lock_dir'})
+    if unknown:
+        raise ValueError(f"Unknown limits: {', '.join(sorted(unknown))}.")
+    # validates the values before any worker starts
+    RateLimiter(**limits)
+
+    return {
+        'sessions': load_credentials(manifest['credentials'], base_dir),
+        'output': output,
+        'workers': int(manifest.get('workers', 1)),
+        'base_url': manifest.get('base_url'),
+        'limits': limits,
+        'jobs': jobs,
+    }
+
+
+def job_key(job):
+    # a finished job is only skipped while its definition, and the IDs files it reads, stay the same
+    key = hashlib.sha1(json.dumps(job, sort_keys=True, default=str).encode())
+    for path in job.get('ids_file', []):
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    key.update(chunk)
+            key.update(b'\0')
+        except OSError:
+            # the job fails on it anyway, and must not match a finished run
+            key.update(b'\0missing')
+    return key.hexdigest()[:16]
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+# state of a worker process, set by _init_worker
+_session = None
+_events = None
+
+
+def _init_worker(sessions, events, base_url, limits):
+    from .client import GISAIDClient, set_client
+
+    global _session, _events
+    _session = sessions.get()
+    _events = events
+    options = {} if base_url is None else {'base_url': base_url}
+    set_client(GISAIDClient(limiter=RateLimiter(**limits), **options))
+
+
+def _event(name, kind, **values):
+    if _events is not None:
+        _events.put(dict(values, job=name, kind=kind))
+
+
+def run_job(job):
+    """
+    Runs one job with the session of the current worker process and returns its summary.
+    """
+    from .main import download_bulk
+
+    name = job['name']
+    start = time.perf_counter()
+    summary = {'job': name, 'key': job_key(job), 'output': job['output'], 'records': 0, 'requested': 0, 'bytes': 0}
+    try:
+        credentials = dict(_session)
+        if 'query' in job:
+            from .functions import count_query, get_accession_ids, reset_query
+            from .query import Query
+            total = count_query(credentials, Query.from_dict(job['query']))
+            _event(name, 'query', total=total)
+            if total:
+                ids = get_accession_ids(credentials, as_set=True)
+            else:
+                ids = []
+                reset_query(credentials)
+        elif 'ids_file' in job:
+            ids = list(dict.fromkeys(i for file in job['ids_file'] for i in read_accession_ids(file)))
+        else:
+            ids = list(dict.fromkeys(job['ids']))
+        summary['requested'] = len(ids)
+        _event(name, 'start', ids=len(ids))
+
+        if ids:
+            # the progress prints of concurrent jobs would interleave, events report it instead
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                lf = download_bulk(
+                    credentials, ids, get_sequence=job['get_sequence'], batch_size=job['batch_size'], max_workers=1,
+                    retries=job['retries'], output=job['output'], output_format=job['format'], columns=job['columns'],
+                    packed=job['packed'], content_hash=job['content_hash'], dedupe=job['dedupe'],
+                    parse_dates=job['parse_dates'],
+                    progress=lambda done, total: _event(name, 'batch', done=done, total=total)
+                )
+            summary['records'] = lf.select('accession_id').collect().height
+            summary['bytes'] = _directory_size(job['output'])
+        summary['status'] = 'ok'
+    except Exception as e:
+        logging.exception(f"Job {name} failed")
+        summary['status'] = 'failed'
+        summary['error'] = f"{type(e).__name__}: {e}"
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def _load_state(output):
+    path = os.path.join(output, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(output, state):
+    os.makedirs(output, exist_ok=True)
+    path = os.path.join(output, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def run_manifest(manifest, workers=None, force=False, on_event=None):
+    """
+    Runs the jobs of a loaded manifest on a pool of worker processes.
+
+    Args:
+        manifest (dict): from `load_manifest`.
+        workers (int): worker processes, the manifest's `workers` by default; capped at the
+            number of sessions.
+        force (bool): also rerun jobs that finished before.
+        on_event (callable): called with a dict for every progress event of a job
+            (kind 'query', 'start', 'batch' or 'done').
+
+    Returns:
+        list of job summaries (dicts with job, status, records, requested, bytes, seconds and
+        error), in manifest order; skipped jobs have the status 'skipped'.
+    """
+    workers = workers or manifest['workers']
+    if workers > len(manifest['sessions']):
+        logging.warning(f"Only {len(manifest['sessions'])} sessions for {workers} workers, running fewer workers.")
+    state = _load_state(manifest['output'])
+
+    results, pending = {}, []
+    for job in manifest['jobs']:
+        done = state.get(job['name'])
+        if not force and done is not None and done.get('key') == job_key(job):
+            results[job['name']] = dict(done, status='skipped')
+        else:
+            pending.append(job)
+    workers = max(1, min(workers, len(manifest['sessions']), len(pending)))
+
+    if pending:
+        # spawned rather than forked, polars' thread pool does not survive a fork
+        context = multiprocessing.get_context('spawn')
+        sessions, events = context.Queue(), context.Queue()
+        limits = dict(manifest['limits'], lock_dir=os.path.join(manifest['output'], '.locks'))
+        for session in manifest['sessions'][:workers]:
+            sessions.put(session)
+
+        def forward():
+            for event in iter(events.get, None):
+                if on_event is not None:
+                    on_event(event)
+
+        forwarder = threading.Thread(target=forward, daemon=True)
+        forwarder.start()
+        try:
+            with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                     initargs=(sessions, events, manifest['base_url'], limits)) as executor:
+                futures = {executor.submit(run_job, job): job for job in pending}
+                for future in as_completed(futures):
+                    job = futures[future]
+                    try:
+                        summary = future.result()
+                    except Exception as e:
+                        # the worker process itself died
+                        summary = {'job': job['name'], 'status': 'failed', 'error': f"{type(e).__name__}: {e}",
+                                   'records': 0, 'requested': 0, 'bytes': 0, 'seconds': 0.0}
+                    results[job['name']] = summary
+                    if summary['status'] == 'ok':
+                        state[job['name']] = summary
+                        _save_state(manifest['output'], state)
+                    if on_event is not None:
+                        on_event(dict(summary, kind='done'))
+        finally:
+            events.put(None)
+            forwarder.join()
+
+    return [results[job['name']] for job in manifest['jobs']]
+
+
+def format_summary(results, elapsed=None):
+    """
+    Returns a table of job summaries with their throughput and the totals, including the overall
+    throughput when the wall time `elapsed` of the run is given.
+    """
+    lines = [f"{'job':<20} {'status':<8} {'records':>9} {'seconds':>9} {'rec/s':>8} {'MB':>8} {'MB/s':>7}"]
+    ran = [r for r in results if r['status'] != 'skipped']
+    for r in results:
+        seconds = r.get('seconds') or 0
+        rate = r['records'] / seconds if r['status'] != 'skipped' and seconds else None
+        mb = r.get('bytes', 0) / 1e6
+        lines.append(
+            f"{r['job'][:20]:<20} {r['status']:<8} {r['records']:>9} {seconds:>9.1f} "
+            f"{'-' if rate is None else f'{rate:.0f}':>8} {mb:>8.1f} "
+            f"{'-' if rate is None else f'{mb / seconds:.2f}':>7}"
+        )
+    failed = [r for r in results if r['status'] == 'failed']
+    records, mb = sum(r['records'] for r in ran), sum(r.get('bytes', 0) for r in ran) / 1e6
+    total = (
+        f"{len(results)} jobs: {len(ran) - len(failed)} done, {len(results) - len(ran)} skipped, {len(failed)} failed; "
+        f"{records} records, {mb:.1f} MB"
+    )
+    if elapsed:
+        total += f" in {elapsed:.1f}s ({records / elapsed:.0f} records/s, {mb / elapsed:.2f} MB/s)"
+    lines.append(total)
+    for r in failed:
+        lines.append(f"FAILED {r['job']}: {r.get('error')}")
+    return '\n'.join(lines)
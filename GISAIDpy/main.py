@@ -2,265 +2,424 @@
 Primary script in GISAIDpy, combines functions to produce API request and downloads.
 
 """
-from functions import *
-import glob
-import re
-import requests
-import click
-import numpy as np
-import polars as pl
-from polars_funcs import read_fasta
-import urllib.request
-import tarfile
+import hashlib
+import logging
 import os
+import queue
 import shutil
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .client import get_client
+from .functions import CommandQueue, select_entries, open_download_panel, search_responses, wait_for_async, fetch_file
+from .components import extract_component_ids, extract_overlay, extract_download_job
+from .tracing import traced, current_span
+from .session import get_session_state, StalePanelError
+
+# polars and the modules built on it are imported by the functions parsing downloads, so
+# importing this module stays cheap for processes that never parse anything
 
-def download(credentials, list_of_accession_ids, get_sequence=TRUE, clean_up=TRUE):
+MAX_BATCH_SIZE = 5000
+
+@traced('download')
+def download(credentials, list_of_accession_ids, get_sequence=True, clean_up=True, work_dir=None, progress=None,
+             cache=None, output=None, output_format='parquet', state=None, columns=None, predicate=None, packed=False,
+             content_hash=False, dedupe=False, parse_dates=False):
     """
     Function for downloading data from whichever GISAID db you would like to access.
     
     Args:
-        credentials ()
+        credentials (dict): logged in GISAID session.
+        list_of_accession_ids (list of str | AccessionIDSet): accession IDs to download, at most 5000.
+        get_sequence (bool): join the sequences onto the metadata.
+        clean_up (bool): remove the downloaded files afterwards.
+        work_dir (str): directory for the downloaded file, a new temporary directory by default.
+        progress (callable): called as progress(bytes_done, bytes_total) while downloading.
+        cache (RecordCache): only download the accession IDs missing from this cache, and add them to it.
+        output (str): stream metadata and sequences to files in this directory and return a
+            LazyFrame scanning them, instead of one in-memory DataFrame.
+        output_format (str): 'parquet' or 'ipc' (Arrow IPC) files in `output`.
+        state (SessionState): cache of panel IDs to reuse, the process wide one by default.
+        columns (list of str): metadata columns to keep, `accession_id` and `strain` are always kept.
+        predicate (pl.Expr): keep only the records matching it, e.g.
+            `pl.col('date_parsed').is_between(date(2021, 1, 1), date(2021, 6, 30))` with `parse_dates`.
+        packed (bool): store sequences as 4-bit packed Binary, see `packed.py`.
+        content_hash (bool): add a `sequence_hash` column, see `polars_funcs.sequence_hash`.
+        dedupe (bool): keep each distinct sequence once, shared by the records with its
+            `sequence_hash`; with `output` the sequences file then holds one row per hash.
+        parse_dates (bool): add a pl.Date copy of every date column, e.g. `date_parsed`; the raw
+            string columns keep incomplete dates such as '2021-03'.
     """
-    if len(list_of_accession_ids) > 5000:
-        raise ValueError('Can only download a maximum of 5000 samples at a time.')
+    if len(list_of_accession_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'Can only download a maximum of {MAX_BATCH_SIZE} samples at a time, use download_bulk for more.')
     elif len(list_of_accession_ids) == 0:
         raise ValueError('Select at least one sequence!')
+
+    if cache is not None:
+        if output is not None:
+            raise ValueError('cache and output cannot be combined.')
+        if columns is not None or predicate is not None or packed or content_hash or dedupe or parse_dates:
+            raise ValueError(
+                'cache only stores complete records and cannot be combined with columns, predicate, packed, '
+                'content_hash, dedupe or parse_dates.'
+            )
+        import polars as pl
+
+        cached, missing = cache.get(list_of_accession_ids, get_sequence)
+        if not missing:
+            return cached
+        df = download(credentials, missing, get_sequence, clean_up, work_dir, progress, state=state)
+        cache.put(df)
+        return df if cached is None else pl.concat([cached, df], how='diagonal_relaxed')
     
+    state = state if state is not None else get_session_state()
+    download_url = state.run(credentials['sid'], _prepare_download, credentials, list_of_accession_ids, state)
+
+    return process_download(
+        credentials, download_url, list_of_accession_ids, get_sequence, clean_up, work_dir, progress, output, output_format,
+        columns, predicate, packed, content_hash, dedupe, parse_dates
+    )
+
+
+def _prepare_download(credentials, list_of_accession_ids, state):
+    # runs the command flow up to the prepared download and returns its URL
     print('Selecting entries...')
+    select_entries(credentials=credentials, list_of_accession_ids=list_of_accession_ids, state=state)
 
-    response = select_entries(credentials=credentials, list_of_accession_ids=list_of_accession_ids)
+    panel = open_download_panel(credentials, state)
+    credentials['download_panel_cid'] = panel['cid']
+    queue = CommandQueue(credentials['sid'], panel['wid'], panel['pid'])
 
-    download_pid_wid = {'pid': credentials['pid'], 'wid': credentials['wid']}
-    download_cmd = 'Download'
-    download_pid_wid = get_download_panel(credentials['sid'], credentials['wid'], credentials['pid'], credentials['query_cid'])
-    # load panel
-    download_page = send_request(f"sid={credentials['sid']}&pid={download_pid_wid['pid']}")
+    # choosing the format and opening the download reminder share a request
+    queue.set_value(panel['cid'], panel['ceid'], 'augur_input', 'FormatChange')
+    queue.add(panel['cid'], 'DownloadReminder')
+    overlay = search_responses(queue.send(), extract_overlay)
+    if overlay is None:
+        raise StalePanelError('Could not find the download reminder overlay.')
 
-    download_page_text = download_page.text
+    agreement_page = queue.load(f"sid={credentials['sid']}&pid={overlay['pid']}&wid={overlay['wid']}&mode=page", method='POST')
+    ids = extract_component_ids(agreement_page.text, credentials['database'], ['reminder_buttons', 'agree_checkbox'])
+    cid = credentials['download_panel_cid'] = ids['reminder_buttons']
 
-    if credentials['database'] == 'EpiRSV':
-        credentials['download_panel_cid'] = re.search(r"'(.{5,20})','RSVDownloadSelectionComponent", download_page_text).group(1)
-    elif credentials['database'] == 'EpiPox':
-        credentials['download_panel_cid'] = re.search(r"'(.{5,20})','MPoxDownloadSelectionComponent", download_page_text).group(1)
-    else:
-        credentials['download_panel_cid'] = re.search(r"'(.{5,20})','DownloadSelectionComponent", download_page_text).group(1)
-        radio_button_widget_cid = re.search(r"'(.{5,20})','RadiobuttonWidget", download_page_text).group(1)
-
-    queue = []
-    command = create_command(
-        wid=download_pid_wid['wid'],
-        pid=download_pid_wid['pid'],
-        cid=credentials['download_panel_cid'],
-        cmd='setTarget',
-        params={'cvalue': 'augur_input', 'ceid': radio_button_widget_cid}
-    )
-    queue.append(command)
-
-    command = create_command(
-    wid=download_pid_wid['wid'],
-    pid=download_pid_wid['pid'],
-    cid=credentials['download_panel_cid'],
-    cmd='ChangeValue',
-    params={'cvalue': 'augur_input', 'ceid': radio_button_widget_cid}
-    )
-    queue.append(command)
-
-    command = create_command(
-        wid=download_pid_wid['wid'],
-        pid=download_pid_wid['pid'],
-        cid=credentials['download_panel_cid'],
-        cmd='FormatChange',
-        params={'ceid': radio_button_widget_cid}
-    )
-    queue.append(command)
-
-    command_queue = {'queue': queue}
-    data = format_data_for_request(
-        credentials['sid'],
-        download_pid_wid['wid'],
-        download_pid_wid['pid'],
-        command_queue,
-        timestamp()
-    )
-    response = send_request(method='POST', data=data)
-    # make json object of parsed response
-    response_data = parse_response(response)
-
-    ev = create_command(
-    wid=download_pid_wid['wid'],
-    pid=download_pid_wid['pid'],
-    cid=credentials['download_panel_cid'],
-    cmd='DownloadReminder',
-    params={}
-    )
-    json_queue = {'queue': [ev]}
-    data = format_data_for_request(
-        credentials['sid'],
-        download_pid_wid['wid'],
-        download_pid_wid['pid'],
-        json_queue,
-        timestamp()
-    )
-    res = send_request(method='POST', data=data)
-    j = parse_response(res)
+    # agreeing and starting the compression too, so Download is only ever sent once
+    print('Compressing data. Please wait...')
+    queue.target(overlay['wid'], overlay['pid'])
+    queue.set_value(cid, ids['agree_checkbox'], ['agreed'], 'Agreed')
+    queue.add(cid, 'Download')
+    try:
+        check_async_id = search_responses(queue.send(), extract_download_job)
+        if check_async_id is None:
+            raise Exception('Could not find the download job.')
 
-    download_pid_wid['wid'] = extract_first_match(r"sys.openOverlay\('(.{5,20})',", j['responses'][2]['data'])
-    download_pid_wid['pid'] = extract_first_match(r",'(.{5,20})',new Object", j['responses'][2]['data'])
+        # Wait until generateDownloadDone is ready
+        wait_for_async(check_async_id, 'is_ready')
 
-    agreement_page = send_request(f"sid={credentials['sid']}&pid={download_pid_wid['pid']}&wid={download_pid_wid['wid']}&mode=page", method="POST")
-    agreement_page_text = agreement_page.text
-    credentials['download_panel_cid'] = extract_first_match(r"'(.{5,20})','Corona2020DownloadReminderButtonsComponent", agreement_page_text)
-    agree_check_box_ceid = extract_first_match(r"createFI\('(.{5,20})','CheckboxWidget'", agreement_page_text)
-    
+        # Get download link
+        print('Data ready.')
+        queue.target(credentials['wid'], credentials['pid']).add(credentials['query_cid'], 'generateDownloadDone')
+        j = queue.send()
+    except StalePanelError as e:
+        # Download has been sent, retrying would start a second compression job
+        raise Exception(f"Download failed after the download job was started: {e}") from e
 
-    # new queue for new command concatenation
-    queue = []
+    logging.debug(f"Download prepared in {queue.round_trips} round trips after selecting entries")
+    if current_span() is not None:
+        current_span().attributes['round_trips'] = queue.round_trips
+    # Extract download URL
+    return get_client().url(j['responses'][0]['data'].split('"')[1])
 
-    command = create_command(
-    wid=download_pid_wid['wid'],
-    pid=download_pid_wid['pid'],
-    cid=credentials['download_panel_cid'],
-    cmd='setTarget',
-    params={'cvalue': ['agreed'], 'ceid': agree_check_box_ceid}
-    )
-    queue.append(command)
-
-    command = create_command(
-        wid=download_pid_wid['wid'],
-        pid=download_pid_wid['pid'],
-        cid=credentials['download_panel_cid'],
-        cmd='ChangeValue',
-        params={'cvalue': ['agreed'], 'ceid': agree_check_box_ceid}
-    )
-    queue.append(command)
-
-    command = create_command(
-        wid=download_pid_wid['wid'],
-        pid=download_pid_wid['pid'],
-        cid=credentials['download_panel_cid'],
-        cmd='Agreed',
-        params={'ceid': agree_check_box_ceid}
-    )
-    queue.append(command)
-
-    command_queue = {'queue': queue}
-    data = format_data_for_request(
-        sid=credentials['sid'],
-        wid=download_pid_wid['wid'],
-        pid=download_pid_wid['pid'],
-        queue=command_queue,
-        timestamp=timestamp()
-    )
-    response = send_request(method='POST', data=data)
-    response_data = parse_response(response)
 
-    logging.debug(response_data)
+def _find_member(tar, suffix):
+    for member in tar.getmembers():
+        if member.isfile() and member.name.endswith(suffix):
+            return member
+    return None
 
-    ev = create_command(
-        wid=download_pid_wid['wid'],
-        pid=download_pid_wid['pid'],
-        cid=credentials['download_panel_cid'],
-        cmd=download_cmd,
-        params={}  # hack for empty {}, direct holdover from R
-    )
-    json_queue = {'queue': [ev]}
-    data = format_data_for_request(
-        sid=credentials['sid'],
-        wid=download_pid_wid['wid'],
-        pid=download_pid_wid['pid'],
-        queue=json_queue,
-        timestamp=timestamp()
-    )
-    print('Compressing data. Please wait...')
-    res = send_request(method='POST', data=data)
-    j = parse_response(res)
-
-    # Send POST request
-    res = requests.post(GISAID.GISAID_URL, headers=GISAID.HEADERS, data=data)
-    j = parse_response(res)
-
-    # Extract check_async
-    check_async_id = j['responses'][0]['data'].split("'")[3]
-
-    # Wait until generateDownloadDone is ready
-    is_ready = False
-    while not is_ready:
-        res = requests.get(f"https://www.epicov.org/epi3/check_async/{check_async_id}?_={timestamp()}")
-        j = parse_response(res)
-        is_ready = j['is_ready']
-        if not is_ready:
-            time.sleep(1)
-
-    # Get download link
-    print('Data ready.')
-    ev = create_command(
-        wid=credentials['wid'],
-        pid=credentials['pid'],
-        cid=credentials['query_cid'],
-        cmd="generateDownloadDone",
-        params={}
+
+@traced('process_download')
+def process_download(credentials, download_url, list_of_accession_ids, get_sequence=True, clean_up=True,
+                     work_dir=None, progress=None, output=None, output_format='parquet', columns=None, predicate=None,
+                     packed=False, content_hash=False, dedupe=False, parse_dates=False):
+    """
+    Fetches a prepared GISAID download and parses it into a polars DataFrame.
+
+    The archive is streamed to disk (resuming on dropped connections) and its members are
+    parsed lazily straight out of the tar file without being extracted, so only the selected
+    columns and rows are materialised.
+
+    Args:
+        credentials (dict): logged in GISAID session.
+        download_url (str): URL returned by the generateDownloadDone command.
+        list_of_accession_ids (list of str | AccessionIDSet): accession IDs that were requested.
+        get_sequence (bool): join the sequences onto the metadata.
+        clean_up (bool): remove the downloaded files afterwards.
+        work_dir (str): directory for the downloaded file, a new temporary directory by default.
+        progress (callable): called as progress(bytes_done, bytes_total) while downloading.
+        output (str): write metadata and sequences to this directory instead of returning them in memory.
+        output_format (str): 'parquet' or 'ipc' (Arrow IPC) files in `output`.
+        columns (list of str): metadata columns to keep, see `metadata.select_metadata`.
+        predicate (pl.Expr): keep only the records matching it.
+        packed (bool): store sequences as 4-bit packed Binary.
+        content_hash (bool): add a `sequence_hash` column.
+        dedupe (bool): keep each distinct sequence once, see `download`.
+        parse_dates (bool): add a pl.Date copy of every date column, see `download`.
+
+    Returns:
+        pl.DataFrame, or a pl.LazyFrame scanning the written files when `output` is given.
+    """
+    import polars as pl
+    from .polars_funcs import scan_fasta
+    from .metadata import scan_metadata, scan_fasta_metadata, select_metadata
+
+    own_work_dir = work_dir is None
+    if own_work_dir:
+        work_dir = tempfile.mkdtemp(prefix='gisaidpy_')
+
+    is_archive = credentials['database'] == 'EpiCoV'
+    # named after the URL so only a partial file of this very download is ever resumed
+    downloadFile = os.path.join(
+        work_dir, f"gisaidr_data_{hashlib.sha1(download_url.encode()).hexdigest()[:12]}{'.tar' if is_archive else '.fasta'}"
     )
-    json_queue = {'queue': [ev]}
-    data = format_data_for_request(credentials['sid'], credentials['wid'], credentials['pid'], json_queue, timestamp())
-    res = send_request(method='POST', data=data)
-    # get final response data for download url
-    j = parse_response(res)
 
-    # Extract download URL
-    download_url = "https://www.epicov.org" + j['responses'][0]['data'].split('"')[1]
-
-    # Attempt download
-    print('Downloading...')
-    if credentials['database'] == 'EpiCoV':
-        tmpTarFile = 'gisaidr_data_tmp.tar'
-        urllib.request.urlretrieve(download_url, tmpTarFile)
-        with tarfile.open(tmpTarFile, 'r') as tar:
-            tar.extractall('gisaidr_data_tmp')
-        metadataFile = glob.glob('gisaidr_data_tmp/*.metadata.tsv')[0]
-        if metadataFile is None:
-            print('gisaid_data files:')
-            print(glob.glob('gisaidr_data_tmp/*'))
-            raise Exception('Could not find metadata file.')
-        df = pl.read_csv(metadataFile, sep='\t', quotechar='')
-        df = df.sort('gisaid_epi_isl', reverse=True)
-        df = df.rename({'gisaid_epi_isl': 'accession_id'})
-        if get_sequence:
-            sequencesFile = glob.glob('gisaidr_data_tmp/*.sequences.fasta')[0]
-            if sequencesFile is None:
-                raise Exception('Could not find sequences file.')
-            seq_df = read_fasta(sequencesFile)
-            df = df.join(seq_df, on='strain', how='outer')
-    else:
-        sequencesFile = 'gisaidr_data_tmp.fasta'
-        urllib.request.urlretrieve(download_url, sequencesFile)
-        fdf = read_fasta(sequencesFile, get_sequence)
-        df = pl.concat([pl.DataFrame({'strain': strain.split('|')}) for strain in fdf['strain']])
-        df = df.reset_index(drop=True)
-        df = df.with_columns({
-            'strain': pl.col('strain'),
-            'accession_id': pl.col('accession_id'),
-            'collection_date': pl.col('collection_date'),
-            'description': pl.col('description')
-        })
-        if get_sequence:
-            df = df.with_column('sequence', pl.col('sequence'))
+    try:
+        print('Downloading...')
+        fetch_file(download_url, downloadFile, progress=progress)
+        if is_archive:
+            with tarfile.open(downloadFile, 'r') as tar:
+                metadataMember = _find_member(tar, '.metadata.tsv')
+                if metadataMember is None:
+                    print('gisaid_data files:')
+                    print(tar.getnames())
+                    raise Exception('Could not find metadata file.')
+                metadata = select_metadata(
+                    scan_metadata(tar.extractfile(metadataMember), parse_dates), list_of_accession_ids, columns, predicate
+                )
+                df = metadata.sort('accession_id', descending=True).collect()
+                sequences = None
+                if get_sequence:
+                    sequencesMember = _find_member(tar, '.sequences.fasta')
+                    if sequencesMember is None:
+                        raise Exception('Could not find sequences file.')
+                    # only the selected records are kept while the FASTA member streams past
+                    sequences = scan_fasta(tar.extractfile(sequencesMember)).filter(
+                        pl.col('strain').is_in(df['strain'].to_list())
+                    )
+                df = _finish_download(df, sequences, output, output_format, packed, content_hash, dedupe)
+        else:
+            metadata = select_metadata(
+                scan_fasta_metadata(downloadFile, get_sequence, parse_dates), list_of_accession_ids, columns, predicate
+            )
+            df = metadata.sort('accession_id', descending=True).collect()
+            sequences = None
+            if get_sequence:
+                sequences = df.lazy().select('strain', 'sequence')
+                df = df.drop('sequence')
+            df = _finish_download(df, sequences, output, output_format, packed, content_hash, dedupe)
+    except Exception:
+        # a partial download in a caller provided work_dir is kept so the next call can resume it
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        raise
 
     # Clean up
     if clean_up:
-        if credentials['database'] == 'EpiCoV':
-            if os.path.exists(tmpTarFile):
-                os.remove(tmpTarFile)
-            if os.path.exists('gisaidr_data_tmp'):
-                shutil.rmtree('gisaidr_data_tmp')
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        elif os.path.exists(downloadFile):
+            os.remove(downloadFile)
+    else:
+        logging.info(f"Downloaded files kept in {work_dir}")
+
+    return df
+
+
+def _finish_download(metadata, sequences, output, output_format, packed=False, content_hash=False, dedupe=False):
+    # sequences is a LazyFrame, only collected here when no output directory was asked for
+    from .output import write_output
+
+    if sequences is None:
+        if output is not None:
+            return write_output(metadata, None, output, output_format)
+        return metadata
+    if content_hash or dedupe:
+        from .polars_funcs import sequence_hash
+        # hashed before packing, so hashes do not depend on the storage format
+        sequences = sequences.with_columns(sequence_hash())
+    if packed:
+        from .packed import pack
+        sequences = sequences.with_columns(pack())
+    if output is not None:
+        return write_output(metadata, sequences, output, output_format, dedupe)
+    sequences = sequences.collect()
+    if dedupe:
+        from .dedup import deduplicate, attach_sequences
+        records, unique = deduplicate(sequences)
+        metadata = metadata.join(records, on='strain', how='left')
+        return attach_sequences(metadata, unique)
+    return metadata.join(sequences, on='strain', how='left')
+
+
+def _batch_key(batch, *options):
+    key = ",".join(batch)
+    # filtered batches must not be mistaken for complete ones when resuming
+    if any(option is not None for option in options):
+        key += repr([str(option) for option in options])
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def download_bulk(credentials, list_of_accession_ids, get_sequence=True, batch_size=MAX_BATCH_SIZE,
+                  max_workers=4, retries=2, checkpoint_dir=None, cache=None, output=None, output_format='parquet',
+                  columns=None, predicate=None, packed=False, content_hash=False, dedupe=False, progress=None,
+                  parse_dates=False):
+    """
+    Downloads any number of accession IDs by splitting them into server-sized batches.
+
+    A GISAID session holds a single selection at a time, so batches only run concurrently
+    across sessions: pass a list of credentials (one per login) to download several batches
+    at once. Finished batches are written to `checkpoint_dir` as Parquet and skipped when
+    the same call is repeated, so an interrupted bulk download resumes where it stopped.
+
+    Args:
+        credentials (dict | list of dict): one or more logged in GISAID sessions.
+        list_of_accession_ids (list of str | AccessionIDSet): accession IDs to download; a set
+            is split into batches of consecutive IDs.
+        get_sequence (bool): also download the sequences.
+        batch_size (int): accession IDs per batch, at most 5000.
+        max_workers (int): maximum number of batches downloading at the same time.
+        retries (int): number of times a failed batch is retried before giving up.
+        checkpoint_dir (str): directory to store finished batches in for resuming.
+        cache (RecordCache): only download the accession IDs missing from this cache, and add them to it.
+        output (str): write every batch into its own subdirectory of `output` instead of keeping
+            it in memory; finished batches double as checkpoints.
+        output_format (str): 'parquet' or 'ipc' (Arrow IPC) files in `output`.
+        columns (list of str): metadata columns to keep, see `download`.
+        predicate (pl.Expr): keep only the records matching it.
+        packed (bool): store sequences as 4-bit packed Binary.
+        content_hash (bool): add a `sequence_hash` column.
+        dedupe (bool): keep each distinct sequence of a batch once, see `download`.
+        progress (callable): called as progress(batches_done, batches_total) after every finished batch.
+        parse_dates (bool): add a pl.Date copy of every date column, see `download`.
+
+    Returns:
+        pl.DataFrame with the rows of every batch, or a pl.LazyFrame scanning them when `output` is given.
+    """
+    import polars as pl
+    from .accession import AccessionIDSet
+    from .output import output_files, scan_output
+
+    if not 0 < batch_size <= MAX_BATCH_SIZE:
+        raise ValueError(f'batch_size must be between 1 and {MAX_BATCH_SIZE}.')
+    if len(list_of_accession_ids) == 0:
+        raise ValueError('Select at least one sequence!')
+
+    if cache is not None and output is not None:
+        raise ValueError('cache and output cannot be combined.')
+    if cache is not None and (columns is not None or predicate is not None or packed or content_hash or dedupe
+                              or parse_dates):
+        raise ValueError(
+            'cache only stores complete records and cannot be combined with columns, predicate, packed, '
+            'content_hash, dedupe or parse_dates.'
+        )
+
+    if not isinstance(list_of_accession_ids, AccessionIDSet):
+        list_of_accession_ids = list(dict.fromkeys(list_of_accession_ids))
+    cached = None
+    if cache is not None:
+        cached, list_of_accession_ids = cache.get(list_of_accession_ids, get_sequence)
+        if not list_of_accession_ids:
+            return cached
+    batches = [list_of_accession_ids[i:i + batch_size] for i in range(0, len(list_of_accession_ids), batch_size)]
+
+    sessions = queue.Queue()
+    for session in (credentials if isinstance(credentials, (list, tuple)) else [credentials]):
+        sessions.put(session)
+    max_workers = max(1, min(max_workers, sessions.qsize(), len(batches)))
+
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def batch_key(batch):
+        # metadata-only batches must not be reused by calls that want the sequences
+        options = (columns, predicate, packed or None, content_hash or None, dedupe or None,
+                   None if get_sequence else False, parse_dates or None)
+        return _batch_key(batch, *options)
+
+    def checkpoint_path(batch):
+        return os.path.join(checkpoint_dir, f"batch_{batch_key(batch)}.parquet")
+
+    def batch_output(batch):
+        return os.path.join(output, f"batch_{batch_key(batch)}")
+
+    def run_batch(batch):
+        if output is not None:
+            metadata_file, sequences_file = output_files(batch_output(batch), output_format)
+            if os.path.exists(metadata_file) and (not get_sequence or os.path.exists(sequences_file)):
+                return None
+        elif checkpoint_dir is not None and os.path.exists(checkpoint_path(batch)):
+            return pl.read_parquet(checkpoint_path(batch))
+
+        for attempt in range(retries + 1):
+            session = sessions.get()
+            try:
+                # download() updates the panel ids on the credentials it is given
+                df = download(
+                    dict(session), batch, get_sequence=get_sequence, cache=cache,
+                    output=batch_output(batch) if output is not None else None, output_format=output_format,
+                    columns=columns, predicate=predicate, packed=packed, content_hash=content_hash, dedupe=dedupe,
+                    parse_dates=parse_dates
+                )
+                break
+            except Exception as e:
+                logging.warning(f"Batch of {len(batch)} failed (attempt {attempt + 1}/{retries + 1}): {e}")
+                if attempt == retries:
+                    raise
+            finally:
+                sessions.put(session)
+            time.sleep(2 ** attempt)
+
+        if output is not None:
+            return None
+        if checkpoint_dir is not None:
+            tmp_path = checkpoint_path(batch) + '.tmp'
+            df.write_parquet(tmp_path)
+            os.replace(tmp_path, checkpoint_path(batch))
+        return df
+
+    frames = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_batch, batch): i for i, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                frames[i] = future.result()
+                print(f'Batch {len(frames)}/{len(batches)} done.')
+                if progress is not None:
+                    progress(len(frames), len(batches))
+            except Exception as e:
+                failed.append(i)
+                logging.warning(f"Batch {i} failed after {retries + 1} attempts: {e}")
+
+    if failed:
+        if output is not None:
+            hint = 'rerun with the same output to resume'
+        elif checkpoint_dir is not None:
+            hint = 'rerun with the same checkpoint_dir to resume'
         else:
-            if os.path.exists(sequencesFile):
-                os.remove(sequencesFile)
+            hint = 'pass checkpoint_dir to keep finished batches'
+        raise Exception(f"{len(failed)} of {len(batches)} batches failed, {hint}.")
 
-    df = df.replace('?', pl.NA)
+    if output is not None:
+        # only this call's batches, `output` may hold batches of earlier calls
+        return scan_output([batch_output(batch) for batch in batches], output_format)
 
-    return df
+    frames = [frames[i] for i in range(len(batches))]
+    if cached is not None:
+        frames.insert(0, cached)
+    return pl.concat(frames, how='diagonal_relaxed')
 
 
 if __name__ == "__main__":
-    download(credentials, list_of_accession_ids)
\ No newline at end of file
+    from .cli import cli
+    cli()
\ No newline at end of file
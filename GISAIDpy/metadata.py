@@ -0,0 +1,108 @@
+"""
+Script containing the lazy parsing of downloaded GISAID metadata.
+
+Both sources are exposed as polars LazyFrames: the `*.metadata.tsv` member of EpiCoV archives,
+and the `strain|accession_id|date|...` FASTA headers of EpiRSV and EpiPox downloads. Filters
+and column selections given to `select_metadata` are pushed down into the scans, so only
+the requested columns and rows are parsed.
+
+"""
+
+import polars as pl
+from .accession import AccessionIDSet
+from .polars_funcs import scan_fasta
+
+# columns typed on read, every other column of the TSV stays a string
+METADATA_SCHEMA = {
+    'length': pl.Int64,
+}
+
+DATE_COLUMNS = ['date', 'date_submitted', 'collection_date']
+# the parsed copy of a date column is named after it with this suffix
+PARSED_DATE_SUFFIX = '_parsed'
+
+HEADER_FIELDS = ['strain', 'accession_id', 'collection_date', 'description']
+
+NULL_VALUES = ['?']
+
+
+def _parse_dates(lf, parse_dates):
+    if not parse_dates:
+        return lf
+    columns = [c for c in DATE_COLUMNS if c in lf.collect_schema()]
+    # incomplete dates such as 2021-03 or 2021-03-XX are null in the parsed copy only, the raw
+    # string column keeps them
+    return lf.with_columns(
+        pl.col(columns).str.to_date('%Y-%m-%d', strict=False).name.suffix(PARSED_DATE_SUFFIX)
+    )
+
+
+def scan_metadata(file, parse_dates=False):
+    """
+    Lazily scans an EpiCoV metadata TSV.
+
+    Args:
+        file (str | file object): path or open binary file, e.g. a tar member.
+        parse_dates (bool): add a pl.Date copy of every date column, e.g. `date_parsed`, null
+            for incomplete dates.
+
+    Returns:
+        pl.LazyFrame with `gisaid_epi_isl` renamed to `accession_id` and '?' read as null.
+    """
+    lf = pl.scan_csv(
+        file, separator='\t', quote_char=None, null_values=NULL_VALUES, infer_schema=False,
+        schema_overrides=METADATA_SCHEMA
+    )
+    lf = lf.rename({'gisaid_epi_isl': 'accession_id'})
+    return _parse_dates(lf, parse_dates)
+
+
+def scan_fasta_metadata(file, get_sequence=True, parse_dates=False):
+    """
+    Lazily scans an EpiRSV/EpiPox FASTA, splitting its headers into metadata columns.
+
+    Args:
+        file (str | file object): FASTA path or open file object.
+        get_sequence (bool): keep the `sequence` column.
+        parse_dates (bool): add `collection_date_parsed`, a pl.Date copy of `collection_date`.
+
+    Returns:
+        pl.LazyFrame with the HEADER_FIELDS columns (null when a header has fewer fields),
+        and `sequence` if requested.
+    """
+    header = pl.col('strain').str.splitn('|', len(HEADER_FIELDS)).struct.rename_fields(HEADER_FIELDS)
+    lf = scan_fasta(file, get_sequence=get_sequence).with_columns(header.alias('header'))
+    lf = lf.drop('strain').unnest('header').with_columns(
+        [pl.when(pl.col(c).is_in(NULL_VALUES)).then(None).otherwise(pl.col(c)).alias(c) for c in HEADER_FIELDS]
+    )
+    lf = lf.select(HEADER_FIELDS + (['sequence'] if get_sequence else []))
+    return _parse_dates(lf, parse_dates)
+
+
+def select_metadata(lf, accession_ids=None, columns=None, predicate=None):
+    """
+    Narrows a metadata LazyFrame down to the wanted rows and columns.
+
+    Args:
+        lf (pl.LazyFrame): from `scan_metadata` or `scan_fasta_metadata`.
+        accession_ids (list of str | AccessionIDSet): keep only these records.
+        columns (list of str): keep only these columns; `accession_id` and `strain` are always
+            kept since downloads join on them, as is the parsed copy of a kept date column.
+        predicate (pl.Expr): keep only rows matching it, e.g. a date range.
+    """
+    if isinstance(accession_ids, AccessionIDSet):
+        # joined rather than is_in, which no longer takes a Series of the column's own type
+        lf = lf.join(accession_ids.to_frame().lazy(), on='accession_id', how='semi')
+    elif accession_ids is not None:
+        lf = lf.filter(pl.col('accession_id').is_in(list(accession_ids)))
+    if predicate is not None:
+        lf = lf.filter(predicate)
+    if columns is not None:
+        keep = ['accession_id', 'strain'] + [c for c in columns if c not in ('accession_id', 'strain')]
+        schema = lf.collect_schema()
+        parsed = [c + PARSED_DATE_SUFFIX for c in keep if c + PARSED_DATE_SUFFIX in schema]
+        keep += [c for c in parsed if c not in keep]
+        if 'sequence' in schema and 'sequence' not in keep:
+            keep.append('sequence')
+        lf = lf.select(keep)
+    return lf
@@ -0,0 +1,124 @@
+"""
+Script containing the columnar (Parquet / Arrow IPC) output mode of download().
+
+Metadata and sequences are written to separate files in an output directory so sequences can
+be streamed to disk without ever holding them all in memory, and read back lazily.
+
+"""
+
+import glob
+import os
+import polars as pl
+from .polars_funcs import HASH_COLUMN
+from .dedup import unique_sequences
+
+OUTPUT_FORMATS = {'parquet': 'parquet', 'ipc': 'arrow'}
+
+# repetitive string columns of GISAID metadata, dictionary encoded on write; a fixed list so
+# every file of a bulk download gets the same schema
+LOW_CARDINALITY_COLUMNS = [
+    'virus', 'region', 'country', 'division', 'location', 'region_exposure', 'country_exposure',
+    'division_exposure', 'segment', 'host', 'sex', 'Nextstrain_clade', 'pango_lineage', 'GISAID_clade',
+    'purpose_of_sequencing',
+]
+
+
+def _check_format(output_format):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {list(OUTPUT_FORMATS)}, not '{output_format}'.")
+    return OUTPUT_FORMATS[output_format]
+
+
+def output_files(output, output_format='parquet'):
+    """
+    Returns the metadata and sequences file paths of an output directory.
+    """
+    extension = _check_format(output_format)
+    return os.path.join(output, f"metadata.{extension}"), os.path.join(output, f"sequences.{extension}")
+
+
+def encode_low_cardinality(df, columns=LOW_CARDINALITY_COLUMNS):
+    """
+    Casts the repetitive string columns of `df` (country, host, lineage, ...) to Categorical,
+    which both formats store dictionary encoded.
+    """
+    columns = [name for name in columns if df.schema.get(name) == pl.Utf8]
+    return df.with_columns(pl.col(columns).cast(pl.Categorical))
+
+
+def _sink(lf, file, output_format):
+    if output_format == 'parquet':
+        lf.sink_parquet(file)
+    else:
+        lf.sink_ipc(file)
+
+
+def write_output(metadata, sequences, output, output_format='parquet', dedupe=False):
+    """
+    Writes `metadata` (DataFrame) and `sequences` (LazyFrame with `strain` and `sequence`) into
+    `output`. The sequences are streamed, so memory stays flat however many there are.
+
+    With `dedupe`, `sequences` also needs a `sequence_hash` column: each distinct sequence is then
+    written once, keyed by its hash, and the metadata gets the `sequence_hash` of every record.
+
+    Returns:
+        pl.LazyFrame scanning the written files, see `scan_output`.
+    """
+    metadata_file, sequences_file = output_files(output, output_format)
+    os.makedirs(output, exist_ok=True)
+    # files are renamed into place once complete, so their presence marks a finished download
+    if sequences is not None:
+        _sink(sequences, sequences_file + '.tmp', output_format)
+        if dedupe:
+            # a file object source can only be read once, so the hashes of the records and the
+            # distinct sequences are both taken from the streamed file
+            scan = pl.scan_parquet if output_format == 'parquet' else pl.scan_ipc
+            written = scan(sequences_file + '.tmp')
+            hashes = written.select('strain', HASH_COLUMN).collect()
+            metadata = metadata.join(hashes, on='strain', how='left', maintain_order='left')
+            _sink(unique_sequences(written), sequences_file + '.unique', output_format)
+            os.replace(sequences_file + '.unique', sequences_file)
+            os.remove(sequences_file + '.tmp')
+        else:
+            os.replace(sequences_file + '.tmp', sequences_file)
+    metadata = encode_low_cardinality(metadata)
+    if output_format == 'parquet':
+        metadata.write_parquet(metadata_file + '.tmp')
+    else:
+        metadata.write_ipc(metadata_file + '.tmp')
+    os.replace(metadata_file + '.tmp', metadata_file)
+    return scan_output(output, output_format)
+
+
+def scan_output(output, output_format='parquet'):
+    """
+    Lazily scans an output directory written by download(output=...), a directory of such
+    directories as written by download_bulk(output=...), or a list of such directories, joining
+    sequences onto the metadata, by `sequence_hash` for directories written with `dedupe`.
+    """
+    if isinstance(output, (list, tuple)):
+        files = [output_files(directory, output_format) for directory in output]
+        metadata_files = [metadata for metadata, _ in files]
+        sequences_files = [sequences for _, sequences in files if os.path.exists(sequences)]
+        missing = [metadata for metadata in metadata_files if not os.path.exists(metadata)]
+        if missing:
+            raise FileNotFoundError(f"No downloaded metadata found at {missing[0]}.")
+    else:
+        metadata_files, sequences_files = output_files(output, output_format)
+        if not os.path.exists(metadata_files):
+            metadata_files, sequences_files = output_files(os.path.join(output, '*'), output_format)
+            if not glob.glob(metadata_files):
+                raise FileNotFoundError(f"No downloaded metadata found in {output}.")
+        if not glob.glob(sequences_files):
+            sequences_files = []
+
+    scan = pl.scan_parquet if output_format == 'parquet' else pl.scan_ipc
+    lf = scan(metadata_files)
+    if sequences_files:
+        sequences = scan(sequences_files)
+        if 'strain' in sequences.collect_schema():
+            lf = lf.join(sequences, on='strain', how='left')
+        else:
+            # every directory holds its own distinct sequences, which may repeat across directories
+            lf = lf.join(sequences.unique(HASH_COLUMN, keep='any'), on=HASH_COLUMN, how='left')
+    return lf
@@ -0,0 +1,258 @@
+"""
+Script containing the compact packed representation of nucleotide sequences.
+
+Every base is stored as a 4-bit IUPAC code, two per byte, using the bit-mask alphabet of BAM
+files (A=1, C=2, G=4, T=8, ambiguity codes are their OR, N=15, gap=0). Stretches of N, which
+make up much of low coverage genomes, are run-length encoded instead of stored base by base.
+A packed sequence is a plain `bytes` object, so a column of them is a polars Binary column.
+
+Layout, all integers little-endian uint32:
+    length, number of N runs, (start, length) of every N run, packed codes of the other bases
+
+Lowercase bases are stored uppercase, U as T, and characters outside the IUPAC alphabet as N.
+
+"""
+
+import struct
+import numpy as np
+import polars as pl
+
+ALPHABET = b'-ACMGRSVTWYHKDBN'
+N_CODE = 15
+# shorter stretches of N are cheaper to store as codes than as a run
+MIN_N_RUN = 8
+
+_HEADER = struct.Struct('<II')
+
+_ENCODE = np.full(256, N_CODE, dtype=np.uint8)
+for _code, _base in enumerate(ALPHABET):
+    _ENCODE[_base] = _code
+    _ENCODE[ord(chr(_base).lower())] = _code
+_ENCODE[ord('U')] = _ENCODE[ord('u')] = _ENCODE[ord('T')]
+_ENCODE[ord('.')] = 0
+_DECODE = np.frombuffer(ALPHABET, dtype=np.uint8)
+
+
+def _nibble_counts(codes):
+    # table of how many codes of `codes` the two nibbles of every byte value hold
+    hits = np.isin(np.arange(16), codes).astype(np.uint8)
+    return hits[np.arange(256) >> 4] + hits[np.arange(256) & 15]
+
+
+_N_COUNT = _nibble_counts([N_CODE])
+_GC_COUNT = _nibble_counts([2, 4])
+_UNAMBIGUOUS_COUNT = _nibble_counts([1, 2, 4, 8])
+
+
+def _run_mask(size, starts, lengths):
+    # True inside the runs, which never overlap
+    in_run = np.zeros(size + 1, dtype=np.int8)
+    np.add.at(in_run, starts, 1)
+    np.add.at(in_run, starts + lengths, -1)
+    return np.cumsum(in_run[:-1], dtype=np.int8).view(bool)
+
+
+def encode_sequences(sequences):
+    """
+    Packs a list of sequences (str or bytes) into a list of bytes.
+
+    The whole batch is encoded with a handful of vectorized passes over its concatenated bases.
+    """
+    sequences = [s.encode() if isinstance(s, str) else s for s in sequences]
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    codes = _ENCODE[np.frombuffer(b''.join(sequences), dtype=np.uint8)]
+
+    # runs of N, cut at record boundaries
+    is_n = codes == N_CODE
+    record_start = np.zeros(len(codes) + 1, dtype=bool)
+    record_start[offsets] = True
+    begins = is_n & (record_start[:-1] | ~np.concatenate(([False], is_n[:-1])))
+    ends = is_n & (record_start[1:] | ~np.concatenate((is_n[1:], [False])))
+    run_starts, run_ends = np.flatnonzero(begins), np.flatnonzero(ends) + 1
+    long_runs = run_ends - run_starts >= MIN_N_RUN
+    run_starts, run_lengths = run_starts[long_runs], (run_ends - run_starts)[long_runs]
+    run_records = np.searchsorted(offsets, run_starts, side='right') - 1
+    run_offsets = np.concatenate(([0], np.cumsum(np.bincount(run_records, minlength=len(sequences)))))
+
+    # the other bases, padded with a gap to a whole byte per record
+    if len(run_starts):
+        codes = codes[~_run_mask(len(codes), run_starts, run_lengths)]
+    stored = lengths - np.bincount(run_records, weights=run_lengths, minlength=len(sequences)).astype(np.int64)
+    odd = stored % 2 == 1
+    codes = np.insert(codes, np.cumsum(stored)[odd], 0)
+    body = (codes[0::2] << 4) | codes[1::2]
+    body_offsets = np.concatenate(([0], np.cumsum((stored + odd) // 2)))
+
+    runs = np.column_stack((run_starts - offsets[run_records], run_lengths)).astype('<u4')
+    return [
+        _HEADER.pack(lengths[i], run_offsets[i + 1] - run_offsets[i])
+        + runs[run_offsets[i]:run_offsets[i + 1]].tobytes()
+        + body[body_offsets[i]:body_offsets[i + 1]].tobytes()
+        for i in range(len(sequences))
+    ]
+
+
+def encode_sequence(sequence):
+    """
+    Packs a sequence (str or bytes) into bytes.
+    """
+    return encode_sequences([sequence])[0]
+
+
+def _parse(data):
+    length, n_runs = _HEADER.unpack_from(data)
+    runs = np.frombuffer(data, dtype='<u4', count=2 * n_runs, offset=_HEADER.size).reshape(-1, 2).astype(np.int64)
+    return length, runs[:, 0], runs[:, 1], _HEADER.size + 8 * n_runs
+
+
+def slice_sequence(data, start=0, end=None):
+    """
+    Decodes bases `start` to `end` of a packed sequence, reading only the bytes covering them.
+    """
+    length, run_starts, run_lengths, offset = _parse(data)
+    start, end, _ = slice(start, end).indices(length)
+    if end <= start:
+        return ''
+
+    # position of a base among the stored codes, i.e. without the N runs before it
+    def stored(position):
+        return position - int(np.clip(position - run_starts, 0, run_lengths).sum())
+
+    first, last = stored(start), stored(end)
+    body = np.frombuffer(data, dtype=np.uint8, offset=offset + first // 2, count=(last + 1) // 2 - first // 2)
+    codes = np.empty(2 * len(body), dtype=np.uint8)
+    codes[0::2], codes[1::2] = body >> 4, body & 15
+    codes = codes[first % 2:first % 2 + last - first]
+
+    out = np.full(end - start, N_CODE, dtype=np.uint8)
+    in_run = np.zeros(end - start + 1, dtype=np.int32)
+    for run_start, run_length in zip(run_starts, run_lengths):
+        lo, hi = max(run_start, start) - start, min(run_start + run_length, end) - start
+        if lo < hi:
+            in_run[lo] += 1
+            in_run[hi] -= 1
+    out[np.cumsum(in_run[:-1]) == 0] = codes
+    return _DECODE[out].tobytes().decode()
+
+
+def decode_sequences(packed):
+    """
+    Unpacks a list of packed sequences into a list of str, vectorized over the whole batch.
+    """
+    lengths, runs, bodies = [], [], []
+    for data in packed:
+        length, run_starts, run_lengths, offset = _parse(data)
+        lengths.append(length)
+        runs.append((run_starts, run_lengths))
+        bodies.append(data[offset:])
+    lengths = np.array(lengths, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    body = np.frombuffer(b''.join(bodies), dtype=np.uint8)
+    codes = np.empty(2 * len(body), dtype=np.uint8)
+    codes[0::2], codes[1::2] = body >> 4, body & 15
+    run_starts = np.concatenate([r[0] + offsets[i] for i, r in enumerate(runs)] or [np.zeros(0, np.int64)])
+    run_lengths = np.concatenate([r[1] for r in runs] or [np.zeros(0, np.int64)])
+    stored = lengths - np.array([r[1].sum() for r in runs], dtype=np.int64)
+    odd = stored % 2 == 1
+    # drop the padding gaps, then put the N runs back
+    codes = np.delete(codes, (np.cumsum(stored + odd) - 1)[odd])
+    out = np.full(offsets[-1], N_CODE, dtype=np.uint8)
+    out[~_run_mask(len(out), run_starts, run_lengths)] = codes
+    text = _DECODE[out].tobytes()
+    return [text[offsets[i]:offsets[i + 1]].decode() for i in range(len(lengths))]
+
+
+def decode_sequence(data):
+    """
+    Unpacks a packed sequence into a str.
+    """
+    return decode_sequences([data])[0]
+
+
+def sequence_length(data):
+    return _HEADER.unpack_from(data)[0]
+
+
+def pack_sequences(sequences):
+    """
+    Packs a Utf8 Series of sequences into a Binary Series, nulls stay null.
+    """
+    values = sequences.to_list()
+    present = [i for i, s in enumerate(values) if s is not None]
+    for i, data in zip(present, encode_sequences([values[i] for i in present])):
+        values[i] = data
+    return pl.Series(sequences.name, values, dtype=pl.Binary)
+
+
+def unpack_sequences(packed):
+    """
+    Unpacks a Binary Series of packed sequences into a Utf8 Series.
+    """
+    values = packed.to_list()
+    present = [i for i, p in enumerate(values) if p is not None]
+    for i, sequence in zip(present, decode_sequences([values[i] for i in present])):
+        values[i] = sequence
+    return pl.Series(packed.name, values, dtype=pl.Utf8)
+
+
+def pack(column='sequence'):
+    """
+    Expression packing a Utf8 sequence column, usable lazily and in streaming sinks.
+    """
+    return pl.col(column).map_batches(pack_sequences, return_dtype=pl.Binary)
+
+
+def unpack(column='sequence'):
+    """
+    Expression unpacking a packed sequence column back into strings.
+    """
+    return pl.col(column).map_batches(unpack_sequences, return_dtype=pl.Utf8)
+
+
+def packed_stats(packed):
+    """
+    Computes the `polars_funcs.sequence_stats` columns straight from packed sequences.
+
+    The packed bytes are counted through lookup tables covering both nibbles of a byte, so
+    nothing is decoded.
+
+    Returns:
+        pl.DataFrame with length, n_count, ambiguous_fraction and gc_content.
+    """
+    lengths, n_runs, bodies = [], [], []
+    missing = packed.is_null().to_numpy()
+    for data in packed:
+        if data is None:
+            data = _HEADER.pack(0, 0)
+        length, run_starts, run_lengths, offset = _parse(data)
+        lengths.append(length)
+        n_runs.append(int(run_lengths.sum()))
+        # the padding nibble of odd lengths is a gap, which none of the tables count
+        bodies.append(data[offset:])
+
+    sizes = np.array([len(body) for body in bodies], dtype=np.int64)
+    buffer = np.frombuffer(b''.join(bodies), dtype=np.uint8)
+    bounds = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    def count(table):
+        counts = np.zeros(len(sizes), dtype=np.int64)
+        filled = sizes > 0
+        if filled.any():
+            counts[filled] = np.add.reduceat(table[buffer], bounds[filled], dtype=np.int64)
+        return counts
+
+    length = np.array(lengths, dtype=np.int64)
+    n_count = count(_N_COUNT) + np.array(n_runs, dtype=np.int64)
+    gc = count(_GC_COUNT)
+    unambiguous = count(_UNAMBIGUOUS_COUNT)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = pl.DataFrame({
+            'length': length,
+            'n_count': n_count,
+            'ambiguous_fraction': (length - unambiguous) / length,
+            'gc_content': gc / unambiguous,
+        })
+    # null sequences get null statistics
+    return stats.with_columns(pl.when(pl.lit(pl.Series(missing))).then(None).otherwise(pl.all()).name.keep())
@@ -2,27 +2,307 @@
 File containing functions pertaining to polars implementation of fasta reading.
 """
 
+import gzip
+import hashlib
+import mmap
+import os
 import polars as pl
+from .packed import pack
 
-def read_fasta(file=None, get_sequence=True):
-    fasta_lines = pl.read_csv(file, sep='\n').to_list("a").flatten()
+DEFAULT_BATCH_SIZE = 10000
 
-    # Get sequence names
-    seq_name_index = [i for i, line in enumerate(fasta_lines) if line.startswith(">")]
-    strain = [line[1:] for line in fasta_lines[seq_name_index]]
+FASTA_SCHEMA = {'strain': pl.Utf8, 'sequence': pl.Utf8}
 
+HASH_COLUMN = 'sequence_hash'
+# 128 bits keep collisions out of reach for any number of sequences GISAID will ever hold
+HASH_SIZE = 16
+
+
+def _fasta_schema(get_sequence=True, packed=False, content_hash=False):
+    schema = {'strain': pl.Utf8}
     if get_sequence:
-        # Get sequence
-        seq_aa_start_index = [i + 1 for i in seq_name_index]
-        seq_aa_end_index = seq_name_index[1:] + [len(fasta_lines)]
-        sequence = ["".join(fasta_lines[start:end]).replace(" ", "") for start, end in zip(seq_aa_start_index, seq_aa_end_index)]
-
-        return pl.DataFrame({
-            "strain": strain,
-            "sequence": sequence
-        })
-    else:
-        return pl.DataFrame({
-            "strain": strain
-        })
+        schema['sequence'] = pl.Binary if packed else pl.Utf8
+    if content_hash:
+        schema[HASH_COLUMN] = pl.Utf8
+    return schema
+
+
+def _open_fasta(file):
+    """
+    Returns a binary line iterator over `file` and whether the caller owns it.
+
+    Args:
+        file (str | os.PathLike | file object): path to a (optionally gzipped) FASTA
+            file, or an already opened file object in binary or text mode.
+    """
+    if hasattr(file, 'read'):
+        return file, False
+    path = str(file)
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb'), True
+    return open(path, 'rb'), True
+
+
+def _fasta_batch(strain, sequence=None):
+    columns = {'strain': pl.Series('strain', strain, dtype=pl.Utf8)}
+    if sequence is not None:
+        columns['sequence'] = pl.Series('sequence', sequence, dtype=pl.Utf8)
+    return pl.DataFrame(columns)
+
+
+def iter_fasta(file, batch_size=DEFAULT_BATCH_SIZE, get_sequence=True):
+    """
+    Streams a FASTA file as polars DataFrames of at most `batch_size` records.
+
+    Only the records of the current batch are held in memory, so arbitrarily large
+    EpiCoV `*.sequences.fasta` files can be processed in bounded memory.
+
+    Args:
+        file (str | os.PathLike | file object): FASTA path or open file object.
+        batch_size (int): maximum number of records per yielded batch.
+        get_sequence (bool): also assemble the `sequence` column.
+
+    Yields:
+        pl.DataFrame with a `strain` column and, if requested, a `sequence` column.
+    """
+    if batch_size < 1:
+        raise ValueError('batch_size must be a positive integer.')
+
+    handle, owned = _open_fasta(file)
+    strain, sequence = [], []
+    header, chunks = None, []
+    try:
+        for line in handle:
+            if isinstance(line, str):
+                line = line.encode()
+            line = line.rstrip()
+            if not line:
+                continue
+            if line[:1] == b'>':
+                if header is not None:
+                    strain.append(header)
+                    if get_sequence:
+                        sequence.append(b''.join(chunks).decode())
+                    if len(strain) >= batch_size:
+                        yield _fasta_batch(strain, sequence if get_sequence else None)
+                        strain, sequence = [], []
+                header = line[1:].decode()
+                chunks = []
+            elif get_sequence and header is not None:
+                chunks.append(line.replace(b' ', b''))
+
+        if header is not None:
+            strain.append(header)
+            if get_sequence:
+                sequence.append(b''.join(chunks).decode())
+        if strain:
+            yield _fasta_batch(strain, sequence if get_sequence else None)
+    finally:
+        if owned:
+            handle.close()
+
+
+def scan_fasta(file, batch_size=DEFAULT_BATCH_SIZE, get_sequence=True):
+    """
+    Lazily scans a FASTA file into a polars LazyFrame backed by `iter_fasta`.
+
+    Column projection is pushed down, so selecting only `strain` skips sequence
+    assembly entirely. When `file` is a file object the LazyFrame can only be
+    collected once.
+    """
+    from polars.io.plugins import register_io_source
+
+    schema = _fasta_schema(get_sequence)
+
+    def source(with_columns, predicate, n_rows, source_batch_size):
+        need_sequence = get_sequence and (with_columns is None or 'sequence' in with_columns)
+        remaining = n_rows
+        for batch in iter_fasta(file, source_batch_size or batch_size, need_sequence):
+            if predicate is not None:
+                batch = batch.filter(predicate)
+            if with_columns is not None:
+                batch = batch.select(with_columns)
+            if remaining is not None:
+                batch = batch.head(remaining)
+                remaining -= batch.height
+            yield batch
+            if remaining is not None and remaining <= 0:
+                break
+
+    return register_io_source(source, schema=schema)
+
+
+def _count_bases(sequence, bases):
+    # literal counts are searched with memchr, much faster than a character class regex; added
+    # with + rather than sum_horizontal so a null sequence gets a null count
+    counts = [sequence.str.count_matches(base, literal=True) for base in bases]
+    return sum(counts[1:], counts[0])
+
+
+def sequence_stats(column='sequence'):
+    """
+    Returns expressions computing per-sequence statistics from a sequence column.
+
+    Columns:
+        length: number of bases.
+        n_count: number of N bases.
+        ambiguous_fraction: share of bases other than A, C, G and T (N included).
+        gc_content: share of G and C among the unambiguous bases.
+    """
+    sequence = pl.col(column)
+    length = sequence.str.len_bytes()
+    gc = _count_bases(sequence, 'GCgc')
+    unambiguous = gc + _count_bases(sequence, 'ATat')
+    return [
+        length.alias('length'),
+        _count_bases(sequence, 'Nn').alias('n_count'),
+        ((length - unambiguous) / length).alias('ambiguous_fraction'),
+        (gc / unambiguous).alias('gc_content'),
+    ]
+
+
+def with_sequence_stats(df, column='sequence'):
+    """
+    Adds the `sequence_stats` columns to a DataFrame or LazyFrame.
+    """
+    return df.with_columns(sequence_stats(column))
+
+
+def hash_sequences(sequences):
+    """
+    Hashes a Utf8 Series of sequences into a Utf8 Series of hex BLAKE2b digests, nulls stay null.
+
+    The digest only depends on the sequence text, so it is stable across runs, machines and
+    polars versions and can be compared with hashes stored by earlier downloads.
+    """
+    blake2b = hashlib.blake2b
+    values = [
+        None if s is None else blake2b(s, digest_size=HASH_SIZE).hexdigest()
+        for s in sequences.cast(pl.Binary).to_list()
+    ]
+    return pl.Series(HASH_COLUMN, values, dtype=pl.Utf8)
+
+
+def sequence_hash(column='sequence'):
+    """
+    Expression computing the `sequence_hash` column from a Utf8 sequence column.
+    """
+    return pl.col(column).map_batches(hash_sequences, return_dtype=pl.Utf8).alias(HASH_COLUMN)
+
+
+def _read_buffer(file):
+    # memory map plain files, other inputs have to be read into memory
+    if not hasattr(file, 'read') and not str(file).endswith('.gz'):
+        if os.path.getsize(file) == 0:
+            return b''
+        with open(file, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    handle, owned = _open_fasta(file)
+    try:
+        data = handle.read()
+    finally:
+        if owned:
+            handle.close()
+    return data.encode() if isinstance(data, str) else data
+
+
+def _record_chunks(data, n_chunks):
+    # byte ranges of roughly equal size that each start at a record header; a range without any
+    # header, e.g. only blank lines, holds no records and some polars versions refuse to scan it
+    size = len(data)
+    bounds = [0]
+    for i in range(1, n_chunks):
+        start = data.find(b'\n>', max(bounds[-1], size * i // n_chunks))
+        if start == -1:
+            break
+        if start + 1 > bounds[-1]:
+            bounds.append(start + 1)
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if data.find(b'>', start, end) != -1]
+
+
+def _parse_chunk(chunk, get_sequence):
+    # one row per line, the unit separator never occurs in FASTA so lines are never split
+    lines = pl.scan_csv(
+        chunk, has_header=False, separator='\x1f', quote_char=None, schema={'line': pl.Utf8}
+    ).select(pl.col('line').str.strip_chars_end()).filter(pl.col('line').is_not_null() & (pl.col('line') != ''))
+    if not get_sequence:
+        return lines.filter(pl.col('line').str.starts_with('>')).select(pl.col('line').str.slice(1).alias('strain'))
+    return (
+        lines.with_columns(pl.col('line').str.starts_with('>').cum_sum().alias('record'))
+        .filter(pl.col('record') > 0)
+        .group_by('record', maintain_order=True)
+        .agg(
+            pl.col('line').first().str.slice(1).alias('strain'),
+            pl.col('line').slice(1).str.join('').str.replace_all(' ', '', literal=True).alias('sequence'),
+        )
+        .drop('record')
+    )
+
+
+def read_fasta_parallel(file, get_sequence=True, stats=False, n_chunks=None, packed=False, content_hash=False):
+    """
+    Reads a whole FASTA file using all cores.
+
+    The file is split into chunks at record boundaries and every chunk is parsed with polars
+    string kernels; the chunks are collected concurrently on the polars thread pool.
+
+    Args:
+        file (str | os.PathLike | file object): FASTA path (optionally gzipped) or open file object.
+        get_sequence (bool): keep the `sequence` column.
+        stats (bool): add the `sequence_stats` columns, also when the sequence itself is dropped.
+        n_chunks (int): number of chunks, the size of the polars thread pool by default.
+        packed (bool): store the sequences as 4-bit packed Binary, see `packed.py`.
+        content_hash (bool): add the `sequence_hash` column, also when the sequence itself is dropped.
+
+    Returns:
+        pl.DataFrame with `strain`, and `sequence`, `sequence_hash` and the statistics when requested.
+    """
+    data = _read_buffer(file)
+    n_chunks = n_chunks or pl.thread_pool_size()
+    need_sequence = get_sequence or stats or content_hash
+    try:
+        frames = [_parse_chunk(data[start:end], need_sequence) for start, end in _record_chunks(data, n_chunks)]
+        if content_hash:
+            frames = [f.with_columns(sequence_hash()) for f in frames]
+        if stats:
+            frames = [with_sequence_stats(f) for f in frames]
+        if packed and get_sequence:
+            frames = [f.with_columns(pack()) for f in frames]
+        if not frames:
+            return pl.DataFrame(schema=_fasta_schema(get_sequence, packed, content_hash))
+        frames = pl.collect_all(frames)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    df = pl.concat(frames, rechunk=True)
+    if need_sequence and not get_sequence:
+        df = df.drop('sequence')
+    return df
+
 
+def read_fasta(file=None, get_sequence=True, batch_size=DEFAULT_BATCH_SIZE, stats=False, parallel=None, packed=False,
+               content_hash=False):
+    """
+    Reads a whole FASTA file into memory, with `read_fasta_parallel` or batch by batch with
+    `iter_fasta`. By default the parallel parser is used whenever polars has more than one
+    thread. Use `scan_fasta` for files larger than memory.
+    """
+    if parallel is None:
+        parallel = pl.thread_pool_size() > 1
+    if parallel:
+        return read_fasta_parallel(file, get_sequence, stats, packed=packed, content_hash=content_hash)
+    need_sequence = get_sequence or stats or content_hash
+    batches = list(iter_fasta(file, batch_size, need_sequence))
+    if not batches:
+        return pl.DataFrame(schema=_fasta_schema(get_sequence, packed, content_hash))
+    df = pl.concat(batches, rechunk=True)
+    if content_hash:
+        df = df.with_columns(sequence_hash())
+    if stats:
+        df = with_sequence_stats(df)
+    if need_sequence and not get_sequence:
+        df = df.drop('sequence')
+    if packed and get_sequence:
+        df = df.with_columns(pack())
+    return df
@@ -0,0 +1,161 @@
+"""
+Script containing the waiter used to poll GISAID's check_async endpoint until a job is done.
+
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from . import tracing
+
+
+class AsyncJobWaiter:
+    """
+    Polls an async GISAID job with exponentially growing intervals.
+
+    Short jobs are noticed quickly while long compressions only cost a handful of requests.
+    Every finished job is recorded in `history` so the intervals can be tuned.
+
+    Args:
+        initial_interval (float): seconds before the second poll.
+        factor (float): growth of the interval after every poll.
+        max_interval (float): cap on a single interval.
+        timeout (float): overall deadline per job in seconds, None waits forever.
+        history_size (int): number of finished jobs to keep in `history`.
+    """
+
+    def __init__(self, initial_interval=0.25, factor=1.6, max_interval=5.0, timeout=1800, history_size=1000):
+        if initial_interval <= 0 or factor < 1 or max_interval < initial_interval:
+            raise ValueError('Polling intervals must be positive, growing and below max_interval.')
+        self.initial_interval = initial_interval
+        self.factor = factor
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.history_size = history_size
+        self.history = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        # cancel tokens of the waits in progress, mapped to the function setting them
+        self._active = {}
+
+    def cancel(self):
+        """
+        Aborts the waits in progress; later waits are not affected.
+        """
+        with self._lock:
+            for set_token in self._active.values():
+                set_token()
+
+    def _start(self, token, set_token=None):
+        with self._lock:
+            self._active[token] = set_token or token.set
+        return token
+
+    def _finish(self, token):
+        with self._lock:
+            self._active.pop(token, None)
+
+    def _check_cancelled(self, job, token):
+        if token.is_set():
+            raise InterruptedError(f"Waiting for job {job} was cancelled.")
+
+    def _next_delay(self, job, start, delay, token):
+        self._check_cancelled(job, token)
+        elapsed = time.monotonic() - start
+        if self.timeout is not None and elapsed >= self.timeout:
+            raise TimeoutError(f"Job {job} was not ready after {elapsed:.1f} seconds.")
+        if self.timeout is not None:
+            delay = min(delay, self.timeout - elapsed)
+        return delay
+
+    def _record(self, job, start, polls):
+        seconds = time.monotonic() - start
+        logging.debug(f"Job {job} ready after {seconds:.2f}s and {polls} polls")
+        with self._lock:
+            self.history.append({'job': job, 'seconds': seconds, 'polls': polls})
+
+    def wait(self, job, check, is_ready, cancel_event=None):
+        """
+        Calls `check(job)` until `is_ready(result)` is true and returns that result.
+
+        Setting `cancel_event` aborts only this wait, `cancel` aborts every wait in progress.
+        """
+        token = self._start(cancel_event if cancel_event is not None else threading.Event())
+        try:
+            start = time.monotonic()
+            delay = self.initial_interval
+            polls = 0
+            while True:
+                self._check_cancelled(job, token)
+                result = check(job)
+                polls += 1
+                tracing.record(polls=1)
+                if is_ready(result):
+                    self._record(job, start, polls)
+                    return result
+                delay = self._next_delay(job, start, delay, token)
+                # Event.wait doubles as an interruptible sleep
+                token.wait(delay)
+                delay = min(self.max_interval, delay * self.factor)
+        finally:
+            self._finish(token)
+
+    async def wait_async(self, job, check, is_ready, cancel_event=None):
+        """
+        Awaitable `wait`; `check` is a coroutine function and `cancel_event` an asyncio.Event.
+        Task cancellation also aborts it.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        token = cancel_event if cancel_event is not None else asyncio.Event()
+        # cancel() may be called from another thread, asyncio events are set on their loop
+        self._start(token, lambda: loop.call_soon_threadsafe(token.set))
+        try:
+            start = time.monotonic()
+            delay = self.initial_interval
+            polls = 0
+            while True:
+                self._check_cancelled(job, token)
+                result = await check(job)
+                polls += 1
+                tracing.record(polls=1)
+                if is_ready(result):
+                    self._record(job, start, polls)
+                    return result
+                delay = self._next_delay(job, start, delay, token)
+                # waiting on the token doubles as a sleep that a cancellation cuts short
+                try:
+                    await asyncio.wait_for(token.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(self.max_interval, delay * self.factor)
+        finally:
+            self._finish(token)
+
+    def stats(self):
+        """
+        Returns count, mean, max seconds and mean polls of the recorded jobs.
+        """
+        with self._lock:
+            history = list(self.history)
+        if not history:
+            return {'jobs': 0, 'mean_seconds': None, 'max_seconds': None, 'mean_polls': None}
+        return {
+            'jobs': len(history),
+            'mean_seconds': sum(h['seconds'] for h in history) / len(history),
+            'max_seconds': max(h['seconds'] for h in history),
+            'mean_polls': sum(h['polls'] for h in history) / len(history),
+        }
+
+
+_default_waiter = AsyncJobWaiter()
+
+
+def get_waiter():
+    return _default_waiter
+
+
+def set_waiter(waiter):
+    global _default_waiter
+    _default_waiter = waiter
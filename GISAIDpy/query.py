@@ -0,0 +1,139 @@
+"""
+Script containing the builder of server side search queries.
+
+A `Query` collects filters for the search panel and turns them into the setTarget/ChangeValue/
+FilterChange commands the GISAID web interface sends when a filter is edited. GISAID then
+filters the records itself, so `functions.count_query` can report how many records match and
+`functions.get_accession_ids` only returns the matching IDs, before any data is downloaded.
+
+Example:
+    query = Query().location('Europe / Denmark').collection_date('2021-01-01', '2021-03-31').lineage('B.1.1.7')
+    print(count_query(credentials, query))
+    ids = get_accession_ids(credentials)
+
+"""
+
+import datetime
+from .functions import create_command
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# value of each quality filter in the list sent for the `quality` checkbox field
+QUALITY_VALUES = {
+    'complete': 'complete',
+    'high_coverage': 'highq',
+    'low_coverage_excluded': 'lowco',
+}
+
+
+def _format_date(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime(DATE_FORMAT)
+    # validates strings before they reach the server, which silently ignores malformed dates
+    return datetime.datetime.strptime(value, DATE_FORMAT).strftime(DATE_FORMAT)
+
+
+class Query:
+    """
+    Filters for the search panel, set through chainable methods.
+
+    Setting a filter again replaces its value. Filter names match the keys of
+    `components.QUERY_FIELDS`; the quality filters share the `quality` checkbox field and are
+    sent together as one list of its checked values.
+    """
+
+    def __init__(self):
+        self.filters = {}
+
+    @classmethod
+    def from_dict(cls, spec):
+        """
+        Builds a query from a dict such as `{'location': 'Europe', 'lineage': 'BA.1',
+        'collection_date': ['2021-01-01', '2021-03-31'], 'complete': True}`, e.g. from a job manifest.
+        """
+        query = cls()
+        for name, value in spec.items():
+            method = getattr(cls, name, None)
+            if name.startswith('_') or name in ('commands', 'from_dict') or not callable(method):
+                raise ValueError(f"Unknown query filter '{name}'.")
+            if name in ('collection_date', 'submission_date'):
+                method(query, *value)
+            elif name in QUALITY_VALUES:
+                if value:
+                    method(query)
+            else:
+                method(query, value)
+        return query
+
+    def __repr__(self):
+        return f"Query({', '.join(f'{name}={value!r}' for name, value in self.filters.items())})"
+
+    def _set(self, name, value):
+        if value is not None:
+            self.filters[name] = value
+        return self
+
+    def virus_name(self, name):
+        return self._set('virus_name', name)
+
+    def location(self, location):
+        """
+        Keeps records from `location`, e.g. 'Europe' or 'Europe / United Kingdom / England'.
+        """
+        return self._set('location', location)
+
+    def lineage(self, lineage):
+        return self._set('lineage', lineage)
+
+    def variant(self, variant):
+        return self._set('variant', variant)
+
+    def collection_date(self, start=None, end=None):
+        """
+        Keeps records collected between `start` and `end` (inclusive, date or 'YYYY-MM-DD').
+        """
+        self._set('collection_date_from', start if start is None else _format_date(start))
+        return self._set('collection_date_to', end if end is None else _format_date(end))
+
+    def submission_date(self, start=None, end=None):
+        """
+        Keeps records submitted between `start` and `end` (inclusive, date or 'YYYY-MM-DD').
+        """
+        self._set('submission_date_from', start if start is None else _format_date(start))
+        return self._set('submission_date_to', end if end is None else _format_date(end))
+
+    def _check_quality(self, name):
+        values = self.filters.get('quality', [])
+        if QUALITY_VALUES[name] not in values:
+            self.filters['quality'] = values + [QUALITY_VALUES[name]]
+        return self
+
+    def complete(self):
+        return self._check_quality('complete')
+
+    def high_coverage(self):
+        return self._check_quality('high_coverage')
+
+    def low_coverage_excluded(self):
+        return self._check_quality('low_coverage_excluded')
+
+    def commands(self, credentials, field_ids):
+        """
+        Returns the command queue applying the filters, starting from a reset search panel.
+
+        Args:
+            credentials (dict): logged in GISAID session.
+            field_ids (dict): ceid of every filter, see `components.extract_field_ids`.
+        """
+        wid, pid, cid = credentials['wid'], credentials['pid'], credentials['search_cid']
+        queue = [create_command(wid, pid, cid, 'Reset')]
+        for name, value in self.filters.items():
+            ceid = field_ids.get(name)
+            if ceid is None:
+                raise Exception(f"Could not find the {name} filter on the search panel.")
+            queue += [
+                create_command(wid, pid, cid, 'setTarget', {'cvalue': value, 'ceid': ceid}, f"ST{ceid}"),
+                create_command(wid, pid, cid, 'ChangeValue', {'cvalue': value, 'ceid': ceid}, f"CV{ceid}"),
+                create_command(wid, pid, cid, 'FilterChange', {'ceid': ceid}),
+            ]
+        return queue
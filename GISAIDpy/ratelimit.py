@@ -0,0 +1,400 @@
+"""
+Script containing the rate limiter every request to GISAID goes through.
+
+`RateLimiter` keeps a token bucket and a cap on requests in flight for every session and for
+the host as a whole. A request waits until both its session and the host have a token and a
+free slot, so parallel downloads cannot flood epicov.org, and a Retry-After header from the
+server pauses everyone sending to it.
+
+The limits are shared by all threads and asyncio tasks using the same `GISAIDClient`. With a
+`lock_dir` they are also shared with other processes on the machine through lock files there
+(POSIX only), e.g. the workers of `gisaidpy run`.
+
+Example:
+    set_client(GISAIDClient(limiter=RateLimiter(rate=2, host_rate=5, lock_dir='/tmp/gisaidpy_locks')))
+    ...
+    print(get_client().limiter.stats())
+
+"""
+
+import collections
+import email.utils
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+_UNSAFE_CHARACTERS = re.compile(r'[^A-Za-z0-9_.-]')
+# seconds between attempts to take a slot held by another process
+_LOCK_POLL_INTERVAL = 0.02
+
+
+def parse_retry_after(value):
+    """
+    Returns the seconds to wait from a Retry-After header, given in seconds or as an HTTP
+    date, or None when the header is missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Slots:
+    """
+    First come first served semaphore that threads and asyncio tasks can wait on together.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+
+    def _enter(self, wake):
+        with self._lock:
+            if self.used < self.size and not self._waiters:
+                self.used += 1
+                return True
+            self._waiters.append(wake)
+            return False
+
+    def acquire(self):
+        event = threading.Event()
+        if self._enter(event.set):
+            return
+        try:
+            event.wait()
+        except BaseException:
+            with self._lock:
+                queued = event.set in self._waiters
+                if queued:
+                    self._waiters.remove(event.set)
+            if not queued:
+                self.release()
+            raise
+
+    async def acquire_async(self):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant():
+            # a waiter cancelled before its turn hands the slot on
+            if future.cancelled():
+                self.release()
+            else:
+                future.set_result(None)
+
+        def wake():
+            loop.call_soon_threadsafe(grant)
+
+        if self._enter(wake):
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = wake in self._waiters
+                if queued:
+                    self._waiters.remove(wake)
+            if not queued and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.used -= 1
+                return
+            # the slot goes straight to the next waiter, so `used` stays the same
+            wake = self._waiters.popleft()
+        wake()
+
+
+class _Limit:
+    """
+    Token bucket and slots of one key, e.g. a session or the host.
+
+    The bucket is kept as the time the next token is due (GCRA), a single number that is easy
+    to share with other processes through a file.
+    """
+
+    def __init__(self, key, rate, burst, concurrency, lock_dir):
+        self.key = key
+        self.interval = 1 / rate if rate else 0.0
+        self.tolerance = self.interval * (max(1, burst) - 1)
+        self.slots = _Slots(concurrency) if concurrency else None
+        self.lock_dir = lock_dir
+        self.clock = time.time if lock_dir else time.monotonic
+        self._due = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'throttled': 0}
+        if lock_dir is not None:
+            name = _UNSAFE_CHARACTERS.sub('_', key)
+            self._bucket_path = os.path.join(lock_dir, f"{name}.bucket")
+            self._slot_paths = [os.path.join(lock_dir, f"{name}.{i}.slot") for i in range(concurrency or 0)]
+
+    def _update(self, change):
+        # applies change(due, now) -> (due, result) to the bucket, under a file lock when shared
+        with self._lock:
+            now = self.clock()
+            if self.lock_dir is None:
+                self._due, result = change(self._due, now)
+                return result
+            import fcntl
+
+            with open(self._bucket_path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                content = f.read()
+                due, result = change(json.loads(content) if content else 0.0, now)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(due))
+                f.flush()
+            return result
+
+    def reserve(self):
+        """
+        Takes the next token and returns the seconds to wait before using it.
+        """
+        if not self.interval and self.lock_dir is None and not self._due:
+            return 0.0
+
+        def take(due, now):
+            due = max(due, now)
+            return due + self.interval, max(0.0, due - self.tolerance - now)
+
+        return self._update(take)
+
+    def pause(self, seconds):
+        """
+        Makes the next token due in `seconds` at the earliest.
+        """
+        def delay(due, now):
+            return max(due, now + seconds + self.tolerance), None
+
+        self._update(delay)
+        with self._lock:
+            self.stats['throttled'] += 1
+
+    def _try_lock_slot(self):
+        import fcntl
+
+        for path in self._slot_paths:
+            f = open(path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            return f
+        return None
+
+    def acquire_slot(self):
+        if self.slots is None:
+            return None
+        self.slots.acquire()
+        if self.lock_dir is None:
+            return None
+        try:
+            while True:
+                f = self._try_lock_slot()
+                if f is not None:
+                    return f
+                time.sleep(_LOCK_POLL_INTERVAL)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    async def acquire_slot_async(self):
+        import asyncio
+
+        if self.slots is None:
+            return None
+        await self.slots.acquire_async()
+        if self.lock_dir is None:
+            return None
+        try:
+            while True:
+                f = self._try_lock_slot()
+                if f is not None:
+                    return f
+                await asyncio.sleep(_LOCK_POLL_INTERVAL)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release_slot(self, lock_file):
+        if lock_file is not None:
+            # closing the file drops its lock
+            lock_file.close()
+        if self.slots is not None:
+            self.slots.release()
+
+    def record(self, wait):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['wait_seconds'] += wait
+            self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], wait)
+
+
+class Permit:
+    """
+    Slots held by one request, released by `release` or when used as a context manager.
+    """
+
+    def __init__(self, held, wait):
+        self._held = held
+        self._lock = threading.Lock()
+        self.wait = wait
+
+    def release(self):
+        # streamed responses release from `close`, which may run more than once
+        with self._lock:
+            held, self._held = self._held, []
+        for limit, lock_file in reversed(held):
+            limit.release_slot(lock_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class RateLimiter:
+    """
+    Token buckets and concurrency caps per session and per host, shared by every thread,
+    asyncio task and, with `lock_dir`, process using it.
+
+    Any limit set to None is not enforced.
+
+    Args:
+        rate (float): requests per second of a single session.
+        burst (int): requests a session may send at once after idling.
+        concurrency (int): requests of a session in flight at once.
+        host_rate (float): requests per second of all sessions together.
+        host_burst (int): requests all sessions may send at once after idling.
+        host_concurrency (int): requests of all sessions in flight at once.
+        lock_dir (str): directory of the lock files sharing the limits with other processes,
+            None keeps them to this process. Slots are first come first served within a process,
+            other processes poll for them.
+    """
+
+    def __init__(self, rate=4.0, burst=8, concurrency=4, host_rate=10.0, host_burst=20, host_concurrency=8,
+                 lock_dir=None):
+        for name, value in [('rate', rate), ('burst', burst), ('concurrency', concurrency),
+                            ('host_rate', host_rate), ('host_burst', host_burst),
+                            ('host_concurrency', host_concurrency)]:
+            if value is not None and value <= 0:
+                raise ValueError(f"{name} must be positive or None.")
+        self.session_limits = (rate, burst or 1, concurrency)
+        self.host_limits = (host_rate, host_burst or 1, host_concurrency)
+        self.lock_dir = lock_dir
+        if lock_dir is not None:
+            os.makedirs(lock_dir, exist_ok=True)
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def _limit(self, key):
+        limit = self._limits.get(key)
+        if limit is None:
+            with self._lock:
+                limit = self._limits.get(key)
+                if limit is None:
+                    rate, burst, concurrency = self.host_limits if key.startswith('host:') else self.session_limits
+                    limit = self._limits[key] = _Limit(key, rate, burst, concurrency, self.lock_dir)
+        return limit
+
+    def _keys(self, host, session):
+        # sessions before the host, every request takes slots in the same order
+        return ([f"session:{session}"] if session else []) + [f"host:{host}"]
+
+    def _reserve(self, limits):
+        delay = max(limit.reserve() for limit in limits)
+        if delay > 0.5:
+            logging.debug(f"Rate limit of {limits[-1].key} delays the next request by {delay:.2f}s")
+        return delay
+
+    def _granted(self, limits, held, start):
+        wait = time.monotonic() - start
+        for limit in limits:
+            limit.record(wait)
+        return Permit(held, wait)
+
+    def acquire(self, host, session=None):
+        """
+        Waits for a slot and a token of `session` and of `host`.
+
+        Returns:
+            Permit to release once the response is read.
+        """
+        start = time.monotonic()
+        limits = [self._limit(key) for key in self._keys(host, session)]
+        held = []
+        try:
+            for limit in limits:
+                held.append((limit, limit.acquire_slot()))
+            delay = self._reserve(limits)
+            if delay:
+                time.sleep(delay)
+        except BaseException:
+            Permit(held, 0).release()
+            raise
+        return self._granted(limits, held, start)
+
+    async def acquire_async(self, host, session=None):
+        """
+        Awaitable `acquire`, waiting without blocking the event loop.
+        """
+        import asyncio
+
+        start = time.monotonic()
+        limits = [self._limit(key) for key in self._keys(host, session)]
+        held = []
+        try:
+            for limit in limits:
+                held.append((limit, await limit.acquire_slot_async()))
+            delay = self._reserve(limits)
+            if delay:
+                await asyncio.sleep(delay)
+        except BaseException:
+            Permit(held, 0).release()
+            raise
+        return self._granted(limits, held, start)
+
+    def pause(self, host, session=None, seconds=0.0):
+        """
+        Holds back the requests of `host`, and of `session` if given, for `seconds`, e.g. after
+        a Retry-After header.
+        """
+        logging.info(f"{host} asked to retry after {seconds:.1f}s, pausing requests")
+        for key in self._keys(host, session):
+            self._limit(key).pause(seconds)
+
+    def stats(self):
+        """
+        Returns the requests, total/mean/max seconds waited for the limits, Retry-After pauses and
+        requests in flight of every session and host seen so far.
+        """
+        with self._lock:
+            limits = list(self._limits.values())
+        result = {}
+        for limit in limits:
+            with limit._lock:
+                stats = dict(limit.stats)
+            stats['mean_wait_seconds'] = stats['wait_seconds'] / stats['requests'] if stats['requests'] else None
+            stats['in_flight'] = limit.slots.used if limit.slots is not None else None
+            result[limit.key] = stats
+        return result
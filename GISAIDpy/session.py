@@ -0,0 +1,109 @@
+"""
+Script containing the per-session cache of discovered GISAID panel IDs.
+
+Opening a panel costs a command round trip plus a page load that is then scanned for
+component IDs. Within one logged in session those IDs stay the same, so they are kept
+here per session ID and reused by later select_entries() and download() calls.
+
+"""
+
+import logging
+import threading
+
+
+class SessionExpiredError(Exception):
+    """
+    The GISAID session expired, only a new login helps.
+    """
+
+
+class StalePanelError(Exception):
+    """
+    A panel did not answer as expected, e.g. because its cached IDs belong to a panel the server
+    no longer knows or the page structure changed.
+    """
+
+
+class SessionState:
+    """
+    Caches the wid/pid/cid/ceid values of opened panels, keyed by session ID and panel name.
+
+    When a call using cached entries fails with a `StalePanelError`, the entries of its session
+    are dropped and `run` retries the call once with freshly discovered IDs. Any other error,
+    e.g. an expired session, a timeout or a failure after the download job was started, is
+    raised as is, so no command is sent twice.
+    """
+
+    def __init__(self):
+        self._panels = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sid, panel):
+        with self._lock:
+            ids = self._panels.get(sid, {}).get(panel)
+            if ids is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(ids)
+
+    def set(self, sid, panel, ids):
+        with self._lock:
+            self._panels.setdefault(sid, {})[panel] = dict(ids)
+
+    def invalidate(self, sid=None):
+        """
+        Forgets the panels of `sid`, or of every session. Returns whether anything was cached.
+        """
+        with self._lock:
+            if sid is None:
+                cached = bool(self._panels)
+                self._panels.clear()
+            else:
+                cached = bool(self._panels.pop(sid, None))
+        if cached:
+            logging.debug(f"Dropped cached panel IDs of session {sid or '*'}")
+        return cached
+
+    def run(self, sid, func, *args, **kwargs):
+        """
+        Calls `func`, retrying once without cached panel IDs if it raises a `StalePanelError`
+        while some were cached.
+        """
+        try:
+            return func(*args, **kwargs)
+        except StalePanelError as e:
+            if not self.invalidate(sid):
+                raise
+            logging.debug(f"Retrying {func.__name__} with fresh panel IDs after: {e}")
+        return func(*args, **kwargs)
+
+    async def run_async(self, sid, func, *args, **kwargs):
+        """
+        Awaitable `run` for coroutine functions.
+        """
+        try:
+            return await func(*args, **kwargs)
+        except StalePanelError as e:
+            if not self.invalidate(sid):
+                raise
+            logging.debug(f"Retrying {func.__name__} with fresh panel IDs after: {e}")
+        return await func(*args, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._panels), 'hits': self.hits, 'misses': self.misses}
+
+
+_default_state = SessionState()
+
+
+def get_session_state():
+    return _default_state
+
+
+def set_session_state(state):
+    global _default_state
+    _default_state = state
@@ -0,0 +1,116 @@
+"""
+Script containing the incremental sync mode, which only downloads accession IDs not seen before.
+
+The output directory holds a Hive-partitioned Parquet dataset (one `sync_date=` partition per
+run) and a `_manifest` directory with every accession ID synced so far and the last run time.
+
+"""
+
+import datetime
+import json
+import logging
+import os
+import shutil
+import polars as pl
+from .functions import get_accession_ids
+from .main import MAX_BATCH_SIZE, download_bulk
+
+
+def _manifest_dir(output_dir):
+    return os.path.join(output_dir, '_manifest')
+
+
+def load_manifest(output_dir):
+    """
+    Returns the accession IDs synced into `output_dir` so far and the state of the last run.
+    """
+    seen_file = os.path.join(_manifest_dir(output_dir), 'seen.parquet')
+    state_file = os.path.join(_manifest_dir(output_dir), 'state.json')
+    seen = pl.read_parquet(seen_file) if os.path.exists(seen_file) else pl.DataFrame(schema={'accession_id': pl.Utf8})
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            state = json.load(f)
+    return seen, state
+
+
+def _save_manifest(output_dir, seen, state):
+    manifest_dir = _manifest_dir(output_dir)
+    os.makedirs(manifest_dir, exist_ok=True)
+    seen_file = os.path.join(manifest_dir, 'seen.parquet')
+    seen.write_parquet(seen_file + '.tmp')
+    os.replace(seen_file + '.tmp', seen_file)
+    state_file = os.path.join(manifest_dir, 'state.json')
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def new_accession_ids(accession_ids, seen):
+    """
+    Anti-joins the current accession IDs of a query against the already synced ones.
+    """
+    return accession_ids.select('accession_id').unique().join(seen, on='accession_id', how='anti')
+
+
+def sync(credentials, output_dir, get_sequence=True, batch_size=MAX_BATCH_SIZE, max_workers=4, cache=None):
+    """
+    Downloads the records of the current query that were not synced into `output_dir` before.
+
+    Args:
+        credentials (dict | list of dict): one or more logged in GISAID sessions, the first is
+            used to list the accession IDs of the query.
+        output_dir (str): dataset directory, created on the first run.
+        get_sequence (bool): also download the sequences.
+        batch_size (int): accession IDs per download batch, at most 5000.
+        max_workers (int): maximum number of batches downloading at the same time.
+        cache (RecordCache): passed on to download_bulk.
+
+    Returns:
+        pl.DataFrame with the newly synced records, empty when nothing changed.
+    """
+    seen, state = load_manifest(output_dir)
+    started = datetime.datetime.now(datetime.timezone.utc)
+
+    query_credentials = credentials[0] if isinstance(credentials, (list, tuple)) else credentials
+    new = new_accession_ids(get_accession_ids(query_credentials), seen)
+    logging.info(f"{new.height} new accession IDs since {state.get('last_run', 'the first run')}")
+
+    df = pl.DataFrame(schema={'accession_id': pl.Utf8})
+    if new.height:
+        df = download_bulk(
+            credentials,
+            # sorted so a rerun after a failure rebuilds the same checkpointed batches
+            new['accession_id'].sort().to_list(),
+            get_sequence=get_sequence,
+            batch_size=batch_size,
+            max_workers=max_workers,
+            # finished batches survive a failed run and are picked up by the next one
+            checkpoint_dir=os.path.join(_manifest_dir(output_dir), 'checkpoints'),
+            cache=cache
+        )
+        partition_dir = os.path.join(output_dir, f"sync_date={started.date().isoformat()}")
+        os.makedirs(partition_dir, exist_ok=True)
+        df.write_parquet(os.path.join(partition_dir, f"part-{started.strftime('%H%M%S%f')}.parquet"))
+        seen = pl.concat([seen, new])
+
+    state = {
+        'last_run': started.isoformat(),
+        'runs': state.get('runs', 0) + 1,
+        'last_new': new.height,
+        'total': seen.height,
+    }
+    _save_manifest(output_dir, seen, state)
+    shutil.rmtree(os.path.join(_manifest_dir(output_dir), 'checkpoints'), ignore_errors=True)
+    return df
+
+
+def scan_synced(output_dir):
+    """
+    Lazily scans every record synced into `output_dir`.
+    """
+    return pl.scan_parquet(
+        os.path.join(output_dir, 'sync_date=*', '*.parquet'),
+        hive_partitioning=True,
+        missing_columns='insert'
+    )
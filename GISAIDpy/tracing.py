@@ -0,0 +1,239 @@
+"""
+Script containing lightweight tracing of the GISAID command flow.
+
+Every protocol step runs inside a `span`. Spans carry their duration, the number of HTTP
+requests, bytes sent and received, the command names queued and the check_async polls, and
+are handed to registered hooks when they finish. Counters also roll up into the enclosing
+spans, so a `download` span holds the totals of all its steps.
+
+With no hooks registered `span` does nothing, so tracing can stay wired in permanently.
+
+Example:
+    recorder = SpanRecorder()
+    add_hook(recorder)
+    download(credentials, ids)
+    for s in recorder.spans:
+        print(s.name, s.duration, s.requests, s.commands)
+
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import deque
+
+_hooks = []
+_hooks_lock = threading.Lock()
+_current = contextvars.ContextVar('gisaidpy_span', default=None)
+
+
+class Span:
+    __slots__ = (
+        'name', 'attributes', 'parent', 'start', 'end', 'requests', 'bytes_sent', 'bytes_received',
+        'commands', 'polls', 'error', 'context'
+    )
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end = None
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.commands = []
+        self.polls = 0
+        self.error = None
+        # free slot for hooks to keep their own state, e.g. an OpenTelemetry span
+        self.context = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    @property
+    def path(self):
+        names = []
+        span = self
+        while span is not None:
+            names.append(span.name)
+            span = span.parent
+        return '/'.join(reversed(names))
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'path': self.path,
+            'duration': self.duration,
+            'requests': self.requests,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'commands': list(self.commands),
+            'polls': self.polls,
+            'error': self.error,
+            'attributes': dict(self.attributes),
+        }
+
+    def __repr__(self):
+        return f"Span({self.path!r}, {self.duration:.3f}s, requests={self.requests}, commands={self.commands})"
+
+
+def add_hook(on_end, on_start=None):
+    """
+    Registers `on_end(span)`, and optionally `on_start(span)`, for every span.
+    """
+    with _hooks_lock:
+        _hooks.append((on_start, on_end))
+
+
+def remove_hook(on_end):
+    with _hooks_lock:
+        _hooks[:] = [hook for hook in _hooks if hook[1] is not on_end]
+
+
+def enabled():
+    return bool(_hooks)
+
+
+def current_span():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a span named `name`, nested in the current span if any.
+    """
+    if not _hooks:
+        yield None
+        return
+
+    s = Span(name, attributes, _current.get())
+    for on_start, _ in list(_hooks):
+        if on_start is not None:
+            on_start(s)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        s.end = time.perf_counter()
+        for _, on_end in list(_hooks):
+            try:
+                on_end(s)
+            except Exception:
+                logging.exception(f"Tracing hook failed for span {s.name}")
+
+
+def traced(name):
+    """
+    Decorator running every call of a function, or coroutine function, in a span.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _hooks:
+                    return await func(*args, **kwargs)
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(requests=0, bytes_sent=0, bytes_received=0, polls=0, commands=None):
+    """
+    Adds counters to the current span and every span enclosing it.
+    """
+    s = _current.get()
+    while s is not None:
+        s.requests += requests
+        s.bytes_sent += bytes_sent
+        s.bytes_received += bytes_received
+        s.polls += polls
+        if commands:
+            s.commands.extend(commands)
+        s = s.parent
+
+
+class SpanRecorder:
+    """
+    Hook that keeps the most recent finished spans in memory.
+    """
+
+    def __init__(self, max_spans=10000):
+        self.max_spans = max_spans
+        self.spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+def log_hook(span):
+    """
+    Hook that logs one compact line per finished span.
+    """
+    logging.info(
+        f"{span.path} {span.duration * 1000:.1f}ms requests={span.requests} sent={span.bytes_sent}B "
+        f"received={span.bytes_received}B polls={span.polls} commands={','.join(span.commands)}"
+        + (f" error={span.error}" if span.error else "")
+    )
+
+
+def add_opentelemetry_hook(tracer=None):
+    """
+    Mirrors every span into OpenTelemetry, nested like the GISAIDpy spans.
+
+    Requires the `opentelemetry-api` package and a configured tracer provider.
+    """
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        raise ImportError('add_opentelemetry_hook requires the opentelemetry-api package.')
+
+    tracer = tracer if tracer is not None else trace.get_tracer('GISAIDpy')
+
+    def on_start(span):
+        parent = span.parent.context if span.parent is not None else None
+        context = trace.set_span_in_context(parent) if parent is not None else None
+        span.context = tracer.start_span(f"gisaid.{span.name}", context=context)
+
+    def on_end(span):
+        otel_span = span.context
+        if otel_span is None:
+            return
+        for key, value in span.attributes.items():
+            otel_span.set_attribute(f"gisaid.{key}", value)
+        otel_span.set_attribute('gisaid.requests', span.requests)
+        otel_span.set_attribute('gisaid.bytes_sent', span.bytes_sent)
+        otel_span.set_attribute('gisaid.bytes_received', span.bytes_received)
+        otel_span.set_attribute('gisaid.polls', span.polls)
+        otel_span.set_attribute('gisaid.commands', list(span.commands))
+        if span.error:
+            otel_span.set_status(trace.Status(trace.StatusCode.ERROR, span.error))
+        otel_span.end()
+
+    add_hook(on_end, on_start)
+    return on_end
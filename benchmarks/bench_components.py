@@ -0,0 +1,104 @@
+"""
+Micro-benchmarks of component ID extraction from GISAID panel pages.
+
+Compares the per-name `re.search` calls GISAIDpy used to make over the download and agreement
+pages with the single-pass `components.extract_component_ids`. Pages are synthetic but sized
+like real EpiCoV panels: hundreds of createComponent/createFI declarations between markup and
+script, with the components looked up declared near the end.
+
+Usage:
+    python benchmarks/bench_components.py
+    python benchmarks/bench_components.py --sizes 100 1000 --number 200
+
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from GISAIDpy.components import extract_component_ids
+
+DEFAULT_SIZES = [50, 250, 1000]
+
+FILLER_NAMES = [
+    'ButtonWidget', 'EntryWidget', 'ComboboxWidget', 'DateWidget', 'TableComponent', 'FilterComponent',
+    'PagerComponent', 'TabsComponent', 'DialogComponent', 'MenuComponent',
+]
+
+LEGACY_PATTERNS = {
+    'download': [r"'(.{5,20})','DownloadSelectionComponent", r"'(.{5,20})','RadiobuttonWidget"],
+    'agreement': [r"'(.{5,20})','Corona2020DownloadReminderButtonsComponent", r"createFI\('(.{5,20})','CheckboxWidget'"],
+}
+
+ROLES = {
+    'download': ['download_selection', 'format_radio'],
+    'agreement': ['reminder_buttons', 'agree_checkbox'],
+}
+
+
+def make_page(kilobytes, page, seed=0):
+    """
+    Returns a page of roughly `kilobytes` KB declaring the components of `page` at the end.
+    """
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < kilobytes * 1024:
+        cid = f"c_{rng.getrandbits(40):010x}"
+        name = rng.choice(FILLER_NAMES)
+        call = 'createFI' if name.endswith('Widget') else 'createComponent'
+        part = (
+            f"<div class=\"sys-{name.lower()}\" id=\"{cid}\"><span>{'x' * rng.randint(20, 200)}</span></div>"
+            f"<script>sys.{call}('{cid}','{name}',new Object({{'label':'{name}'}}));</script>\n"
+        )
+        parts.append(part)
+        size += len(part)
+    if page == 'download':
+        parts.append("<script>sys.createComponent('c_dl0001','DownloadSelectionComponent');"
+                     "sys.createFI('ce_rb0001','RadiobuttonWidget','augur_input');</script>")
+    else:
+        parts.append("<script>sys.createComponent('c_rm0001','Corona2020DownloadReminderButtonsComponent');"
+                     "sys.createFI('ce_cb0001','CheckboxWidget','agreed');</script>")
+    return ''.join(parts)
+
+
+def legacy(text, page):
+    return [re.search(pattern, text).group(1) for pattern in LEGACY_PATTERNS[page]]
+
+
+def single_pass(text, page):
+    return list(extract_component_ids(text, 'EpiCoV', ROLES[page]).values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='page sizes in KB')
+    parser.add_argument('--number', type=int, default=50, help='extractions per timing')
+    parser.add_argument('--repeat', type=int, default=5, help='timings per case, the best is reported')
+    args = parser.parse_args(argv)
+
+    print(f"{'page':<10} {'KB':>6} {'legacy ms':>10} {'single ms':>10} {'speedup':>8}")
+    results = []
+    for page in ['download', 'agreement']:
+        for kilobytes in args.sizes:
+            text = make_page(kilobytes, page)
+            assert legacy(text, page) == single_pass(text, page)
+            times = {}
+            for name, func in [('legacy', legacy), ('single', single_pass)]:
+                best = min(timeit.repeat(lambda: func(text, page), number=args.number, repeat=args.repeat))
+                times[name] = best / args.number * 1000
+            results.append(dict(times, page=page, kilobytes=kilobytes))
+            print(
+                f"{page:<10} {kilobytes:>6} {times['legacy']:>10.3f} {times['single']:>10.3f} "
+                f"{times['legacy'] / times['single']:>7.1f}x"
+            )
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+End-to-end benchmarks of GISAIDpy against the offline mock GISAID server.
+
+Every case runs in a fresh process so peak memory is measured per case. Reports wall time,
+the number of HTTP requests the server saw, throughput of the downloaded payload and the
+peak resident memory of the client process.
+
+Usage:
+    python benchmarks/bench_download.py                     # 1k, 5k and 100k record downloads
+    python benchmarks/bench_download.py --sizes 1000 --json results.json
+    python benchmarks/bench_download.py --latency 0.05 --compression-seconds 1
+
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DEFAULT_SIZES = [1000, 5000, 100000]
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _with_server(options, run):
+    from GISAIDpy.client import GISAIDClient, set_client
+    from tests.mock_server import MockGISAIDServer
+
+    with MockGISAIDServer(
+        n_records=options['n_records'],
+        sequence_length=options['sequence_length'],
+        latency=options['latency'],
+        compression_seconds=options['compression_seconds'],
+    ) as server:
+        set_client(GISAIDClient(base_url=server.url))
+        server.reset_counts()
+        start = time.perf_counter()
+        rows = run(server)
+        seconds = time.perf_counter() - start
+        stats = server.stats()
+    return {
+        'seconds': seconds,
+        'rows': rows,
+        'requests': stats['requests'],
+        'mb': stats['bytes_sent'] / 1e6,
+        'mb_per_s': stats['bytes_sent'] / 1e6 / seconds if seconds else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        'counts': stats['counts'],
+    }
+
+
+def case_download(options):
+    from GISAIDpy import main
+
+    ids = [f"EPI_ISL_{i + 1}" for i in range(options['size'])]
+
+    def run(server):
+        if options['size'] <= main.MAX_BATCH_SIZE:
+            df = main.download(server.credentials(), ids)
+        else:
+            sessions = [server.credentials() for _ in range(options['sessions'])]
+            df = main.download_bulk(sessions, ids, max_workers=options['sessions'])
+        return df.height
+
+    return _with_server(options, run)
+
+
+def case_select_entries(options):
+    from GISAIDpy import functions
+
+    ids = [f"EPI_ISL_{i + 1}" for i in range(options['size'])]
+
+    def run(server):
+        functions.select_entries(server.credentials(), ids)
+        return len(ids)
+
+    return _with_server(options, run)
+
+
+def case_get_accession_ids(options):
+    from GISAIDpy import functions
+
+    return _with_server(options, lambda server: functions.get_accession_ids(server.credentials()).height)
+
+
+def _case_fasta(options, parse):
+    from tests.mock_server import MockDataset
+
+    dataset = MockDataset(options['size'], options['sequence_length'])
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'bench.fasta')
+        dataset.write_fasta(path, range(options['size']))
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        rows = parse(path).height
+        seconds = time.perf_counter() - start
+    return {
+        'seconds': seconds,
+        'rows': rows,
+        'requests': 0,
+        'mb': size / 1e6,
+        'mb_per_s': size / 1e6 / seconds if seconds else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        'counts': {},
+    }
+
+
+def case_read_fasta(options):
+    from GISAIDpy.polars_funcs import read_fasta
+
+    return _case_fasta(options, read_fasta)
+
+
+def case_read_fasta_stats(options):
+    from GISAIDpy.polars_funcs import read_fasta_parallel
+
+    return _case_fasta(options, lambda path: read_fasta_parallel(path, stats=True))
+
+
+CASES = {
+    'download': case_download,
+    'select_entries': case_select_entries,
+    'get_accession_ids': case_get_accession_ids,
+    'read_fasta': case_read_fasta,
+    'read_fasta_stats': case_read_fasta_stats,
+}
+
+
+def _run_case(name, options, results):
+    # keep the progress prints of download() out of the report
+    sys.stdout = open(os.devnull, 'w')
+    results.put(CASES[name](options))
+
+
+def run_case(name, options):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_case, args=(name, options, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='records per download')
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--sequence-length', type=int, default=1000, help='bases per synthetic sequence')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--compression-seconds', type=float, default=0.0, help='server side job duration')
+    parser.add_argument('--sessions', type=int, default=4, help='sessions used for downloads over 5000 records')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'case':<18} {'records':>8} {'seconds':>9} {'requests':>9} {'MB':>9} {'MB/s':>8} {'peak MB':>9}")
+    for name in args.cases:
+        for size in args.sizes:
+            options = {
+                'size': size,
+                'n_records': size,
+                'sequence_length': args.sequence_length,
+                'latency': args.latency,
+                'compression_seconds': args.compression_seconds,
+                'sessions': args.sessions,
+            }
+            result = dict(run_case(name, options), case=name, size=size)
+            results.append(result)
+            print(
+                f"{name:<18} {size:>8} {result['seconds']:>9.3f} {result['requests']:>9} "
+                f"{result['mb']:>9.2f} {result['mb_per_s'] or 0:>8.1f} {result['peak_rss_mb']:>9.1f}"
+            )
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
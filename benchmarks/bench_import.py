@@ -0,0 +1,99 @@
+"""
+Import-time benchmark of GISAIDpy, failing on regressions.
+
+Every case imports part of the package in fresh interpreters and reports the best import time
+and which heavy dependencies got loaded. The run fails (exit status 1) when a case loads a
+dependency it must not, e.g. polars for `from GISAIDpy import download`, when it exceeds its
+time budget, or when it is more than `--tolerance` slower than a baseline saved with `--json`.
+
+Usage:
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --json baseline.json
+    python benchmarks/bench_import.py --baseline baseline.json --tolerance 0.25
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+HEAVY_MODULES = ['asyncio', 'click', 'numpy', 'polars', 'requests']
+
+# name, statement, heavy modules it must not load, budget in ms
+CASES = [
+    ('package', 'import GISAIDpy', HEAVY_MODULES, 20),
+    ('download', 'from GISAIDpy import download', HEAVY_MODULES, 80),
+    ('query', 'from GISAIDpy import Query, count_query', HEAVY_MODULES, 80),
+    ('async', 'import GISAIDpy.async_functions', ['click', 'numpy', 'polars', 'requests'], 150),
+    # polars itself imports asyncio
+    ('parse', 'from GISAIDpy import read_fasta', ['click', 'requests'], 2000),
+]
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{'ms': seconds * 1000, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(statement, repeat):
+    """
+    Returns the best import time in ms of `statement` over `repeat` fresh interpreters, and the
+    heavy modules it loaded.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    code = PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    results = []
+    # the first run also writes the bytecode caches, so it is not timed
+    for _ in range(repeat + 1):
+        out = subprocess.run([sys.executable, '-c', code], env=env, check=True, capture_output=True, text=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return min(r['ms'] for r in results[1:]), results[-1]['loaded']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='interpreters per case, the best is reported')
+    parser.add_argument('--json', help='write the results to this file, e.g. as a baseline')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"{'case':<10} {'ms':>8} {'budget':>8} {'baseline':>9}  loaded")
+    results, failures = {}, []
+    for name, statement, forbidden, budget in CASES:
+        ms, loaded = measure(statement, args.repeat)
+        results[name] = {'ms': ms, 'loaded': loaded}
+        previous = baseline.get(name, {}).get('ms')
+        print(
+            f"{name:<10} {ms:>8.1f} {budget:>8} {previous if previous is None else round(previous, 1)!s:>9}  "
+            f"{', '.join(loaded) or '-'}"
+        )
+        if set(loaded) & set(forbidden):
+            failures.append(f"{name}: `{statement}` loads {', '.join(sorted(set(loaded) & set(forbidden)))}")
+        if ms > budget:
+            failures.append(f"{name}: {ms:.1f} ms over the {budget} ms budget")
+        if previous is not None and ms > previous * (1 + args.tolerance):
+            failures.append(f"{name}: {ms:.1f} ms, {ms / previous - 1:.0%} slower than the baseline")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
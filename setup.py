@@ -9,13 +9,21 @@ setup(
     url='https://github.com/erick-andrews/GISAIDpy',
     packages=['GISAIDpy'],
     install_requires=[
+        'click',
         'numpy',
-        'polars',
+        # scan_parquet(missing_columns=...), register_io_source and streaming sinks of joined scans
+        'polars>=1.31',
+        'requests',
+        # TOML job manifests, tomllib is in the standard library from 3.11
+        'tomli; python_version < "3.11"',
     ],
+    entry_points={
+        'console_scripts': ['gisaidpy = GISAIDpy.cli:main'],
+    },
     classifiers=[
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
         'Operating System :: OS Independent',
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.9',
 )
@@ -0,0 +1,44 @@
+import pytest
+from GISAIDpy.client import GISAIDClient, get_client, set_client
+from tests.mock_server import MockGISAIDServer
+from GISAIDpy.session import SessionState, get_session_state, set_session_state
+
+
+def _serve(**options):
+    client, state = get_client(), get_session_state()
+    server = MockGISAIDServer(**options).start()
+    set_client(GISAIDClient(base_url=server.url, limiter=False, backoff_factor=0.01))
+    set_session_state(SessionState())
+    return server, client, state
+
+
+def _stop(server, client, state):
+    get_client().close()
+    set_client(client)
+    set_session_state(state)
+    server.stop()
+
+
+@pytest.fixture
+def server():
+    """
+    Mock EpiCoV server with 100 records, used by the process wide client.
+    """
+    server, client, state = _serve(n_records=100, sequence_length=200)
+    yield server
+    _stop(server, client, state)
+
+
+@pytest.fixture
+def fasta_server():
+    """
+    Mock EpiRSV server, serving plain FASTA downloads.
+    """
+    server, client, state = _serve(n_records=100, sequence_length=200, database='EpiRSV')
+    yield server
+    _stop(server, client, state)
+
+
+@pytest.fixture
+def credentials(server):
+    return server.credentials()
@@ -0,0 +1,510 @@
+"""
+Offline stand-in for the EpiCoV frontend, for exercising and benchmarking GISAIDpy without
+GISAID credentials.
+
+It speaks enough of the `frontend` command-queue protocol for `select_entries`, `download`,
+`get_accession_ids`, `count_query` and `reset_query`: Selection/DownloadAllSequences panels,
+setTarget, ChangeValue, search filters, GetData, DownloadReminder, Agreed, Download, CallAsync,
+check_async polling and the final file download (with Range support). Payloads are synthetic
+and generated on the fly.
+
+Example:
+    with MockGISAIDServer(n_records=1000) as server:
+        set_client(GISAIDClient(base_url=server.url))
+        df = download(server.credentials(), ['EPI_ISL_1', 'EPI_ISL_2'])
+
+"""
+
+import collections
+import http.server
+import json
+import logging
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+MAIN_PID = 'p_mocksearch'
+QUERY_CID = 'c_mockquery'
+SEARCH_CID = 'c_mocksearch'
+SELECTION_PANEL_CID = 'c_mockselect'
+SELECTION_CEID = 'ce_mockselect'
+DOWNLOAD_PANEL_CID = 'c_mockdownload'
+RADIO_CEID = 'ce_mockradio'
+REMINDER_CID = 'c_mockreminder'
+CHECKBOX_CEID = 'ce_mockcheck'
+# ceids of the search filters, by field name
+QUERY_CEIDS = {
+    name: f"ce_mockq{i:02d}" for i, name in enumerate([
+        'covv_virus_name', 'covv_location', 'pangolin_lineage', 'covv_variants', 'covv_collection_date_from',
+        'covv_collection_date_to', 'covv_subm_date_from', 'covv_subm_date_to', 'quality',
+    ])
+}
+QUERY_FIELD_NAMES = {ceid: name for name, ceid in QUERY_CEIDS.items()}
+
+METADATA_COLUMNS = ['strain', 'virus', 'gisaid_epi_isl', 'date', 'region', 'country', 'division', 'pango_lineage', 'length']
+REGIONS = ['Africa', 'Asia', 'Europe', 'North America', 'Oceania', 'South America']
+LINEAGES = ['B.1.1.7', 'B.1.617.2', 'BA.1', 'BA.2', 'BA.5', 'XBB.1.5', 'JN.1']
+
+
+class MockDataset:
+    """
+    Deterministic synthetic records `EPI_ISL_1` ... `EPI_ISL_<n_records>`.
+    """
+
+    def __init__(self, n_records=1000, sequence_length=1000, seed=0):
+        self.n_records = n_records
+        self.sequence_length = sequence_length
+        rng = random.Random(seed)
+        bases = ''.join(rng.choice('ACGT') for _ in range(sequence_length))
+        # a stretch of Ns, like real assemblies have
+        bases = bases[:10] + 'N' * min(50, sequence_length // 10) + bases[10 + min(50, sequence_length // 10):]
+        self._bases = (bases + bases)
+        self.accession_ids = [f"EPI_ISL_{i + 1}" for i in range(n_records)]
+
+    def index_of(self, accession_id):
+        try:
+            i = int(accession_id.strip().rsplit('_', 1)[1]) - 1
+        except (IndexError, ValueError):
+            return None
+        return i if 0 <= i < self.n_records else None
+
+    def strain(self, i):
+        return f"hCoV-19/{REGIONS[i % len(REGIONS)]}/MOCK-{i + 1}/2021"
+
+    def sequence(self, i):
+        start = i % self.sequence_length
+        return self._bases[start:start + self.sequence_length]
+
+    def matches(self, i, filters):
+        """
+        Whether record `i` passes the search `filters` (field name to value), as set by a query.
+        """
+        date = f"2021-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}"
+        location = f"{REGIONS[i % len(REGIONS)]} / Country{i % 40}"
+        checks = {
+            'covv_virus_name': lambda v: v in self.strain(i),
+            'covv_location': lambda v: location == v or location.startswith(v + ' / '),
+            'pangolin_lineage': lambda v: LINEAGES[i % len(LINEAGES)] == v,
+            'covv_collection_date_from': lambda v: date >= v,
+            'covv_collection_date_to': lambda v: date <= v,
+            'quality': lambda v: all(value in ('complete', 'highq', 'lowco') for value in v),
+        }
+        # every mock record is complete and high coverage, and has no submission date or variant
+        return all(check(filters[name]) for name, check in checks.items() if filters.get(name))
+
+    def metadata_row(self, i):
+        return [
+            self.strain(i), 'ncov', f"EPI_ISL_{i + 1}", f"2021-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}",
+            REGIONS[i % len(REGIONS)], f"Country{i % 40}", '?' if i % 7 == 0 else f"Division{i % 300}",
+            LINEAGES[i % len(LINEAGES)], str(self.sequence_length),
+        ]
+
+    def write_archive(self, path, indices):
+        """
+        Writes an EpiCoV style tar with `<name>.metadata.tsv` and `<name>.sequences.fasta`.
+        """
+        work_dir = tempfile.mkdtemp(prefix='gisaidpy_mock_')
+        try:
+            metadata = os.path.join(work_dir, 'mock.metadata.tsv')
+            with open(metadata, 'w') as f:
+                f.write('\t'.join(METADATA_COLUMNS) + '\n')
+                for i in indices:
+                    f.write('\t'.join(self.metadata_row(i)) + '\n')
+            sequences = os.path.join(work_dir, 'mock.sequences.fasta')
+            with open(sequences, 'w') as f:
+                for i in indices:
+                    f.write(f">{self.strain(i)}\n{self.sequence(i)}\n")
+            with tarfile.open(path, 'w') as tar:
+                tar.add(metadata, arcname='mock.metadata.tsv')
+                tar.add(sequences, arcname='mock.sequences.fasta')
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def write_fasta(self, path, indices):
+        """
+        Writes an EpiRSV/EpiPox style FASTA with `strain|accession_id|date` headers.
+        """
+        with open(path, 'w') as f:
+            for i in indices:
+                row = self.metadata_row(i)
+                f.write(f">{row[0]}|{row[2]}|{row[3]}\n{self.sequence(i)}\n")
+
+
+class MockGISAIDServer:
+    """
+    Threaded local HTTP server emulating the GISAID frontend.
+
+    Args:
+        n_records (int): number of synthetic records in the mock database.
+        sequence_length (int): length of every synthetic sequence.
+        latency (float): seconds added to every request.
+        compression_seconds (float): how long a Download job takes before check_async reports ready.
+        database (str): 'EpiCoV' serves tar archives, anything else serves plain FASTA.
+        max_rate (float): requests per second above which requests are answered with 429 and a
+            Retry-After header, None accepts any rate.
+        host (str): interface to bind, port 0 picks a free one.
+        port (int): port to bind.
+    """
+
+    def __init__(self, n_records=1000, sequence_length=1000, latency=0.0, compression_seconds=0.0,
+                 database='EpiCoV', host='127.0.0.1', port=0, max_rate=None):
+        self.dataset = MockDataset(n_records, sequence_length)
+        self.latency = latency
+        self.compression_seconds = compression_seconds
+        self.database = database
+        self.max_rate = max_rate
+        self.files_dir = tempfile.mkdtemp(prefix='gisaidpy_mock_files_')
+        self.counts = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+        self._sessions = collections.defaultdict(dict)
+        self._jobs = {}
+        self._files = {}
+        self._httpd = http.server.ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def credentials(self, sid=None):
+        """
+        Returns a credentials dict for a fresh mock session.
+        """
+        return {
+            'sid': sid or uuid.uuid4().hex[:16],
+            'wid': 'w_mockmain',
+            'pid': MAIN_PID,
+            'query_cid': QUERY_CID,
+            'search_cid': SEARCH_CID,
+            'selection_panel_cid': SELECTION_PANEL_CID,
+            'selection_ceid': SELECTION_CEID,
+            'database': self.database,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        shutil.rmtree(self.files_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.max_in_flight = self.in_flight
+
+    def expire_session(self, sid):
+        """
+        Makes every further command of session `sid` fail as expired.
+        """
+        with self._lock:
+            self._sessions[sid]['expired'] = True
+
+    def close_panels(self, sid):
+        """
+        Forgets the panels opened by session `sid`, so commands sent to them fail.
+        """
+        with self._lock:
+            self._sessions[sid].pop('panels', None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': sum(v for k, v in self.counts.items() if k.startswith('http:')),
+                'counts': dict(self.counts),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'max_in_flight': self.max_in_flight,
+            }
+
+    def _throttled(self):
+        # sliding one second window over the accepted requests
+        if self.max_rate is None:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - 1:
+                self._recent.popleft()
+            if len(self._recent) >= self.max_rate:
+                self.counts['throttled'] += 1
+                return True
+            self._recent.append(now)
+            return False
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counts[key] += n
+
+    # protocol
+
+    def _new_job(self, kind, **payload):
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._jobs[job_id] = dict(payload, kind=kind, ready_at=time.monotonic() + self.compression_seconds)
+        return job_id
+
+    def _new_file(self, indices, kind):
+        token = uuid.uuid4().hex
+        if kind == 'ids':
+            path = os.path.join(self.files_dir, f"{token}.csv")
+            with open(path, 'w') as f:
+                f.write('\n'.join(self.dataset.accession_ids[i] for i in indices) + '\n')
+        elif self.database == 'EpiCoV':
+            path = os.path.join(self.files_dir, f"{token}.tar")
+            self.dataset.write_archive(path, indices)
+        else:
+            path = os.path.join(self.files_dir, f"{token}.fasta")
+            self.dataset.write_fasta(path, indices)
+        with self._lock:
+            self._files[token] = path
+        return f"/mock/files/{token}"
+
+    def _matching(self, session):
+        filters = session.get('filters', {})
+        return [i for i in range(self.dataset.n_records) if self.dataset.matches(i, filters)]
+
+    def _overlay(self, session, prefix):
+        wid, pid = f"w_{prefix}{uuid.uuid4().hex[:6]}", f"p_{prefix}{uuid.uuid4().hex[:6]}"
+        session.setdefault('panels', set()).add(pid)
+        return f"sys.openOverlay('{wid}','{pid}',new Object({{}}));"
+
+    def _command(self, session, command):
+        cmd = command['cmd']
+        params = command.get('params') or {}
+        self._count(f"cmd:{cmd}")
+        if cmd == 'Selection':
+            return {'data': self._overlay(session, 'sel')}
+        if cmd == 'DownloadAllSequences':
+            return {'data': self._overlay(session, 'dl')}
+        if cmd in ('setTarget', 'ChangeValue') and params.get('ceid') == SELECTION_CEID:
+            ids = [i for i in (self.dataset.index_of(a) for a in str(params.get('cvalue', '')).split(',')) if i is not None]
+            session['selected'] = ids
+            return {'data': ''}
+        if cmd in ('setTarget', 'ChangeValue') and params.get('ceid') in QUERY_FIELD_NAMES:
+            session.setdefault('filters', {})[QUERY_FIELD_NAMES[params['ceid']]] = params.get('cvalue')
+            return {'data': ''}
+        if cmd == 'FilterChange':
+            return {'data': ''}
+        if cmd == 'DownloadReminder':
+            return [{'data': ''}, {'data': ''}, {'data': self._overlay(session, 'rem')}]
+        if cmd == 'Download' and command.get('cid') == SELECTION_PANEL_CID:
+            path = self._new_file(self._matching(session), 'ids')
+            return {'data': f'sys.downloadFile("{path}",false);'}
+        if cmd == 'Download':
+            job_id = self._new_job('download', path=self._new_file(session.get('selected', []), 'data'))
+            session['download_job'] = job_id
+            return {'data': f"sys.call('{command.get('cid')}','{job_id}','generateDownloadDone');"}
+        if cmd == 'generateDownloadDone':
+            job = self._jobs.get(session.get('download_job'))
+            if job is None:
+                return {'data': 'Error: no download prepared.'}
+            return {'data': f'sys.downloadFile("{job["path"]}");'}
+        if cmd == 'Back':
+            return {'data': ''}
+        if cmd == 'Reset':
+            session.pop('selected', None)
+            session.pop('filters', None)
+            return {'data': ''}
+        return {'data': ''}
+
+    def _frontend(self, params, body):
+        form = urllib.parse.parse_qs(body, keep_blank_values=True)
+        form.update(params)
+        sid = (form.get('sid') or [''])[0]
+        session = self._sessions[sid]
+        mode = (form.get('mode') or ['ajax'])[0]
+
+        if 'data' not in form:
+            # panel or page load
+            self._count('page')
+            return 'text/html', self._page(mode)
+
+        if session.get('expired'):
+            return 'application/json', json.dumps({'responses': [{'data': 'The session has expired.'}]})
+        pid = (form.get('pid') or [''])[0]
+        if pid != MAIN_PID and pid not in session.get('panels', ()):
+            self._count('unknown_panel')
+            return 'application/json', json.dumps({'responses': [{'data': 'Error: unknown panel.'}]})
+
+        queue = json.loads(form['data'][0])['queue']
+        responses = []
+        result = {}
+        for command in queue:
+            if command['cmd'] == 'CallAsync':
+                self._count('cmd:CallAsync')
+                result['callback_response'] = {'async_id': self._new_job('select_all')}
+                responses.append({'data': ''})
+                continue
+            if command['cmd'] == 'GetData':
+                self._count('cmd:GetData')
+                matching = self._matching(session)
+                start = int(command['params'].get('start_index', 0))
+                rows = matching[start:start + int(command['params'].get('rows_per_page', 50))]
+                result['totalRecords'] = len(matching)
+                result['records'] = [{'covv_accession_id': self.dataset.accession_ids[i]} for i in rows]
+                responses.append({'data': ''})
+                continue
+            response = self._command(session, command)
+            responses.extend(response if isinstance(response, list) else [response])
+        # the real server answers with at least one response per queue, plus UI updates
+        while len(responses) < 2:
+            responses.append({'data': ''})
+        result['responses'] = responses
+        return 'application/json', json.dumps(result)
+
+    def _page(self, mode):
+        if mode == 'page':
+            return (
+                f"<script>sys.createComponent('{REMINDER_CID}','Corona2020DownloadReminderButtonsComponent');"
+                f"sys.createFI('{CHECKBOX_CEID}','CheckboxWidget','agreed');</script>"
+            )
+        return (
+            f"<script>sys.createComponent('{DOWNLOAD_PANEL_CID}','DownloadSelectionComponent');"
+            f"sys.createComponent('c_mockrsv01','RSVDownloadSelectionComponent');"
+            f"sys.createComponent('c_mockpox01','MPoxDownloadSelectionComponent');"
+            f"sys.createFI('{RADIO_CEID}','RadiobuttonWidget','augur_input');"
+            f"sys.createComponent('{SELECTION_PANEL_CID}','SelectionPanelComponent');"
+            + ''.join(
+                f"sys.createFI('{ceid}','{'CheckboxWidget' if name == 'quality' else 'EntryWidget'}','{name}');"
+                for name, ceid in QUERY_CEIDS.items()
+            )
+            + "</script>"
+        )
+
+    def _check_async(self, job_id):
+        self._count('check_async')
+        job = self._jobs.get(job_id)
+        ready = job is not None and time.monotonic() >= job['ready_at']
+        return 'application/json', json.dumps({'is_ready': ready, '__ready__': ready})
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, content_type, body, headers=None):
+                if isinstance(body, str):
+                    body = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+                with server._lock:
+                    server.bytes_sent += len(body)
+
+            def _send_file(self, path):
+                size = os.path.getsize(path)
+                start, status = 0, 200
+                requested = self.headers.get('Range')
+                if requested and requested.startswith('bytes='):
+                    start = int(requested[6:].split('-')[0] or 0)
+                    if start >= size:
+                        self._reply(416, 'application/octet-stream', b'', {'Content-Range': f"bytes */{size}"})
+                        return
+                    status = 206
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(size - start))
+                if status == 206:
+                    self.send_header('Content-Range', f"bytes {start}-{size - 1}/{size}")
+                self.end_headers()
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    shutil.copyfileobj(f, self.wfile, 1 << 20)
+                with server._lock:
+                    server.bytes_sent += size - start
+
+            def _handle(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode() if length else ''
+                with server._lock:
+                    server.bytes_received += length
+                    server.counts[f"http:{method}"] += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    if server._throttled():
+                        self._reply(429, 'text/plain', 'Too many requests', {'Retry-After': '1'})
+                    else:
+                        if server.latency:
+                            time.sleep(server.latency)
+                        self._route(body)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _route(self, body):
+                url = urllib.parse.urlsplit(self.path)
+                params = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+                if url.path.endswith('/epi3/frontend'):
+                    self._reply(200, *server._frontend(params, body))
+                elif '/epi3/check_async/' in url.path:
+                    self._reply(200, *server._check_async(url.path.rsplit('/', 1)[1]))
+                elif url.path.startswith('/mock/files/'):
+                    path = server._files.get(url.path.rsplit('/', 1)[1])
+                    if path is None:
+                        self._reply(404, 'text/plain', 'Unknown file')
+                    else:
+                        server._count('file')
+                        self._send_file(path)
+                else:
+                    self._reply(404, 'text/plain', 'Not found')
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+        return Handler
+
+
+def serve(n_records=1000, sequence_length=1000, latency=0.0, compression_seconds=0.0, port=8765):
+    """
+    Runs a mock server in the foreground until interrupted.
+    """
+    server = MockGISAIDServer(n_records, sequence_length, latency, compression_seconds, port=port)
+    logging.info(f"Mock GISAID server on {server.url}")
+    logging.info(json.dumps(server.credentials(), indent=2))
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    serve()
@@ -0,0 +1,68 @@
+import io
+import pytest
+from GISAIDpy import AccessionIDSet, get_accession_ids
+
+
+def test_ids_are_sorted_and_unique():
+    ids = AccessionIDSet(['EPI_ISL_10', 'EPI_ISL_2', 'EPI_ISL_10', ' EPI_ISL_3 ', 'EPI_SET_1', 'EPI1'])
+
+    assert len(ids) == 5
+    assert ids.to_list() == ['EPI_ISL_2', 'EPI_ISL_3', 'EPI_ISL_10', 'EPI_SET_1', 'EPI1']
+    assert 'EPI_ISL_3' in ids
+    assert 'EPI_ISL_4' not in ids
+    assert 'not an ID' not in ids
+
+
+def test_invalid_ids_are_rejected():
+    with pytest.raises(ValueError):
+        AccessionIDSet(['EPI_ISL_1', 'hCoV-19/Wuhan'])
+    with pytest.raises(ValueError):
+        AccessionIDSet(['EPI_ISL_01'])
+
+
+def test_set_operations():
+    a = AccessionIDSet(['EPI_ISL_1', 'EPI_ISL_2', 'EPI_ISL_3'])
+    b = AccessionIDSet(['EPI_ISL_3', 'EPI_ISL_4'])
+
+    assert (a | b).to_list() == ['EPI_ISL_1', 'EPI_ISL_2', 'EPI_ISL_3', 'EPI_ISL_4']
+    assert (a & b).to_list() == ['EPI_ISL_3']
+    assert (a - b).to_list() == ['EPI_ISL_1', 'EPI_ISL_2']
+    assert (a ^ b).to_list() == ['EPI_ISL_1', 'EPI_ISL_2', 'EPI_ISL_4']
+    assert a - ['EPI_ISL_1'] == AccessionIDSet(['EPI_ISL_2', 'EPI_ISL_3'])
+
+
+def test_slicing():
+    ids = AccessionIDSet(f"EPI_ISL_{i}" for i in range(1, 11))
+
+    assert ids[:3].to_list() == ['EPI_ISL_1', 'EPI_ISL_2', 'EPI_ISL_3']
+    assert ids[-1] == 'EPI_ISL_10'
+    with pytest.raises(ValueError):
+        ids[::2]
+
+
+def test_from_csv_in_chunks():
+    text = b''.join(f"EPI_ISL_{i}\n".encode() for i in range(1000, 0, -1)) + b'EPI_ISL_5'
+
+    ids = AccessionIDSet.from_csv(io.BytesIO(text), chunk_size=64)
+    assert len(ids) == 1000
+    assert ids[0] == 'EPI_ISL_1'
+
+
+def test_save_and_load(tmp_path):
+    ids = AccessionIDSet(['EPI_ISL_402124', 'EPI_ISL_1', 'EPI_SET_7'])
+    ids.save(tmp_path / 'ids.npz')
+
+    assert AccessionIDSet.load(tmp_path / 'ids.npz') == ids
+
+
+def test_join():
+    assert AccessionIDSet(['EPI_ISL_2', 'EPI_ISL_1']).join() == 'EPI_ISL_1, EPI_ISL_2'
+    assert AccessionIDSet().join() == ''
+
+
+def test_get_accession_ids(credentials):
+    ids = get_accession_ids(credentials, as_set=True)
+
+    assert isinstance(ids, AccessionIDSet)
+    assert len(ids) == 100
+    assert get_accession_ids(credentials)['accession_id'].to_list() == ids.to_list()
@@ -0,0 +1,31 @@
+import asyncio
+from GISAIDpy import AccessionIDSet, Query
+from GISAIDpy import async_functions
+
+
+def test_async_download(server, credentials):
+    async def run():
+        return await asyncio.gather(
+            async_functions.download(credentials, ['EPI_ISL_1', 'EPI_ISL_2']),
+            async_functions.download(server.credentials(), ['EPI_ISL_3'], get_sequence=False),
+        )
+
+    first, second = asyncio.run(run())
+    assert first['accession_id'].to_list() == ['EPI_ISL_2', 'EPI_ISL_1']
+    assert first['sequence'].to_list() == [server.dataset.sequence(i) for i in (1, 0)]
+    assert second['accession_id'].to_list() == ['EPI_ISL_3']
+    assert 'sequence' not in second.columns
+    assert server.stats()['counts']['cmd:Download'] == 2
+
+
+def test_async_count_and_accession_ids(credentials):
+    async def run():
+        total = await async_functions.count_query(credentials, Query().location('Europe'))
+        return total, await async_functions.get_accession_ids(credentials, as_set=True)
+
+    total, ids = asyncio.run(run())
+    assert total == 17
+    assert isinstance(ids, AccessionIDSet)
+    assert len(ids) == 17
+    # every sixth record is European
+    assert 'EPI_ISL_3' in ids.to_frame()['accession_id'].to_list()
@@ -0,0 +1,87 @@
+import os
+import polars as pl
+from GISAIDpy import AccessionIDSet, RecordCache, download
+
+
+def _records(*numbers, sequence=True):
+    df = pl.DataFrame({
+        'accession_id': [f"EPI_ISL_{n}" for n in numbers],
+        'strain': [f"strain{n}" for n in numbers],
+    })
+    return df.with_columns(pl.lit('ACGT').alias('sequence')) if sequence else df
+
+
+def test_get_and_put(tmp_path):
+    cache = RecordCache(str(tmp_path))
+    assert cache.get(['EPI_ISL_1']) == (None, ['EPI_ISL_1'])
+
+    cache.put(_records(1, 2))
+    cached, missing = cache.get(['EPI_ISL_2', 'EPI_ISL_3'])
+    assert cached['accession_id'].to_list() == ['EPI_ISL_2']
+    assert missing == ['EPI_ISL_3']
+
+    cached, missing = cache.get(AccessionIDSet(['EPI_ISL_1', 'EPI_ISL_3']))
+    assert cached['accession_id'].to_list() == ['EPI_ISL_1']
+    assert missing == AccessionIDSet(['EPI_ISL_3'])
+
+
+def test_metadata_only_records_do_not_answer_sequence_lookups(tmp_path):
+    cache = RecordCache(str(tmp_path))
+    cache.put(_records(1, sequence=False))
+
+    assert cache.get(['EPI_ISL_1'])[1] == ['EPI_ISL_1']
+    assert cache.get(['EPI_ISL_1'], get_sequence=False)[1] == []
+
+
+def test_lookups_write_access_times_on_close(tmp_path):
+    with RecordCache(str(tmp_path)) as cache:
+        cache.put(_records(1))
+        index_mtime = os.path.getmtime(tmp_path / 'index.parquet')
+        partitions = (tmp_path / 'partitions.json').read_text()
+
+        cache.get(['EPI_ISL_1'])
+        assert os.path.getmtime(tmp_path / 'index.parquet') == index_mtime
+        assert (tmp_path / 'partitions.json').read_text() == partitions
+
+    assert (tmp_path / 'partitions.json').read_text() != partitions
+    assert os.path.getmtime(tmp_path / 'index.parquet') == index_mtime
+
+
+def test_reopened_cache(tmp_path):
+    RecordCache(str(tmp_path)).put(_records(1, 2))
+
+    cache = RecordCache(str(tmp_path))
+    assert cache.get(['EPI_ISL_1', 'EPI_ISL_2'])[0].height == 2
+
+
+def test_ttl(tmp_path):
+    cache = RecordCache(str(tmp_path), ttl=-1)
+    cache.put(_records(1))
+
+    assert cache.get(['EPI_ISL_1'])[0] is None
+    assert cache.size() == 0
+
+
+def test_lru_eviction(tmp_path):
+    cache = RecordCache(str(tmp_path))
+    cache.put(_records(1))
+    cache.put(_records(2))
+    cache.get(['EPI_ISL_1'])
+
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    assert cache.get(['EPI_ISL_1', 'EPI_ISL_2'])[1] == ['EPI_ISL_2']
+
+
+def test_download_only_fetches_missing_records(server, credentials, tmp_path):
+    cache = RecordCache(str(tmp_path))
+    download(credentials, ['EPI_ISL_1', 'EPI_ISL_2'], cache=cache)
+
+    server.reset_counts()
+    df = download(credentials, ['EPI_ISL_1', 'EPI_ISL_2', 'EPI_ISL_3'], cache=cache)
+    assert sorted(df['accession_id'].to_list()) == ['EPI_ISL_1', 'EPI_ISL_2', 'EPI_ISL_3']
+    assert server.stats()['counts']['cmd:Download'] == 1
+
+    server.reset_counts()
+    assert download(credentials, ['EPI_ISL_3', 'EPI_ISL_1'], cache=cache).height == 2
+    assert 'cmd:Download' not in server.stats()['counts']
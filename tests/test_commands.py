@@ -0,0 +1,41 @@
+import asyncio
+import json
+import urllib.parse
+import pytest
+from GISAIDpy import async_functions, download
+from GISAIDpy.functions import CommandQueue
+from GISAIDpy.tracing import SpanRecorder, add_hook, remove_hook
+
+
+def test_command_queue():
+    queue = CommandQueue('sid', 'w1', 'p1')
+    queue.set_value('c1', 'ce1', 'augur_input', 'FormatChange', equiv=True).add('c1', 'DownloadReminder')
+
+    with pytest.raises(ValueError):
+        queue.target('w2', 'p2')
+    data = urllib.parse.parse_qs(queue.build())
+    commands = json.loads(data['data'][0])['queue']
+    assert [c['cmd'] for c in commands] == ['setTarget', 'ChangeValue', 'FormatChange', 'DownloadReminder']
+    assert commands[0]['equiv'] == 'STce1'
+    assert queue.round_trips == 1
+    with pytest.raises(ValueError):
+        queue.build()
+    assert queue.target('w2', 'p2').wid == 'w2'
+
+
+@pytest.fixture
+def recorder():
+    recorder = SpanRecorder()
+    add_hook(recorder)
+    yield recorder
+    remove_hook(recorder)
+
+
+def test_download_round_trips(server, credentials, recorder):
+    download(credentials, ['EPI_ISL_1'])
+    # format and reminder, agreement page, agreement and download, download link
+    assert recorder.spans[-1].attributes['round_trips'] == 4
+    assert server.stats()['counts']['cmd:Download'] == 1
+
+    asyncio.run(async_functions.download(server.credentials(), ['EPI_ISL_2']))
+    assert recorder.spans[-1].attributes['round_trips'] == 4
@@ -0,0 +1,60 @@
+from GISAIDpy.components import (
+    QUERY_FIELDS, extract_component_ids, extract_components, extract_download_job, extract_field_ids, extract_overlay,
+)
+
+DOWNLOAD_PAGE = (
+    "<div id='c_button01'></div><script>"
+    "sys.createComponent('c_button01','ButtonWidget');"
+    "sys.createComponent('c_qwe123ab','DownloadSelectionComponent');"
+    "sys.createComponent('c_rsv456cd','RSVDownloadSelectionComponent');"
+    "sys.createFI('ce_rad789e','RadiobuttonWidget','augur_input');"
+    "sys.createFI('ce_rad000x','RadiobuttonWidget','other_input');"
+    "</script>"
+)
+AGREEMENT_PAGE = (
+    "<script>sys.createComponent('c_remind01','Corona2020DownloadReminderButtonsComponent');"
+    "sys.createFI('ce_check01','CheckboxWidget','agreed');</script>"
+)
+SEARCH_PAGE = (
+    "<script>sys.createFI('ce_loc0001','EntryWidget','covv_location');"
+    "sys.createFI('ce_lin0001','EntryWidget','pangolin_lineage');"
+    "sys.createFI('ce_qual001','CheckboxWidget','quality');</script>"
+)
+
+
+def test_extract_components_keeps_the_first_declaration():
+    components = extract_components(DOWNLOAD_PAGE)
+
+    assert components['ButtonWidget'] == 'c_button01'
+    assert components['RadiobuttonWidget'] == 'ce_rad789e'
+
+
+def test_extract_component_ids():
+    roles = ['download_selection', 'format_radio']
+
+    assert extract_component_ids(DOWNLOAD_PAGE, 'EpiCoV', roles) == {
+        'download_selection': 'c_qwe123ab', 'format_radio': 'ce_rad789e'
+    }
+    assert extract_component_ids(DOWNLOAD_PAGE, 'EpiRSV', roles)['download_selection'] == 'c_rsv456cd'
+    assert extract_component_ids(DOWNLOAD_PAGE, 'EpiPox', roles)['download_selection'] is None
+    assert extract_component_ids(AGREEMENT_PAGE, 'EpiCoV', ['reminder_buttons', 'agree_checkbox']) == {
+        'reminder_buttons': 'c_remind01', 'agree_checkbox': 'ce_check01'
+    }
+
+
+def test_extract_field_ids():
+    fields = extract_field_ids(SEARCH_PAGE, 'EpiCoV', list(QUERY_FIELDS['EpiCoV']))
+
+    assert fields['location'] == 'ce_loc0001'
+    assert fields['lineage'] == 'ce_lin0001'
+    assert fields['quality'] == 'ce_qual001'
+    assert fields['virus_name'] is None
+
+
+def test_extract_overlay_and_download_job():
+    assert extract_overlay("sys.openOverlay('wid_abc123','pid_def456',new Object({}));") == {
+        'wid': 'wid_abc123', 'pid': 'pid_def456'
+    }
+    assert extract_overlay("sys.goBack();") is None
+    assert extract_download_job("sys.call('c_remind01','job_42','generateDownloadDone');") == 'job_42'
+    assert extract_download_job("sys.call('c_remind01','job_42','Other');") is None
@@ -0,0 +1,46 @@
+import polars as pl
+import pytest
+from GISAIDpy.dedup import attach_sequences, deduplicate, new_sequences, unique_sequences
+from GISAIDpy.polars_funcs import HASH_COLUMN, hash_sequences
+
+
+def _records():
+    return pl.DataFrame({
+        'strain': ['a', 'b', 'c', 'd'],
+        'sequence': ['ACGT', 'GGCC', 'ACGT', None],
+    })
+
+
+def test_deduplicate_and_attach():
+    records, sequences = deduplicate(_records())
+
+    assert records.columns == ['strain', HASH_COLUMN]
+    assert records[HASH_COLUMN][0] == records[HASH_COLUMN][2]
+    assert sequences['sequence'].to_list() == ['ACGT', 'GGCC', None]
+    assert attach_sequences(records, sequences).drop(HASH_COLUMN).equals(_records())
+
+
+def test_hashes_are_stable():
+    hashes = hash_sequences(pl.Series(['ACGT', None]))
+
+    # BLAKE2b-128 of the sequence text, comparable with hashes stored by earlier downloads
+    assert hashes.to_list() == ['f9f322ef1b905091d65847bc9eeec665', None]
+
+
+def test_unique_sequences_keeps_an_existing_hash_column():
+    df = _records().with_columns(pl.lit('x').alias(HASH_COLUMN))
+
+    assert unique_sequences(df).height == 1
+
+
+# is_in with a Series of the column's own type is deprecated as ambiguous; polars 2
+# prints that warning from Rust rather than through the warnings module
+@pytest.mark.filterwarnings('error')
+def test_new_sequences(capfd):
+    sequences = unique_sequences(pl.DataFrame({'sequence': ['ACGT', 'GGCC', 'TTAA', 'ACGT']}))
+    known = sequences[HASH_COLUMN][:2]
+
+    assert new_sequences(sequences, known)['sequence'].to_list() == ['TTAA']
+    assert new_sequences(sequences.lazy(), set(known)).collect().height == 1
+    assert new_sequences(sequences, []).height == 3
+    assert 'deprecated' not in capfd.readouterr().err
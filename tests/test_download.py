@@ -0,0 +1,113 @@
+import os
+import polars as pl
+import pytest
+from GISAIDpy import AccessionIDSet, download, download_bulk
+
+
+def test_download(server, credentials):
+    df = download(credentials, ['EPI_ISL_1', 'EPI_ISL_2', 'EPI_ISL_3'])
+
+    assert df['accession_id'].to_list() == ['EPI_ISL_3', 'EPI_ISL_2', 'EPI_ISL_1']
+    assert df['sequence'].to_list() == [server.dataset.sequence(i) for i in (2, 1, 0)]
+    assert df['strain'].to_list() == [server.dataset.strain(i) for i in (2, 1, 0)]
+    assert server.stats()['counts']['cmd:Download'] == 1
+
+
+def test_download_without_sequences(credentials):
+    df = download(credentials, ['EPI_ISL_1', 'EPI_ISL_2'], get_sequence=False)
+
+    assert df.height == 2
+    assert 'sequence' not in df.columns
+
+
+def test_download_columns_and_predicate(credentials):
+    df = download(
+        credentials, AccessionIDSet(f"EPI_ISL_{i}" for i in range(1, 13)), columns=['region'],
+        predicate=pl.col('region') == 'Europe'
+    )
+
+    assert df.columns == ['accession_id', 'strain', 'region', 'sequence']
+    assert df['accession_id'].to_list() == ['EPI_ISL_9', 'EPI_ISL_3']
+
+
+def test_download_keeps_raw_dates(credentials):
+    df = download(credentials, ['EPI_ISL_1', 'EPI_ISL_2'], columns=['date'], parse_dates=True)
+
+    assert df.schema['date'] == pl.String
+    assert df.schema['date_parsed'] == pl.Date
+    assert df['date'].to_list() == ['2021-02-02', '2021-01-01']
+
+
+def test_download_fasta_database(fasta_server):
+    df = download(fasta_server.credentials(), ['EPI_ISL_4', 'EPI_ISL_5'])
+
+    assert df['accession_id'].to_list() == ['EPI_ISL_5', 'EPI_ISL_4']
+    assert df['strain'].to_list() == [fasta_server.dataset.strain(i) for i in (4, 3)]
+    assert df['sequence'].to_list() == [fasta_server.dataset.sequence(i) for i in (4, 3)]
+
+
+def test_download_to_output(credentials, tmp_path):
+    lf = download(credentials, ['EPI_ISL_1', 'EPI_ISL_2'], output=str(tmp_path), dedupe=True)
+
+    assert isinstance(lf, pl.LazyFrame)
+    assert sorted(lf.collect()['accession_id'].to_list()) == ['EPI_ISL_1', 'EPI_ISL_2']
+
+
+def test_download_rejects_empty_and_oversized_selections(credentials):
+    with pytest.raises(ValueError):
+        download(credentials, [])
+    with pytest.raises(ValueError):
+        download(credentials, [f"EPI_ISL_{i}" for i in range(5001)])
+
+
+def test_download_bulk(server, credentials):
+    ids = [f"EPI_ISL_{i}" for i in range(1, 26)]
+    df = download_bulk(credentials, ids, batch_size=10)
+
+    assert sorted(df['accession_id'].to_list()) == sorted(ids)
+    assert df['sequence'].null_count() == 0
+    assert server.stats()['counts']['cmd:Download'] == 3
+
+
+def test_download_bulk_output_scans_only_this_call(server, credentials, tmp_path):
+    output = str(tmp_path)
+    first = download_bulk(credentials, AccessionIDSet(f"EPI_ISL_{i}" for i in range(1, 21)), batch_size=8,
+                          output=output)
+    second = download_bulk(credentials, ['EPI_ISL_50', 'EPI_ISL_51'], output=output)
+
+    # batches with different metadata values are scanned together
+    assert first.collect().height == 20
+    assert sorted(second.collect()['accession_id'].to_list()) == ['EPI_ISL_50', 'EPI_ISL_51']
+
+    # finished batches are not downloaded again
+    server.reset_counts()
+    assert download_bulk(credentials, ['EPI_ISL_50', 'EPI_ISL_51'], output=output).collect().height == 2
+    assert 'cmd:Download' not in server.stats()['counts']
+
+
+def test_download_bulk_checkpoints(server, credentials, tmp_path):
+    ids = [f"EPI_ISL_{i}" for i in range(1, 6)]
+    checkpoint_dir = str(tmp_path)
+    download_bulk(credentials, ids, get_sequence=False, checkpoint_dir=checkpoint_dir)
+    assert len(os.listdir(checkpoint_dir)) == 1
+
+    # metadata-only checkpoints are not reused when the sequences are wanted
+    df = download_bulk(credentials, ids, checkpoint_dir=checkpoint_dir)
+    assert 'sequence' in df.columns
+    assert server.stats()['counts']['cmd:Download'] == 2
+
+    server.reset_counts()
+    assert download_bulk(credentials, ids, checkpoint_dir=checkpoint_dir).height == 5
+    assert 'cmd:Download' not in server.stats()['counts']
+
+
+def test_download_bulk_failure_hint(server, credentials, tmp_path):
+    server.expire_session(credentials['sid'])
+    ids = ['EPI_ISL_1', 'EPI_ISL_2']
+
+    with pytest.raises(Exception, match='pass checkpoint_dir'):
+        download_bulk(credentials, ids, retries=0)
+    with pytest.raises(Exception, match='same checkpoint_dir'):
+        download_bulk(credentials, ids, retries=0, checkpoint_dir=str(tmp_path / 'checkpoints'))
+    with pytest.raises(Exception, match='same output'):
+        download_bulk(credentials, ids, retries=0, output=str(tmp_path / 'output'))
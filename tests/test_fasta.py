@@ -0,0 +1,106 @@
+import gzip
+import io
+import polars as pl
+import pytest
+from GISAIDpy.polars_funcs import (
+    HASH_COLUMN, iter_fasta, read_fasta, read_fasta_parallel, scan_fasta, sequence_hash, sequence_stats,
+    with_sequence_stats,
+)
+
+FASTA = (
+    ">hCoV-19/England/1/2021|EPI_ISL_1|2021-01-02\nACGT\nAC GT\n"
+    ">hCoV-19/Wales/2/2021|EPI_ISL_2|2021-02-03\nGG\n"
+    ">hCoV-19/Scotland/3/2021|EPI_ISL_3|2021-03-04\n\nTTTT\n"
+)
+STRAINS = [
+    'hCoV-19/England/1/2021|EPI_ISL_1|2021-01-02',
+    'hCoV-19/Wales/2/2021|EPI_ISL_2|2021-02-03',
+    'hCoV-19/Scotland/3/2021|EPI_ISL_3|2021-03-04',
+]
+
+
+def test_iter_fasta_batches(tmp_path):
+    path = tmp_path / 'sequences.fasta'
+    path.write_text(FASTA)
+
+    batches = list(iter_fasta(path, batch_size=2))
+    assert [batch.height for batch in batches] == [2, 1]
+    df = pl.concat(batches)
+    assert df['strain'].to_list() == STRAINS
+    assert df['sequence'].to_list() == ['ACGTACGT', 'GG', 'TTTT']
+    assert list(iter_fasta(path, get_sequence=False))[0].columns == ['strain']
+
+
+def test_iter_fasta_inputs(tmp_path):
+    path = tmp_path / 'sequences.fasta.gz'
+    with gzip.open(path, 'wt') as f:
+        f.write(FASTA)
+    expected = pl.concat(iter_fasta(io.BytesIO(FASTA.encode())))
+
+    assert pl.concat(iter_fasta(path)).equals(expected)
+    assert pl.concat(iter_fasta(str(path))).equals(expected)
+    assert pl.concat(iter_fasta(io.StringIO(FASTA))).equals(expected)
+
+
+def test_scan_fasta(tmp_path):
+    path = tmp_path / 'sequences.fasta'
+    path.write_text(FASTA)
+
+    lf = scan_fasta(path, batch_size=1)
+    assert lf.collect_schema() == {'strain': pl.Utf8, 'sequence': pl.Utf8}
+    assert lf.collect()['sequence'].to_list() == ['ACGTACGT', 'GG', 'TTTT']
+    assert lf.select('strain').collect()['strain'].to_list() == STRAINS
+    assert lf.head(2).collect().height == 2
+    assert lf.filter(pl.col('sequence') == 'GG').collect()['strain'].to_list() == STRAINS[1:2]
+
+
+EDGE_CASES = {
+    'crlf': FASTA.replace('\n', '\r\n'),
+    'no_final_newline': FASTA.rstrip('\n'),
+    'blank_lines': '\n\n' + FASTA.replace('\n>', '\n\n\n>') + '\n\n',
+    'empty': '',
+    'only_blank_lines': '\n\n\n',
+    'quotes_and_hashes': '>"quoted" #1|EPI_ISL_1\nAC\n># comment, "2\nGT\n>empty\n>x\tTab \nN N\n',
+    'before_first_header': 'ACGT\n' + FASTA,
+    'long': ''.join(f'>s{i}|"{i}"#\n{"ACGT" * (i % 5)}\n{"N" * i}\n' for i in range(50)),
+}
+
+
+def _expected(path, get_sequence=True):
+    batches = list(iter_fasta(path, batch_size=3, get_sequence=get_sequence))
+    if not batches:
+        return pl.DataFrame(schema={'strain': pl.Utf8, 'sequence': pl.Utf8} if get_sequence else {'strain': pl.Utf8})
+    return pl.concat(batches)
+
+
+@pytest.mark.parametrize('case', EDGE_CASES)
+def test_read_fasta_parallel_matches_iter_fasta(tmp_path, case):
+    path = tmp_path / 'sequences.fasta'
+    path.write_bytes(EDGE_CASES[case].encode())
+    expected = _expected(path)
+
+    for n_chunks in [1, 2, 3, 7, 64]:
+        assert read_fasta_parallel(path, n_chunks=n_chunks).equals(expected), n_chunks
+        assert read_fasta_parallel(path, get_sequence=False, n_chunks=n_chunks).equals(_expected(path, False))
+    assert read_fasta(path, parallel=False).equals(expected)
+    with open(path, 'rb') as f:
+        assert read_fasta_parallel(f, n_chunks=3).equals(expected)
+
+
+def test_sequence_stats():
+    df = pl.DataFrame({'sequence': ['ACGTNN', 'ggcc', 'RYN', '', None]}).select(sequence_stats())
+
+    # shares over no bases are NaN
+    assert df.fill_nan(None).rows() == [
+        (6, 2, 2 / 6, 0.5), (4, 0, 0.0, 1.0), (3, 1, 1.0, None), (0, 0, None, None), (None, None, None, None),
+    ]
+
+
+def test_read_fasta_parallel_stats(tmp_path):
+    path = tmp_path / 'sequences.fasta'
+    path.write_text(EDGE_CASES['long'])
+    expected = with_sequence_stats(_expected(path)).with_columns(sequence_hash())
+
+    df = read_fasta_parallel(path, stats=True, content_hash=True, n_chunks=4)
+    assert df.equals(expected.select(df.columns))
+    assert read_fasta_parallel(path, get_sequence=False, stats=True, n_chunks=4).equals(expected.drop('sequence', HASH_COLUMN))
@@ -0,0 +1,29 @@
+from GISAIDpy.fasta_index import build_fasta_index, fetch_sequences, load_fasta_index, scan_sequences
+
+FASTA = (
+    ">hCoV-19/South Africa/NHLS-1/2021|EPI_ISL_11|2021-03\nACGT\nAC\n"
+    ">hCoV-19/New Zealand/2/2021\nGGGG\n"
+    ">hCoV-19/Wales/3/2021|EPI_ISL_13|2021-04-01\nTT\n"
+)
+
+
+def test_index_keeps_full_headers(tmp_path):
+    path = tmp_path / 'sequences.fasta'
+    path.write_text(FASTA)
+
+    index = build_fasta_index(path)
+    assert index['name'][0] == 'hCoV-19/South Africa/NHLS-1/2021|EPI_ISL_11|2021-03'
+    assert index['strain'].to_list() == [
+        'hCoV-19/South Africa/NHLS-1/2021', 'hCoV-19/New Zealand/2/2021', 'hCoV-19/Wales/3/2021'
+    ]
+    assert index['accession_id'].to_list() == ['EPI_ISL_11', None, 'EPI_ISL_13']
+    assert load_fasta_index(path).equals(index)
+
+
+def test_fetch_sequences(tmp_path):
+    path = tmp_path / 'sequences.fasta'
+    path.write_text(FASTA)
+
+    df = fetch_sequences(path, strains=['hCoV-19/New Zealand/2/2021'], accession_ids=['EPI_ISL_11'])
+    assert df.rows() == [('hCoV-19/South Africa/NHLS-1/2021', 'ACGTAC'), ('hCoV-19/New Zealand/2/2021', 'GGGG')]
+    assert scan_sequences(path, accession_ids=['EPI_ISL_13']).collect().rows() == [('hCoV-19/Wales/3/2021', 'TT')]
@@ -0,0 +1,44 @@
+import json
+import sys
+import pytest
+from GISAIDpy.jobs import job_key, load_manifest
+
+
+def _manifest(tmp_path, server, jobs):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps({'credentials': [server.credentials()], 'base_url': server.url, 'jobs': jobs}))
+    return load_manifest(str(path))
+
+
+def test_load_manifest(server, tmp_path):
+    manifest = _manifest(tmp_path, server, [{'name': 'few', 'ids': ['EPI_ISL_1'], 'parse_dates': True}])
+
+    job = manifest['jobs'][0]
+    assert job['parse_dates'] is True
+    assert job['output'] == str(tmp_path / 'gisaidpy_output' / 'few')
+
+
+def test_job_key_follows_ids_file_contents(server, tmp_path):
+    ids_file = tmp_path / 'ids.txt'
+    ids_file.write_text('EPI_ISL_1\n')
+    job = _manifest(tmp_path, server, [{'name': 'file', 'ids_file': 'ids.txt'}])['jobs'][0]
+
+    key = job_key(job)
+    assert job_key(job) == key
+    ids_file.write_text('EPI_ISL_1\nEPI_ISL_2\n')
+    assert job_key(job) != key
+    ids_file.unlink()
+    assert job_key(job) != key
+
+
+def test_toml_manifest(server, tmp_path, monkeypatch):
+    credentials = ', '.join(f'{key} = "{value}"' for key, value in server.credentials().items())
+    path = tmp_path / 'manifest.toml'
+    path.write_text(f'credentials = {{{credentials}}}\n[[jobs]]\nname = "few"\nids = ["EPI_ISL_1"]\n')
+    assert load_manifest(str(path))['jobs'][0]['ids'] == ['EPI_ISL_1']
+
+    # neither tomllib (Python < 3.11) nor its tomli backport
+    monkeypatch.setitem(sys.modules, 'tomllib', None)
+    monkeypatch.setitem(sys.modules, 'tomli', None)
+    with pytest.raises(ValueError, match='TOML manifests need'):
+        load_manifest(str(path))
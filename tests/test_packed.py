@@ -0,0 +1,59 @@
+import polars as pl
+import pytest
+from GISAIDpy.packed import (
+    ALPHABET, MIN_N_RUN, decode_sequence, decode_sequences, encode_sequence, encode_sequences, pack,
+    packed_stats, sequence_length, slice_sequence, unpack,
+)
+from GISAIDpy.polars_funcs import sequence_stats
+
+IUPAC = ALPHABET.decode()
+SEQUENCES = [
+    IUPAC,
+    IUPAC[1:],
+    'N' * (MIN_N_RUN - 1) + 'ACG',
+    'A' + 'N' * MIN_N_RUN + 'CG',
+    'AC' + 'N' * (MIN_N_RUN + 1),
+    'N' * 20 + 'ACGTRY' + 'N' * 9 + 'T' + 'N' * 3 + 'G',
+    'N' * 30,
+    '',
+]
+
+
+def test_round_trip():
+    assert decode_sequences(encode_sequences(SEQUENCES)) == SEQUENCES
+    assert [decode_sequence(encode_sequence(s)) for s in SEQUENCES] == SEQUENCES
+    assert [sequence_length(encode_sequence(s)) for s in SEQUENCES] == [len(s) for s in SEQUENCES]
+    assert decode_sequence(encode_sequence('acgun.X')) == 'ACGTN-N'
+
+
+@pytest.mark.parametrize('n', [MIN_N_RUN - 1, MIN_N_RUN, MIN_N_RUN + 1])
+def test_n_runs(n):
+    sequence = 'A' + 'N' * n + 'C'
+    data = encode_sequence(sequence)
+
+    n_runs = int.from_bytes(data[4:8], 'little')
+    assert n_runs == (n >= MIN_N_RUN)
+    assert decode_sequence(data) == sequence
+    # a run shrinks the body to the bases around it
+    assert len(data) == 8 + 8 * n_runs + (len(sequence) - n_runs * n + 1) // 2
+
+
+def test_slice_sequence():
+    for sequence in SEQUENCES:
+        data = encode_sequence(sequence)
+        for start in range(len(sequence) + 1):
+            for end in range(start, len(sequence) + 2):
+                assert slice_sequence(data, start, end) == sequence[start:end], (sequence, start, end)
+    data = encode_sequence(SEQUENCES[5])
+    assert slice_sequence(data) == SEQUENCES[5]
+    assert slice_sequence(data, -5) == SEQUENCES[5][-5:]
+
+
+def test_packed_stats_match_sequence_stats():
+    sequences = pl.Series('sequence', SEQUENCES[:-1] + ['GGCCAT', None])
+    expected = pl.DataFrame({'sequence': sequences}).select(sequence_stats())
+
+    df = pl.DataFrame({'sequence': sequences}).lazy().with_columns(pack()).collect()
+    assert df.schema['sequence'] == pl.Binary
+    assert packed_stats(df['sequence']).equals(expected)
+    assert df.select(unpack())['sequence'].equals(sequences)
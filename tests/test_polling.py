@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+import pytest
+from GISAIDpy.polling import AsyncJobWaiter
+
+
+def _job(ready_after):
+    calls = []
+
+    def check(job):
+        calls.append(job)
+        return {'ready': len(calls) >= ready_after}
+
+    async def check_async(job):
+        return check(job)
+
+    return calls, check, check_async
+
+
+def _is_ready(result):
+    return result['ready']
+
+
+def test_wait_records_history():
+    waiter = AsyncJobWaiter(initial_interval=0.001, max_interval=0.002, history_size=2)
+    for job in ['a', 'b', 'c']:
+        calls, check, _ = _job(3)
+        assert waiter.wait(job, check, _is_ready) == {'ready': True}
+        assert calls == [job] * 3
+
+    assert [h['job'] for h in waiter.history] == ['b', 'c']
+    assert waiter.stats()['jobs'] == 2
+    assert waiter.stats()['mean_polls'] == 3
+
+
+def test_history_size_zero_keeps_nothing():
+    waiter = AsyncJobWaiter(initial_interval=0.001, history_size=0)
+    waiter.wait('a', _job(1)[1], _is_ready)
+
+    assert list(waiter.history) == []
+    assert waiter.stats()['jobs'] == 0
+
+
+def test_timeout():
+    waiter = AsyncJobWaiter(initial_interval=0.01, max_interval=0.01, timeout=0.05)
+    with pytest.raises(TimeoutError):
+        waiter.wait('a', _job(1000)[1], _is_ready)
+
+
+def test_cancel_before_the_first_check():
+    waiter = AsyncJobWaiter()
+    calls, check, check_async = _job(1)
+    event = threading.Event()
+    event.set()
+
+    with pytest.raises(InterruptedError):
+        waiter.wait('a', check, _is_ready, cancel_event=event)
+
+    async def wait():
+        cancel_event = asyncio.Event()
+        cancel_event.set()
+        await waiter.wait_async('a', check_async, _is_ready, cancel_event=cancel_event)
+
+    with pytest.raises(InterruptedError):
+        asyncio.run(wait())
+    assert calls == []
+
+
+def test_cancel_wakes_the_sleep():
+    waiter = AsyncJobWaiter(initial_interval=30, max_interval=30)
+    calls, check, check_async = _job(1000)
+    threading.Timer(0.1, waiter.cancel).start()
+
+    start = time.monotonic()
+    with pytest.raises(InterruptedError):
+        waiter.wait('a', check, _is_ready)
+    threading.Timer(0.1, waiter.cancel).start()
+    with pytest.raises(InterruptedError):
+        asyncio.run(waiter.wait_async('b', check_async, _is_ready))
+
+    assert time.monotonic() - start < 5
+    assert calls == ['a', 'b']
+    # later waits are not affected
+    assert waiter.wait('c', _job(1)[1], _is_ready) == {'ready': True}
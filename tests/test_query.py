@@ -0,0 +1,38 @@
+import datetime
+import pytest
+from GISAIDpy import Query, count_query, get_accession_ids, reset_query
+
+
+def test_quality_filters_share_one_field():
+    query = Query().complete().high_coverage().complete()
+    assert query.filters == {'quality': ['complete', 'highq']}
+
+    field_ids = {'quality': 'ce_quality'}
+    commands = query.commands({'wid': 'w', 'pid': 'p', 'search_cid': 'c'}, field_ids)
+    assert [command['cmd'] for command in commands] == ['Reset', 'setTarget', 'ChangeValue', 'FilterChange']
+    assert commands[2]['params'] == {'cvalue': ['complete', 'highq'], 'ceid': 'ce_quality'}
+
+
+def test_from_dict():
+    query = Query.from_dict({
+        'location': 'Europe', 'collection_date': ['2021-01-01', datetime.date(2021, 3, 31)],
+        'low_coverage_excluded': True, 'complete': False,
+    })
+
+    assert query.filters == {
+        'location': 'Europe', 'collection_date_from': '2021-01-01', 'collection_date_to': '2021-03-31',
+        'quality': ['lowco'],
+    }
+    with pytest.raises(ValueError):
+        Query.from_dict({'commands': 1})
+    with pytest.raises(ValueError):
+        Query().collection_date('2021-13-01')
+
+
+def test_count_query(credentials):
+    assert count_query(credentials, Query().location('Europe')) == 17
+    assert count_query(credentials, Query().location('Europe').lineage('B.1.1.7').complete().high_coverage()) == 3
+    assert len(get_accession_ids(credentials, as_set=True)) == 3
+
+    reset_query(credentials)
+    assert len(get_accession_ids(credentials, as_set=True)) == 100
@@ -0,0 +1,107 @@
+import asyncio
+import email.utils
+import threading
+import time
+import pytest
+from GISAIDpy.ratelimit import RateLimiter, parse_retry_after
+
+
+def _unlimited(**limits):
+    options = dict(rate=None, burst=None, concurrency=None, host_rate=None, host_burst=None, host_concurrency=None)
+    return RateLimiter(**dict(options, **limits))
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    in_a_minute = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert 55 < parse_retry_after(in_a_minute) <= 60
+
+
+def test_rate_and_burst():
+    limiter = _unlimited(rate=20, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire('host', 'sid').release()
+    assert time.monotonic() - start < 0.1
+
+    for _ in range(4):
+        limiter.acquire('host', 'sid').release()
+    # the burst is spent, every further request waits for its token
+    assert time.monotonic() - start >= 0.15
+    # other sessions have their own bucket
+    assert limiter.acquire('host', 'other').wait < 0.05
+
+    stats = limiter.stats()
+    assert stats['session:sid']['requests'] == 7
+    assert stats['host:host']['requests'] == 8
+
+
+def test_concurrency():
+    limiter = _unlimited(host_concurrency=1)
+    first = limiter.acquire('host', 'a')
+    acquired = threading.Event()
+
+    def second():
+        limiter.acquire('host', 'b').release()
+        acquired.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not acquired.wait(0.1)
+    assert limiter.stats()['host:host']['in_flight'] == 1
+    first.release()
+    assert acquired.wait(5)
+    thread.join()
+    assert limiter.stats()['host:host']['in_flight'] == 0
+
+
+def test_cancelled_async_waiter_hands_its_slot_on():
+    limiter = _unlimited(concurrency=1)
+
+    async def run():
+        first = await limiter.acquire_async('host', 'sid')
+        cancelled = asyncio.ensure_future(limiter.acquire_async('host', 'sid'))
+        waiting = asyncio.ensure_future(limiter.acquire_async('host', 'sid'))
+        await asyncio.sleep(0.05)
+        cancelled.cancel()
+        first.release()
+        (await asyncio.wait_for(waiting, 5)).release()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+    asyncio.run(run())
+    assert limiter.stats()['session:sid']['in_flight'] == 0
+
+
+def test_pause():
+    limiter = _unlimited(rate=100)
+    limiter.pause('host', 'sid', seconds=0.2)
+
+    assert limiter.acquire('host', 'sid').wait >= 0.15
+    assert limiter.acquire('host').wait < 0.05
+    assert limiter.stats()['session:sid']['throttled'] == 1
+
+
+def test_limits_are_shared_through_lock_dir(tmp_path):
+    # two limiters on one lock_dir stand in for two processes
+    first, second = (_unlimited(host_rate=10, host_concurrency=1, lock_dir=str(tmp_path)) for _ in range(2))
+    permit = first.acquire('host')
+    acquired = threading.Event()
+
+    def acquire():
+        second.acquire('host').release()
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not acquired.wait(0.1)
+    permit.release()
+    assert acquired.wait(5)
+    thread.join()
+    # the second limiter took the token after the first one's
+    start = time.monotonic()
+    first.acquire('host').release()
+    assert time.monotonic() - start >= 0.05
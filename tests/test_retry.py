@@ -0,0 +1,120 @@
+import http.server
+import socket
+import threading
+import time
+import pytest
+from GISAIDpy import SessionExpiredError, download
+from GISAIDpy.client import GISAIDClient
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # answers /<status> with that status, /slow after a pause longer than the test read timeout
+    hits = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        type(self).hits += 1
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = self.path.strip('/')
+        if path == 'slow':
+            time.sleep(0.3)
+            path = '200'
+        self.send_response(int(path))
+        if self.headers.get('X-Retry-After') is not None:
+            self.send_header('Retry-After', self.headers['X-Retry-After'])
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_GET = do_POST = _handle
+
+
+@pytest.fixture
+def http_server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    _Handler.hits = 0
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client():
+    client = GISAIDClient(timeout=(1, 0.1), retries=2, backoff_factor=0.01, limiter=False)
+    yield client
+    client.close()
+
+
+@pytest.mark.parametrize('path, status', [('500', 500), ('502', 502), ('429', 429)])
+def test_get_retries_server_errors(http_server, client, path, status):
+    assert client.get(f"{http_server}/{path}").status_code == status
+    assert _Handler.hits == 3
+
+
+def test_get_retries_read_timeouts(http_server, client):
+    with pytest.raises(Exception):
+        client.get(f"{http_server}/slow")
+    assert _Handler.hits == 3
+
+
+@pytest.mark.parametrize('path', ['500', '429'])
+def test_post_is_not_retried_after_it_reached_the_server(http_server, client, path):
+    assert client.post(f"{http_server}/{path}").status_code == int(path)
+    assert _Handler.hits == 1
+
+
+def test_post_is_not_retried_after_a_read_timeout(http_server, client):
+    with pytest.raises(Exception):
+        client.post(f"{http_server}/slow")
+    assert _Handler.hits == 1
+
+
+@pytest.mark.parametrize('path', ['503', '429'])
+def test_post_is_retried_when_turned_away_with_retry_after(http_server, client, path):
+    response = client.post(f"{http_server}/{path}", headers={'X-Retry-After': '0'})
+    assert response.status_code == int(path)
+    assert _Handler.hits == 3
+
+
+def test_idempotent_post_is_retried(http_server, client):
+    assert client.post(f"{http_server}/500", idempotent=True).status_code == 500
+    assert _Handler.hits == 3
+
+
+def test_post_is_retried_when_the_connection_is_refused(client, monkeypatch):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    attempts = []
+    send = client.session.request
+
+    def counting_send(*args, **kwargs):
+        attempts.append(args)
+        return send(*args, **kwargs)
+    monkeypatch.setattr(client.session, 'request', counting_send)
+
+    with pytest.raises(Exception):
+        client.post(f"http://127.0.0.1:{port}/")
+    assert len(attempts) == 3
+
+
+def test_stale_panels_are_reopened(server, credentials):
+    download(credentials, ['EPI_ISL_1'])
+    server.close_panels(credentials['sid'])
+    server.reset_counts()
+
+    assert download(credentials, ['EPI_ISL_2'])['accession_id'].to_list() == ['EPI_ISL_2']
+    counts = server.stats()['counts']
+    assert counts['unknown_panel'] == 1
+    assert counts['cmd:Download'] == 1
+
+
+def test_expired_session_is_not_retried(server, credentials):
+    server.expire_session(credentials['sid'])
+
+    with pytest.raises(SessionExpiredError):
+        download(credentials, ['EPI_ISL_1'])
+    assert server.stats()['counts']['http:POST'] == 1
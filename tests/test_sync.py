@@ -0,0 +1,26 @@
+from GISAIDpy import Query, count_query, scan_synced
+from GISAIDpy.sync import load_manifest, sync
+
+
+def test_sync_downloads_only_new_records(server, credentials, tmp_path):
+    output_dir = str(tmp_path)
+    count_query(credentials, Query().location('Europe'))
+    first = sync(credentials, output_dir, batch_size=10)
+    assert first.height == 17
+    assert first['strain'].str.contains('/Europe/').all()
+
+    # listing the accession IDs resets the search
+    server.reset_counts()
+    count_query(credentials, Query().location('Europe'))
+    assert sync(credentials, output_dir).height == 0
+    # the ID list is downloaded, the records are not
+    assert 'cmd:DownloadReminder' not in server.stats()['counts']
+
+    count_query(credentials, Query().location('Asia'))
+    assert sync(credentials, output_dir).height == 17
+
+    assert scan_synced(output_dir).collect().height == 34
+    seen, state = load_manifest(output_dir)
+    assert seen.height == 34
+    assert state['runs'] == 3
+    assert state['last_new'] == 17
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from GISAIDpy import download, tracing
+from GISAIDpy.tracing import SpanRecorder, add_hook, record, remove_hook, span, traced
+
+
+@pytest.fixture
+def recorder():
+    recorder = SpanRecorder()
+    add_hook(recorder)
+    yield recorder
+    remove_hook(recorder)
+
+
+def test_no_hooks_no_spans():
+    with span('idle') as s:
+        record(requests=1)
+    assert s is None
+    assert not tracing.enabled()
+
+
+def test_counters_roll_up(recorder):
+    with span('outer', job='a') as outer:
+        with span('inner'):
+            record(requests=2, bytes_sent=10, commands=['Download'])
+        record(polls=1)
+
+    inner = recorder.spans[0]
+    assert [s.name for s in recorder.spans] == ['inner', 'outer']
+    assert inner.path == 'outer/inner'
+    assert (inner.requests, inner.bytes_sent, inner.polls) == (2, 10, 0)
+    assert (outer.requests, outer.polls, outer.commands) == (2, 1, ['Download'])
+    assert outer.to_dict()['attributes'] == {'job': 'a'}
+
+
+def test_errors_and_failing_hooks(recorder):
+    def failing_hook(span):
+        raise RuntimeError('hook')
+
+    add_hook(failing_hook)
+    try:
+        with pytest.raises(ValueError):
+            with span('step'):
+                raise ValueError('bad')
+    finally:
+        remove_hook(failing_hook)
+    assert recorder.spans[-1].error == 'ValueError: bad'
+
+
+def test_traced(recorder):
+    @traced('sync_step')
+    def sync_step():
+        return tracing.current_span().name
+
+    @traced('async_step')
+    async def async_step():
+        return tracing.current_span().name
+
+    assert sync_step() == 'sync_step'
+    assert asyncio.run(async_step()) == 'async_step'
+    assert [s.name for s in recorder.spans] == ['sync_step', 'async_step']
+
+
+def test_recorder_keeps_the_latest_spans():
+    recorder = SpanRecorder(max_spans=2)
+    for name in 'abc':
+        recorder(name)
+    assert list(recorder.spans) == ['b', 'c']
+
+    recorder = SpanRecorder(max_spans=0)
+    recorder('a')
+    assert list(recorder.spans) == []
+
+
+def test_download_is_traced(recorder, credentials):
+    download(credentials, ['EPI_ISL_1', 'EPI_ISL_2'])
+
+    top = recorder.spans[-1]
+    assert top.name == 'download'
+    assert top.parent is None
+    assert top.requests > 0 and top.bytes_received > 0
+    assert top.commands.count('Download') == 1
+    assert 'DownloadReminder' in top.commands
+    assert {'select_entries', 'wait_for_async', 'process_download'} <= {s.name for s in recorder.spans}